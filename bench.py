@@ -0,0 +1,994 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`bench.py` times the parts of the bot that should not slow down as the quotes (and their history) grow.
+
+Run everything with `python bench.py`, or just some of it with `python bench.py draw_history ...`.
+Add `--json results.json` to keep the results (and which commit they are for), to compare against another commit.
+
+Quote files are made up, modelled on the real QUOTE_FILE_PATH, see `synthetic_quote_dicts()`.
+Refreshes are against a local stand-in for QUOTE_FILE_ADDRESS, see `QuoteFileStandIn`, so no network is needed.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import itertools
+import json
+import logging
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import tomllib
+import tracemalloc
+from collections import Counter
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Self
+
+import tomli_w
+from aiohttp import web
+
+import bot
+import logs
+import metrics
+import quotes
+from bot import LUCKY_COLOUR_LAG, REFRESH_LEAD, ChannelConfig, daily_jobs
+from duplicates import DuplicateIndex
+from quotes import (
+    DISCORD_MESSAGE_LENGTH_LIMIT,
+    QUOTE_FILE_PATH,
+    QUOTE_REPEAT_DELAY,
+    QUOTE_VALIDATOR,
+    AliasTable,
+    Quote,
+    QuoteDiff,
+    QuoteRenders,
+    QuoteStore,
+    SubmitterBalance,
+    as_quotes,
+    parse_quotes,
+    pull_random_quote,
+    refresh_quotes,
+    render_quote,
+)
+from schedule import Job, Scheduler
+from search import PrefixIndex, SearchIndex, words
+from snapshot import content_digest
+from startup import IMPORT_BUDGETS, import_times
+from state import QuoteState
+
+BENCHMARKS: dict[str, Callable[[], dict[str, Any]]] = {}
+"Every benchmark we have, by name."
+
+
+def benchmark(bench: Callable[[], dict[str, Any]]) -> Callable[[], dict[str, Any]]:
+    """Registers a benchmark under its name, without the `bench_` prefix."""
+    BENCHMARKS[bench.__name__.removeprefix("bench_")] = bench
+    return bench
+
+
+def per_call(call: Callable[[], Any], n: int = 200) -> float:
+    """
+    Times a call n times.
+
+    :returns: The median time of a single call, in microseconds.
+    :rtype: float
+    """
+    times = []
+    for _ in range(n):
+        start = time.perf_counter_ns()
+        call()
+        times.append(time.perf_counter_ns() - start)
+    return statistics.median(times) / 1000
+
+
+@functools.cache
+def real_quotes() -> tuple[Quote, ...]:
+    """The quotes in QUOTE_FILE_PATH, which the made-up ones are modelled on."""
+    real, _, _ = QUOTE_VALIDATOR.validate(tomllib.loads(QUOTE_FILE_PATH.read_text(encoding="utf8")))
+    return tuple(real.values()) or (Quote("Someone", "Something worth saying."),)
+
+
+def synthetic_quote_dicts(n: int, dud_rate: float = 0.005, seed: int = 0) -> dict[str, Any]:
+    """
+    A parsed document of n made-up quotes, about dud_rate of which are not quite right.
+
+    Each is modelled on one of `real_quotes()`: the same submitter and fields, with as much text, from the same words.
+    So the lengths, the submitters, and how many have an attribution or source, all follow the real file.
+    """
+    rng = random.Random(seed)
+    models = real_quotes()
+    words = [word for model in models for word in model.quote.split()]
+    document = {}
+    for i in range(n):
+        model = rng.choice(models)
+        text = []
+        while len(text) < len(model.quote) // 6 + 1:  # Our words average about six characters, space included
+            text.append(rng.choice(words))
+        quote: dict[str, Any] = {"submitter": model.submitter, "quote": " ".join(text)}
+        if model.attribution is not None:
+            quote["attribution"] = model.attribution
+        if model.source is not None:
+            quote["source"] = f"https://example.com/{i}"
+        if model.embed:
+            quote["embed"] = True
+        if rng.random() < dud_rate:
+            quote[rng.choice(["embed", "colour"])] = 42
+        document[f"synthetic-{i}"] = quote
+    return document
+
+
+def synthetic_quotes_toml(n: int, dud_rate: float = 0.005, seed: int = 0) -> str:
+    """A quote file of n made-up quotes, see `synthetic_quote_dicts()`."""
+    return tomli_w.dumps(synthetic_quote_dicts(n, dud_rate, seed))
+
+
+def forget_quotes() -> None:
+    """Drops everything `quotes.py` keeps between calls, as if we had just started."""
+    quotes._current_quotes = quotes._submitter_stats = quotes._quote_renders = None  # noqa: SLF001
+    quotes._duplicate_index = quotes._revalidated_at = quotes._revalidation = None  # noqa: SLF001
+    quotes._search_index = quotes._prefix_index = None  # noqa: SLF001
+    quotes._repo_breaker = quotes.CircuitBreaker()  # noqa: SLF001
+
+
+@contextlib.contextmanager
+def isolated_quotes(directory: Path) -> Iterator[None]:
+    """Points `quotes.py` at files in directory, starting with no quotes loaded, then puts everything back."""
+    paths = [name for name in dir(quotes) if name.startswith("QUOTE_") and name.endswith("_PATH")]
+    saved = {name: getattr(quotes, name) for name in (*paths, "QUOTE_FILE_ADDRESS")}
+    for name in paths:
+        setattr(quotes, name, directory / saved[name].name)
+    forget_quotes()
+    quotes.quote_state.cache_clear()
+    try:
+        yield
+    finally:
+        if quotes.quote_state.cache_info().currsize:
+            quotes.quote_state().close()
+        quotes.quote_state.cache_clear()
+        forget_quotes()
+        for name, value in saved.items():
+            setattr(quotes, name, value)
+
+
+class QuoteFileStandIn:
+    """
+    A local stand-in for QUOTE_FILE_ADDRESS, serving whatever text it is given, and a 304 if it has not changed.
+
+    It can be made slow, or to fail, to see how we cope when GitHub does.
+    """
+
+    def __init__(self, text: str) -> None:
+        """Serve the given text, once started."""
+        self.text = text
+        "What we serve, change it to change the quotes."
+        self.address = ""
+        "Where we are serving it, once started."
+        self.requests = 0
+        "How many GETs we have answered."
+        self.sent = 0
+        "How many bytes of quotes we have sent, over every GET."
+        self.conditional = True
+        "Whether we answer a GET for what we already sent with a 304, as GitHub does, rather than sending it again."
+        self.delay = 0.0
+        "How long (in seconds) we wait before answering."
+        self.status: int | None = None
+        "The (error) status we answer with instead, if any."
+        self._runner: web.AppRunner | None = None
+
+    async def _get(self, request: web.Request) -> web.Response:
+        """Answer a (conditional) GET, as GitHub would."""
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        if self.status is not None:
+            return web.Response(status=self.status)
+        etag = f'"{content_digest(self.text).hex()}"'
+        if self.conditional and request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        self.sent += len(self.text.encode("utf8"))
+        return web.Response(text=self.text, headers={"ETag": etag})
+
+    async def __aenter__(self) -> Self:
+        """Start serving, on any free local port."""
+        app = web.Application()
+        app.router.add_get("/quotes.toml", self._get)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        host, port = self._runner.addresses[0][:2]
+        self.address = f"http://{host}:{port}/quotes.toml"
+        return self
+
+    async def __aexit__(self, *_: object) -> None:
+        """Stop serving."""
+        await self._runner.cleanup()
+
+
+def legacy_quote_compliant(quote: dict) -> bool:  # noqa: C901 - kept as it was, to time against
+    """
+    Checks whether a dict would make a valid Quote, as `quote_compliant()` did before `QUOTE_VALIDATOR`.
+
+    :returns: Is quote a valid Quote?
+    :rtype: bool
+    """
+    logger = logging.getLogger("quote_compliant")
+    annos = Quote.__annotations__
+    "Type annotations for Quote, {field: [types]} map."
+    required_fields = {field for field in annos if field not in Quote._field_defaults}
+    "Necessary fields that must be supplied for a Quote."
+    match quote:
+        case dict(quote):
+            well_formed_quote = True
+            """Whether the quote is good to go."""
+
+            for field in required_fields:
+                if field not in quote:
+                    logger.error(f"Missing '{field}' field from quote {quote}")
+                    well_formed_quote = False
+
+            for key, val in quote.items():
+                match key, val:
+                    case "submitter" | "quote", str():
+                        logger.debug(f"Field {key} = {val} (str)")
+                    case "attribution" | "source", str() | None:
+                        logger.debug(f"Field {key} = {val} ({type(val)})")
+                    case "embed", bool():
+                        logger.debug(f"Field {key} = {val} (bool)")
+                    case "submitter" | "quote" | "attribution" | "source" | "embed", _:
+                        logger.error(f"Field {key} is an incorrect type, must be {annos[key]}, was {type(val)}({val})")
+                        well_formed_quote = False
+                    case _, _:
+                        logger.error(f"{key} is not valid field for Quote, must be one of {', '.join(annos)}")
+                        well_formed_quote = False
+
+            if len(quote["quote"]) > DISCORD_MESSAGE_LENGTH_LIMIT:
+                logger.error(
+                    f"Quote is too long, must be less than 4000 bytes (UTF-8), but is {len(quote['quote'])} bytes long"
+                )
+                well_formed_quote = False
+
+            return well_formed_quote
+        case _:
+            logger.error(f"Quote must be a dictionary, was {type(quote)}({quote})")
+            return False
+
+
+@benchmark
+def bench_draw_history() -> dict[str, Any]:
+    """Per-draw cost of the deck and history, as the history grows."""
+    results = {}
+    ids = [f"quote-{i}" for i in range(10_000)]
+    for history_length in (1_000, 100_000, 1_000_000):
+        with tempfile.TemporaryDirectory() as tmp:
+            state = QuoteState(Path(tmp) / "quote_state.sqlite3")
+            state.deal(ids)
+            with sqlite3.connect(Path(tmp) / "quote_state.sqlite3") as db:
+                db.executemany(
+                    "INSERT INTO history (quote_id) VALUES (?)", ((ids[i % len(ids)],) for i in range(history_length))
+                )
+
+            def draw(state: QuoteState = state) -> None:
+                """Check the recent history, then draw the next quote that is not recent."""
+                rs = set(state.recent(QUOTE_REPEAT_DELAY))
+                state.draw(lambda k: k not in rs)
+
+            results[history_length] = {"draw_us": per_call(draw)}
+            state.close()
+    return results
+
+
+@benchmark
+def bench_weighted_draw() -> dict[str, Any]:
+    """Per-draw cost of a weighted draw, from an alias table versus rebuilding the weights for `random.choices`."""
+    results = {}
+    policy = SubmitterBalance()
+    for n in (1_000, 10_000, 100_000):
+        quotes = QuoteStore((f"quote-{i}", Quote(f"submitter-{random.randrange(n // 10)}", "...")) for i in range(n))
+        with tempfile.TemporaryDirectory() as tmp:
+            state = QuoteState(Path(tmp) / "quote_state.sqlite3")
+            ids = list(quotes)
+
+            def choices(quotes: QuoteStore = quotes, state: QuoteState = state, ids: list[str] = ids) -> None:
+                """Work out every weight, then draw one quote with them."""
+                random.choices(ids, weights=policy.weights(quotes, state))
+
+            build = per_call(lambda quotes=quotes, state=state: AliasTable(policy.weights(quotes, state)), n=20)
+            table = AliasTable(policy.weights(quotes, state))
+            results[n] = {
+                "alias_build_us": build,
+                "alias_draw_us": per_call(
+                    lambda table=table, quotes=quotes: quotes.identifier(table.sample() + 1), n=10_000
+                ),
+                "choices_draw_us": per_call(choices, n=20),
+            }
+            state.close()
+    return results
+
+
+@benchmark
+def bench_validate() -> dict[str, Any]:
+    """Validating a whole parsed document, with `QUOTE_VALIDATOR` versus the old `quote_compliant()`."""
+    results = {}
+    logging.disable(logging.CRITICAL)  # Neither should be timed on how fast we can print the duds
+    try:
+        for n in (600, 10_000, 100_000):
+            document = synthetic_quote_dicts(n)
+
+            def legacy(document: dict[str, Any] = document) -> None:
+                """Check each quote in turn, as `as_quotes()` used to."""
+                for q in document.values():
+                    if legacy_quote_compliant(q):
+                        Quote(**q)
+
+            runs = 5 if n > 10_000 else 20
+            results[n] = {
+                "legacy_us": per_call(legacy, n=runs),
+                "validator_us": per_call(lambda document=document: QUOTE_VALIDATOR.validate(document), n=runs),
+            }
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+@benchmark
+def bench_parse() -> dict[str, Any]:
+    """Parsing a whole quote file, with `as_quotes()` versus `parse_quotes()` in this process and across all cores."""
+    results = {}
+    logger = logging.getLogger("bench_parse")
+    logging.disable(logging.CRITICAL)
+    try:
+        for n in (1_000, 10_000, 100_000):
+            text = synthetic_quotes_toml(n)
+            start = time.perf_counter()
+            as_quotes(text, logger)
+            results[n] = {"as_quotes_s": time.perf_counter() - start}
+            for name, workers in (("inline", 0), ("parallel", None)):
+                start = time.perf_counter()
+                parse_quotes(text, logger, workers)
+                results[n][f"{name}_s"] = time.perf_counter() - start
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+@benchmark
+def bench_logging() -> dict[str, Any]:
+    """Per-call latency of logging a line, writing to the files directly versus queued for a background thread."""
+    results = {}
+    root = logging.getLogger()
+    for name, queued in (("direct", False), ("queued", True)):
+        with tempfile.TemporaryDirectory() as tmp, contextlib.chdir(tmp):
+            logs.init(debug=False, queued=queued)
+            logger = logging.getLogger(f"bench_logging.{name}")  # A new logger, so dictConfig has not disabled it
+            line = "+ [some-quote] Someone; Somewhere: " + "Something worth saying. " * 4
+            start = time.perf_counter()
+            median = per_call(lambda logger=logger, line=line: logger.info(line), n=20_000)
+            mean = (time.perf_counter() - start) / 20_000 * 1e6
+            logs.stop()  # Until the queue is drained, the background thread is still writing
+            results[name] = {"info_median_us": median, "info_mean_us": mean, "drained_s": time.perf_counter() - start}
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+                handler.close()
+    return results
+
+
+@benchmark
+def bench_render() -> dict[str, Any]:
+    """Per-send cost of getting a quote ready, rendered from scratch versus kept from the first time it was sent."""
+    results = {}
+    for n in (1_000, 10_000, 100_000):
+        store = QuoteStore((k, Quote(**q)) for k, q in synthetic_quote_dicts(n, dud_rate=0).items())
+        renders = QuoteRenders()
+        sample = random.sample(list(store.values()), 1_000)
+        start = time.perf_counter()
+        firsts = [renders.get(q) for q in sample]
+        first = (time.perf_counter() - start) / len(sample)
+        kept = all(renders.get(q) is rendered for q, rendered in zip(sample, firsts, strict=True))
+        if not kept or firsts != [render_quote(q) for q in sample]:
+            msg = f"QuoteRenders differs from render_quote, or did not keep its renders, at {n} quotes"
+            raise AssertionError(msg)
+        picks = itertools.cycle(sample)
+        results[n] = {
+            "first_us": first * 1e6,
+            "scratch_us": per_call(lambda picks=picks: render_quote(next(picks)), n=10_000),
+            "cached_us": per_call(lambda picks=picks, renders=renders: renders.get(next(picks)), n=10_000),
+        }
+    return results
+
+
+@benchmark
+def bench_metrics() -> dict[str, Any]:
+    """The cost of timing a call, for a call that does nothing, plain versus `timed()` versus `timer()`."""
+
+    def nothing() -> None:
+        """As cheap a call as we can make."""
+
+    timed = metrics.timed("bench_metrics")(nothing)
+
+    def with_timer() -> None:
+        """Time nothing in a block."""
+        with metrics.timer("bench_metrics"):
+            nothing()
+
+    results = {
+        "plain_us": per_call(nothing, n=100_000),
+        "timed_us": per_call(timed, n=100_000),
+        "timer_us": per_call(with_timer, n=100_000),
+        "export_us": per_call(metrics.prometheus_text, n=1_000),
+    }
+
+    def add_metrics(thread: int) -> None:
+        """Keep making new counters and histograms, as worker threads do, while we export."""
+        for i in range(200):
+            metrics.count(f"bench_metrics_{thread}_{i}")
+            with metrics.timer(f"bench_metrics_{thread}_{i}"):
+                time.sleep(0.001)
+
+    with ThreadPoolExecutor(4) as pool:
+        adding = [pool.submit(add_metrics, thread) for thread in range(4)]
+        exports = 0
+        while not all(future.done() for future in adding):
+            metrics.prometheus_text()  # Raises if it reads a dict that is changing size
+            exports += 1
+        for future in adding:
+            future.result()
+    results["concurrent_exports"] = exports
+    return results
+
+
+@benchmark
+def bench_search() -> dict[str, Any]:
+    """Per-search cost of a rare and a common word, from the index versus scanning every quote for them."""
+    results = {}
+    for n in (1_000, 10_000, 100_000):
+        store = QuoteStore((k, Quote(**q)) for k, q in synthetic_quote_dicts(n, dud_rate=0).items())
+        start = time.perf_counter()
+        index = SearchIndex(store)
+        results[n] = {"build_s": time.perf_counter() - start}
+        by_quotes = Counter(word for quote in store.values() for word in set(words(quote.quote)))
+        (common, _), *_, (rare, _) = by_quotes.most_common()
+        for name, query in (("rare", rare), ("common", common)):
+
+            def scan(query: str = query, store: QuoteStore = store) -> list[str]:
+                """Look through every quote for the words, as we would without an index."""
+                wanted = words(query)
+                return [
+                    k
+                    for k, q in store.items()
+                    if all(w in words(f"{q.quote} {q.attribution} {q.submitter}") for w in wanted)
+                ]
+
+            found = {r.identifier for r in index.search(query, limit=n)}
+            if found != set(scan()):
+                msg = f"The index and a scan disagree on '{query}' at {n} quotes"
+                raise AssertionError(msg)
+            index.search(query)  # Sorted on first use after any change, then kept
+            results[n][f"{name}_index_us"] = per_call(lambda query=query, index=index: index.search(query), n=1_000)
+            results[n][f"{name}_scan_us"] = per_call(scan, n=3)
+    return results
+
+
+@benchmark
+def bench_autocomplete() -> dict[str, Any]:
+    """Per-keystroke cost of suggesting quotes for a slash command, as an ID is typed out."""
+    results = {}
+    for n in (1_000, 10_000, 100_000):
+        store = QuoteStore((k, Quote(**q)) for k, q in synthetic_quote_dicts(n, dud_rate=0).items())
+        start = time.perf_counter()
+        index = PrefixIndex(store)
+        results[n] = {"build_s": time.perf_counter() - start}
+        target = store.identifier(n // 2)
+        typed = itertools.cycle([target[:i] for i in range(len(target) + 1)])
+        if target not in index.complete(target):
+            msg = f"Typing out {target} did not suggest it at {n} quotes"
+            raise AssertionError(msg)
+        results[n]["keystroke_us"] = per_call(lambda typed=typed, index=index: index.complete(next(typed)), n=10_000)
+    return results
+
+
+def paraphrase(quote: Quote, rng: random.Random, vocabulary: list[str]) -> tuple[str, Quote]:
+    """
+    Submits a quote again, as someone might: with different punctuation and case, or a word or two changed.
+
+    :returns: Which way it was changed, and the changed quote.
+    :rtype: tuple[str, Quote]
+    """
+    text = quote.quote.split()
+    kind = rng.choice(["punctuation", "one_word", "two_words", "dropped_word"])
+    match kind:
+        case "punctuation":
+            text = [word.upper() if rng.random() < 0.2 else word for word in text]
+            text[-1] += rng.choice(["!", "?", "...", "!!"])
+            text[0] = f'"{text[0]}'
+        case "one_word" | "two_words":
+            for i in rng.sample(range(len(text)), min(len(text), 1 if kind == "one_word" else 2)):
+                text[i] = rng.choice(vocabulary)
+        case "dropped_word":
+            del text[rng.randrange(len(text))]
+    return kind, quote._replace(quote=" ".join(text) or quote.quote)
+
+
+def resubmissions(
+    store: QuoteStore, rng: random.Random, every: int = 1
+) -> tuple[dict[str, tuple[str, str, Quote]], dict[str, Quote]]:
+    """
+    Submits every so many of the quotes again, see `paraphrase()`, with as many unrelated new quotes.
+
+    Short quotes have so few shingles that changing a word makes them a different quote, so we only resubmit
+    quotes of a sentence or more.
+    :returns: Each resubmitted quote, with the quote it was and which way it was changed, then the unrelated quotes.
+    :rtype: tuple[dict[str, tuple[str, str, Quote]], dict[str, Quote]]
+    """
+    vocabulary = [word for quote in itertools.islice(store.values(), 1_000) for word in quote.quote.split()]
+    originals = [k for k in itertools.islice(store, 0, len(store), every) if len(store[k].quote) >= 40]
+    resubmitted = {f"again-{k}": (k, *paraphrase(store[k], rng, vocabulary)) for k in originals}
+    unrelated = {
+        f"unrelated-{k}": Quote(**q) for k, q in synthetic_quote_dicts(len(resubmitted), dud_rate=0, seed=1).items()
+    }
+    return resubmitted, unrelated
+
+
+@benchmark
+def bench_duplicates() -> dict[str, Any]:
+    """
+    How many resubmitted (paraphrased) quotes a refresh spots as duplicates, and what checking each addition costs.
+
+    Unrelated new quotes are added too, to count how many are wrongly called duplicates.
+    """
+    results = {}
+    rng = random.Random(0)
+    for n in (1_000, 10_000, 100_000):
+        store = QuoteStore((k, Quote(**q)) for k, q in synthetic_quote_dicts(n, dud_rate=0).items())
+        start = time.perf_counter()
+        index = DuplicateIndex(store)
+        results[n] = {"build_s": time.perf_counter() - start}
+        resubmitted, unrelated = resubmissions(store, rng, every=max(n // 500, 1))
+        additions = [(k, q) for k, (_, _, q) in resubmitted.items()] + list(unrelated.items())
+        updated = {**store, **dict(additions)}
+        start = time.perf_counter()
+        found = index.apply(QuoteDiff(additions, [], []), updated)
+        results[n]["per_addition_us"] = (time.perf_counter() - start) * 1e6 / len(additions)
+        spotted = {(k, duplicate_of) for k, duplicate_of, _ in found}
+        by_kind: dict[str, list[bool]] = {}
+        for k, (original, kind, _) in resubmitted.items():
+            by_kind.setdefault(kind, []).append((k, original) in spotted)
+        for kind, hits in sorted(by_kind.items()):
+            results[n][f"{kind}_recall"] = sum(hits) / len(hits)
+        results[n]["recall"] = sum(map(sum, by_kind.values())) / len(resubmitted)
+        results[n]["false_positives"] = sum(k in unrelated for k, _ in spotted) / len(unrelated)
+    return results
+
+
+@benchmark
+def bench_fan_out() -> dict[str, Any]:
+    """Posting to many channels at once from one copy of the quotes, each post drawing then waiting on Discord."""
+    results = {}
+    corpus = QuoteStore((f"quote-{i}", Quote(f"submitter-{i % 50}", f"Quote number {i}.")) for i in range(1_000))
+    for channels in (1, 10, 100, 1_000):
+        with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+            state = quotes.quote_state()
+            latencies = []
+
+            async def post(channel: int, latencies: list[float] = latencies) -> None:
+                """Draw the channel's quote, then wait about as long as Discord takes to answer."""
+                start = time.perf_counter()
+                await asyncio.to_thread(pull_random_quote, corpus, channel)
+                await asyncio.sleep(0.05)
+                latencies.append(time.perf_counter() - start)
+
+            at = datetime.now(UTC).time()
+            jobs = [Job(f"quote:{c}", at, functools.partial(post, c), group=c) for c in range(channels)]
+            state.set_last_runs({job.name: datetime.now(UTC) - timedelta(days=1) for job in jobs})
+            for c in range(channels):  # As on any day but the first, every channel already has a deck
+                state.deal(corpus, c)
+            tracemalloc.start()
+            start = time.perf_counter()
+            asyncio.run(Scheduler(state, jobs).run_due(datetime.now(UTC)))
+            wall = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if len(latencies) != channels:
+                msg = f"Only {len(latencies)} of {channels} channels were posted to"
+                raise AssertionError(msg)
+            latencies.sort()
+            results[channels] = {
+                "wall_s": wall,
+                "post_p50_ms": latencies[len(latencies) // 2] * 1000,
+                "post_p99_ms": latencies[len(latencies) * 99 // 100] * 1000,
+                "peak_kib": peak / 1024,
+            }
+    return results
+
+
+def lag_after_post(job: Job, config: ChannelConfig) -> timedelta:
+    """How long after the channel's posting time the job runs, going around midnight if need be."""
+    day = date.min
+    return (datetime.combine(day, job.at) - datetime.combine(day, config.quote_at)) % timedelta(days=1)
+
+
+@benchmark
+def bench_daily_jobs() -> dict[str, Any]:
+    """Working out each day's jobs for many channels, posting from midnight to a second before, without running them."""
+    results = {}
+    for channels in (1, 100, 1_000):
+        configs = {}
+        for c in range(channels):
+            at = (datetime(2000, 1, 1, tzinfo=UTC) + timedelta(seconds=c * 86_399 // max(channels - 1, 1))).time()
+            configs[c] = ChannelConfig(c, at, lucky_role=c, duds=c == 0)
+        jobs = {job.name: job for job in daily_jobs(configs)}
+        for c, config in configs.items():
+            for name, lag in (
+                (f"refresh@{config.quote_at.isoformat()}", -REFRESH_LEAD),
+                (f"lucky_colour:{c}", LUCKY_COLOUR_LAG),
+            ):
+                if lag_after_post(jobs[name], config) != lag % timedelta(days=1):
+                    msg = f"{name} is at {jobs[name].at}, not {lag} from {config.quote_at}"
+                    raise AssertionError(msg)
+        results[channels] = {"daily_jobs_us": per_call(lambda configs=configs: daily_jobs(configs), n=20)}
+    with tempfile.TemporaryDirectory() as tmp:
+        saved, bot.CHANNELS_FILE = bot.CHANNELS_FILE, Path(tmp) / "channels.toml"
+        bot.CHANNELS_FILE.write_text("")
+        try:
+            bot.load_channels()
+        except ValueError:
+            pass
+        else:
+            msg = "No channels to serve was not an error"
+            raise AssertionError(msg)
+        finally:
+            bot.CHANNELS_FILE = saved
+    return results
+
+
+@benchmark
+def bench_select() -> dict[str, Any]:
+    """Per-draw cost of `pull_random_quote()`, deck and history included, as the quotes grow."""
+    results = {}
+    logger = logging.getLogger("bench_select")
+    for n in (1_000, 10_000, 100_000):
+        store, _ = parse_quotes(synthetic_quotes_toml(n, dud_rate=0), logger, 0)
+        with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+            start = time.perf_counter()
+            pull_random_quote(store)  # Which has to deal the deck first
+            first = time.perf_counter() - start
+            draw = per_call(lambda store=store: pull_random_quote(store))
+            results[n] = {"first_draw_ms": first * 1000, "draw_us": draw}
+    return results
+
+
+@benchmark
+def bench_diff() -> dict[str, Any]:
+    """Diffing the quotes we have (mapped from the snapshot) against an edit: one added, one removed, one changed."""
+    results = {}
+    logger = logging.getLogger("bench_diff")
+    logging.disable(logging.CRITICAL)
+    try:
+        for n in (1_000, 10_000, 100_000):
+            document = synthetic_quote_dicts(n)
+            edited = {"added": document.pop("synthetic-0"), **document}
+            edited["synthetic-1"] = {**edited["synthetic-1"], "quote": "Something else entirely."}
+            del edited["synthetic-2"]
+            with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+                quotes.QUOTE_FILE_PATH.write_text(tomli_w.dumps({"synthetic-0": edited["added"], **document}))
+                quotes.pull_quotes_from_file()  # Writes the snapshot we then map
+                old, _ = quotes.pull_quotes_from_file()
+                new, _ = as_quotes(tomli_w.dumps(edited), logger, old)
+                start = time.perf_counter()
+                diff = quotes.diff_quotes(old, new)
+                results[n] = {"diff_ms": (time.perf_counter() - start) * 1000}
+                expected = QuoteDiff(
+                    [(k, new[k]) for k in new if k not in old],
+                    [(k, old[k]) for k in old if k not in new],
+                    [(k, new[k], old[k]) for k in new if k in old and new[k] != old[k]],
+                )
+                if diff != expected:
+                    msg = f"Diffing {n} quotes gave {diff}, not {expected}"
+                    raise AssertionError(msg)
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+def built_from_quotes() -> tuple[Any, ...]:
+    """What `quotes.py` has built from the current quotes so far, each is None until something first needs it."""
+    return quotes._submitter_stats, quotes._search_index, quotes._prefix_index  # noqa: SLF001
+
+
+async def check_indexes(after: str, current: QuoteStore) -> None:
+    """Check the submitter stats and both indexes have every one of the current quotes, building them if need be."""
+    if (counted := (await quotes.submitter_stats()).counts.total()) != len(current):
+        msg = f"{after} left {counted} quotes counted in the SubmitterStats, not {len(current)}"
+        raise AssertionError(msg)
+    for index in (await quotes.search_index(), await quotes.prefix_index()):
+        if len(index) != len(current):
+            msg = f"{after} left {len(index)} quotes in the {type(index).__name__}, not {len(current)}"
+            raise AssertionError(msg)
+
+
+async def time_refreshes(text: str, edited: str) -> dict[str, float]:
+    """
+    Times loading, then refreshing, text from a stand-in repo: as it was, unmodified, then edited and back again.
+
+    :returns: How long each took, in seconds.
+    :rtype: dict[str, float]
+    """
+    timings = {}
+    expected = {served: len(QUOTE_VALIDATOR.validate(tomllib.loads(served))[0]) for served in (text, edited)}
+    async with QuoteFileStandIn(text) as repo:
+        quotes.QUOTE_FILE_ADDRESS = repo.address
+        steps = (("load", text), ("same", text), ("unmodified", text), ("added", edited), ("removed", text))
+        for name, served in steps:
+            repo.text = served
+            start = time.perf_counter()
+            current = await (quotes.current_quotes() if name == "load" else refresh_quotes())
+            timings[f"{name}_s"] = time.perf_counter() - start
+            if len(current) != expected[served]:
+                msg = f"Refreshing ({name}) gave {len(current)} quotes, not {expected[served]}"
+                raise AssertionError(msg)
+            if name == "load" and any(built is not None for built in built_from_quotes()):
+                msg = "Loading the quotes built an index, rather than the first command to use it"
+                raise AssertionError(msg)
+            await check_indexes(f"Refreshing ({name})", current)
+        # Use each index for the first time just as the quotes change, which must still end up with the new quotes
+        quotes._submitter_stats = quotes._search_index = quotes._prefix_index = None  # noqa: SLF001
+        repo.text = edited
+        current, *_ = await asyncio.gather(
+            refresh_quotes(), quotes.submitter_stats(), quotes.search_index(), quotes.prefix_index()
+        )
+        await check_indexes("First using the indexes during a refresh", current)
+        await quotes.close_http_session()
+    return timings
+
+
+@benchmark
+def bench_refresh() -> dict[str, Any]:
+    """A whole `refresh_quotes()` from a local stand-in for the repo, with no change, then a small diff."""
+    results = {}
+    logging.disable(logging.CRITICAL)
+    try:
+        for n in (1_000, 10_000, 100_000):
+            text = synthetic_quotes_toml(n)
+            edited = text + tomli_w.dumps({f"new-{k}": q for k, q in synthetic_quote_dicts(5, 0, seed=n).items()})
+            with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+                quotes.QUOTE_FILE_PATH.write_text(text, encoding="utf8")
+                results[n] = asyncio.run(time_refreshes(text, edited))
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+async def count_transfers(text: str, edited: str) -> dict[str, dict[str, int]]:
+    """
+    Refreshes from the stand-in repo: unmodified (a 304), unmodified but sent again anyway (a 200), then edited.
+
+    :returns: How many bytes each refresh was sent, and how many times it parsed the quotes.
+    :rtype: dict[str, dict[str, int]]
+    """
+    parses, counts = metrics.histogram("as_quotes"), {}
+    async with QuoteFileStandIn(text) as repo:
+        quotes.QUOTE_FILE_ADDRESS = repo.address
+        await refresh_quotes()  # Sends what we already have, so now we know its ETag
+        steps = (("unmodified", text, True), ("resent", text, False), ("edited", edited, True))
+        for name, served, conditional in steps:
+            repo.text, repo.conditional = served, conditional
+            sent, parsed = repo.sent, parses.count
+            await refresh_quotes()
+            counts[name] = {"bytes": repo.sent - sent, "parses": parses.count - parsed}
+        await quotes.close_http_session()
+    return counts
+
+
+@benchmark
+def bench_transfer() -> dict[str, Any]:
+    """What each refresh costs us in bytes and parsing, which should be nothing unless the quotes have changed."""
+    results = {}
+    logging.disable(logging.CRITICAL)
+    try:
+        for n in (1_000, 10_000):
+            text = synthetic_quotes_toml(n)
+            edited = text + tomli_w.dumps({f"new-{k}": q for k, q in synthetic_quote_dicts(1, 0, seed=n).items()})
+            with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+                quotes.QUOTE_FILE_PATH.write_text(text, encoding="utf8")
+                results[n] = asyncio.run(count_transfers(text, edited))
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+@benchmark
+def bench_load() -> dict[str, Any]:
+    """Starting up from a snapshot, which should take about as long, and as much memory, however many quotes we have."""
+    results = {}
+    for n in (1_000, 10_000, 100_000):
+        with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+            quotes.QUOTE_FILE_PATH.write_text(synthetic_quotes_toml(n, dud_rate=0), encoding="utf8")
+            quotes.pull_quotes_from_file()  # Writes the snapshot, as the first start would
+            tracemalloc.start()
+            start = time.perf_counter()
+            asyncio.run(quotes.current_quotes())
+            took = time.perf_counter() - start
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if any(built is not None for built in built_from_quotes()):
+                msg = f"Loading {n} quotes built an index, rather than the first command to use it"
+                raise AssertionError(msg)
+            results[n] = {"load_ms": took * 1000, "retained_kib": retained / 1024, "peak_kib": peak / 1024}
+    return results
+
+
+async def time_burst(text: str, edited: str, commands: int, channels: int) -> dict[str, Any]:
+    """
+    Times a burst of commands, each refreshing then drawing a quote for one of some channels, all at once.
+
+    :returns: How long the burst took, and how many fetches it cost.
+    :rtype: dict[str, Any]
+    """
+    async with QuoteFileStandIn(text) as repo:
+        quotes.QUOTE_FILE_ADDRESS = repo.address
+        await quotes.current_quotes()
+        repo.text, before = edited, repo.requests
+
+        async def command(channel: int) -> None:
+            """Refresh, then draw, as `send_quote()` does."""
+            await asyncio.to_thread(pull_random_quote, await refresh_quotes(), channel)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(command(i % channels) for i in range(commands)))
+        timings = {"burst_s": time.perf_counter() - start, "fetches": repo.requests - before}
+        await quotes.close_http_session()
+    current, state = await quotes.current_quotes(), quotes.quote_state()
+    if (drawn := sum(len(state.recent(commands, channel)) for channel in range(channels))) != commands:
+        msg = f"{commands} commands drew {drawn} quotes"
+        raise AssertionError(msg)
+    if (counted := (await quotes.submitter_stats()).counts.total()) != len(current):
+        msg = f"{len(current)} quotes were counted as {counted}, the refresh was applied more than once"
+        raise AssertionError(msg)
+    return timings
+
+
+@benchmark
+def bench_burst() -> dict[str, Any]:
+    """Many commands at once, just as the quotes change, which should share one refresh and lose no draws."""
+    results = {}
+    logging.disable(logging.CRITICAL)
+    try:
+        text = synthetic_quotes_toml(10_000)
+        edited = text + tomli_w.dumps({f"new-{k}": q for k, q in synthetic_quote_dicts(5, 0, seed=1).items()})
+        for commands in (1, 10, 100):
+            with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+                quotes.QUOTE_FILE_PATH.write_text(text, encoding="utf8")
+                results[commands] = asyncio.run(time_burst(text, edited, commands, channels=10))
+                if results[commands]["fetches"] != 1:
+                    msg = f"{commands} commands at once cost {results[commands]['fetches']} fetches"
+                    raise AssertionError(msg)
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+async def time_commands(text: str, commands: int, interval: float) -> dict[str, Any]:
+    """
+    Times one blocking refresh from the stand-in repo, then a command every interval, as they get their quotes.
+
+    :returns: How long each took, in seconds, and how many times the repo was fetched.
+    :rtype: dict[str, Any]
+    """
+    await quotes.current_quotes()
+    start = time.perf_counter()
+    await refresh_quotes()
+    timings: dict[str, Any] = {"blocking_refresh_s": time.perf_counter() - start}
+    quotes._revalidated_at = None  # noqa: SLF001
+    quotes._repo_breaker = quotes.CircuitBreaker(backoff=0.05, limit=0.2, threshold=3, cooldown=60)  # noqa: SLF001
+    latencies, expected = [], len(QUOTE_VALIDATOR.validate(tomllib.loads(text))[0])
+    for _ in range(commands):
+        start = time.perf_counter()
+        current = await quotes.cached_quotes()
+        latencies.append(time.perf_counter() - start)
+        if len(current) != expected:
+            msg = f"A command was given {len(current)} quotes, not {expected}"
+            raise AssertionError(msg)
+        await asyncio.sleep(interval)
+    if quotes._revalidation is not None:  # noqa: SLF001
+        await quotes._revalidation  # noqa: SLF001
+    timings["command_median_us"] = statistics.median(latencies) * 1e6
+    timings["command_max_us"] = max(latencies) * 1e6
+    timings["circuit_open"] = quotes._repo_breaker.is_open  # noqa: SLF001
+    return timings
+
+
+@benchmark
+def bench_upstream() -> dict[str, Any]:
+    """
+    How long commands wait for their quotes when the repo is healthy, slow, timing out, or erroring.
+
+    Every command wants a refresh (no freshness), and backoff is shortened, to see a lot of refreshes in little time.
+    Commands should take about as long whatever the repo does, and a failing repo should only be tried until the
+    circuit opens, unlike a blocking refresh.
+    """
+    results = {}
+    logging.disable(logging.CRITICAL)
+    saved = quotes.QUOTE_FRESHNESS, quotes.QUOTE_FETCH_TIMEOUT
+    quotes.QUOTE_FRESHNESS, quotes.QUOTE_FETCH_TIMEOUT = 0, 0.5
+    try:
+        text = synthetic_quotes_toml(1_000)
+        conditions = {"healthy": (0.0, None), "slow": (0.2, None), "timing_out": (1.0, None), "erroring": (0.0, 503)}
+        for condition, (delay, status) in conditions.items():
+            with tempfile.TemporaryDirectory() as tmp, isolated_quotes(Path(tmp)):
+                quotes.QUOTE_FILE_PATH.write_text(text, encoding="utf8")
+
+                async def run(delay: float = delay, status: int | None = status) -> dict[str, Any]:
+                    """Serve the quotes as the condition has it, while commands ask for them."""
+                    async with QuoteFileStandIn(text) as repo:
+                        quotes.QUOTE_FILE_ADDRESS, repo.delay, repo.status = repo.address, delay, status
+                        timings = await time_commands(text, commands=100, interval=0.02)
+                        await quotes.close_http_session()
+                    return {**timings, "fetches": repo.requests}
+
+                results[condition] = asyncio.run(run())
+                if results[condition]["command_max_us"] > 50_000:
+                    msg = f"A command waited {results[condition]['command_max_us']:.0f}us ({condition})"
+                    raise AssertionError(msg)
+        if results["erroring"]["fetches"] != 1 + 3 or not results["erroring"]["circuit_open"]:
+            msg = f"An erroring repo was fetched {results['erroring']['fetches']} times, not 1 + 3"
+            raise AssertionError(msg)
+    finally:
+        quotes.QUOTE_FRESHNESS, quotes.QUOTE_FETCH_TIMEOUT = saved
+        logging.disable(logging.NOTSET)
+    return results
+
+
+@benchmark
+def bench_startup() -> dict[str, Any]:
+    """How long importing each of IMPORT_BUDGETS takes, in a fresh interpreter, which must be within budget."""
+    results = {}
+    for module, budget in IMPORT_BUDGETS.items():
+        runs = [import_times(module) for _ in range(5)]
+        took = statistics.median(took for took, _ in runs)
+        slowest = {name: child * 1e3 for name, child in itertools.islice(runs[-1][1], 3)}
+        results[module] = {"import_ms": took * 1e3, "slowest_ms": slowest}
+        if took > budget:
+            msg = f"Importing {module} took {took * 1e3:.0f}ms, over its {budget * 1e3:.0f}ms budget"
+            raise AssertionError(msg)
+    return results
+
+
+def git_version() -> str | None:
+    """Which commit we are benchmarking, marked dirty if it has been changed since."""
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],  # noqa: S607
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    return None
+
+
+def main() -> None:
+    """Run the benchmarks we were asked for, or all of them."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help=f"which to run, of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--json", type=Path, help="where to also write the results, to compare between commits")
+    args = parser.parse_args()
+    if unknown := set(args.benchmarks) - set(BENCHMARKS):
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        results[name] = BENCHMARKS[name]()
+        print(f"{name}: {results[name]}")
+    if args.json is not None:
+        run = {"commit": git_version(), "python": platform.python_version(), "results": results}
+        args.json.write_text(json.dumps(run, indent=2) + "\n", encoding="utf8")
+
+
+if __name__ == "__main__":
+    main()
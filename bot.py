@@ -2,43 +2,59 @@
 A polite little Discord bot that can send out a quote each day.
 
 `bot.py` focuses on the Discord integration only.
+
+Any number of channels (in any number of servers) can be served, each with its own time to post, deck, and history,
+all drawing from the one copy of the quotes, which is refreshed once before each posting time.
 """
 
+import argparse
 import asyncio
 import colorsys
-import contextlib
+import functools
+import io
 import logging
 import random
-import re
 import string
+import sys
+import textwrap
 import tomllib
-from collections import Counter
-from datetime import UTC, datetime
-from operator import attrgetter, itemgetter
+from datetime import UTC, date, datetime, time, timedelta
 from pathlib import Path
-from typing import NoReturn
-import matplotlib.pyplot as plt
+from typing import NamedTuple, NoReturn
 import discord
 
-with contextlib.suppress(ModuleNotFoundError):
-    from ada_url import URL
-
 import logs
+import metrics
+from graphs import authors_graph
 from quotes import (
-    QUOTE_DECK_PATH,
-    QUOTE_DUD_PATH,
     QUOTE_FILE_PATH,
-    QUOTE_HISTORY_PATH,
+    cached_quotes,
     calculate_swack_level,
-    format_quote_text,
+    current_quotes,
+    prefix_index,
     pull_random_quote,
     pull_specific_quote,
+    quote_state,
     refresh_quotes,
+    rendered_quote,
+    search_index,
+    submitter_stats,
 )
+from schedule import Job, Scheduler
+from startup import Phases, startup_report
 
 LOCAL_DIR = Path(__file__).parent.resolve()
 "Where this file and other files are placed"
 
+CHANNELS_FILE = LOCAL_DIR / "channels.toml"
+"Which channels we serve and how, see `load_channels()`."
+
+REFRESH_LEAD = timedelta(minutes=1)
+"How long before each posting time we refresh the quotes."
+
+LUCKY_COLOUR_LAG = timedelta(seconds=15)
+"How long after each posting time we change the lucky colour."
+
 REPO_LINK = "https://github.com/Gnomeball/SwackQuote"
 "Where is this repo, in case anybody asks?"
 
@@ -51,13 +67,17 @@ HELP_DOC = """Commands:
 The valid graph types are: "line", "bar".
 The valid scale types are: "log"(arithmic), "linear".
 
+#search <words> - Finds the quotes with all of those words, in the quote, attribution, or submitter
+
 #help    - Prints out this message
 ```
 Admin commands:
 ```js
 #test <ID>    - Sends a test quote, ID optional
 #reroll       - Reroll todays quote
+(/test and /reroll do the same, suggesting IDs as you type an ID or submitter)
 #colour <HEX> - Updates the lucky colour, HEX (RRGGBB) optional
+#stats        - Prints how often, and how long, the slow parts have taken
 ```
 How to add a Quote:
 ```js
@@ -71,37 +91,103 @@ Each step has a full guide and can be done in browser, no downloads required.
 """
 "What SwackQuote can be asked to do."
 
-RE_IS_URL = re.compile(r"^https?://[^\s/$.?#].[^\s]*$", flags=re.IGNORECASE | re.MULTILINE | re.UNICODE)
-"Pattern to check if a string is most likely a URL. Credit to @stephenhay."
 
-MINUTE = 60
-"How long is a minute?"
+class ChannelConfig(NamedTuple):
+    """A channel SwackQuote serves, and what it does there."""
+
+    channel: int
+    "Which channel SwackQuote will place quotes in, and monitor for commands."
+    quote_at: time = time(12)
+    "When the daily quote is sent, in UTC."
+    lucky_role: int | None = None
+    "Which role in the channel's server has its daily colour changed (optional, nothing is changed if not present)."
+    duds: bool = False
+    "Whether the daily dud report is sent here too."
+
+
+class QuotePost(NamedTuple):
+    """A quote to send to a channel, and how it is labelled."""
+
+    channel: int
+    "Which channel the quote is sent to."
+    pre: str = "Quote"
+    "What the footer calls it, such as a re-rolled quote."
+    title: str | None = None
+    "The title of the embed, our swack level if not given."
+    which: str | None = None
+    "Which quote to send (by ID, or submitter), otherwise the next one drawn from the channel's deck."
+
 
 # Variables and stuff
 intents = discord.Intents.default()
 intents.message_content = True
-client = discord.Client(intents=intents)
+client = discord.Bot(intents=intents)
 
 # Prepare the client and logging
-logs.init()
 logger = logging.getLogger("SwackQuote")
 
 
-def is_url(url: str) -> bool:
+def load_channels() -> dict[int, ChannelConfig]:
     """
-    Check if a string is a valid URL for Discord.
-
-    Some invalid URLs may get through, but all valid URLs will pass.
-    Things that are absolutely not URLs will fail.
-    :returns: whether the given string is a valid URL.
-    :rtype: bool
+    Reads the channels we serve from CHANNELS_FILE, or failing that, `channel.txt` and `lucky_role.txt`.
+
+    CHANNELS_FILE has a table per channel, with the fields of ChannelConfig, such as:
+    `[swack]` `channel = 123` `quote_at = 12:00:00` `lucky_role = 456` `duds = true`.
+    Otherwise, `channel.txt` holds one or more channel IDs, one per line, the first of which gets the dud report,
+    and all of which share the lucky role in `lucky_role.txt` (if any).
+    :returns: Channel ID -> its configuration.
+    :rtype: dict[int, ChannelConfig]
     """
-    try:
-        _ = URL(url)
-    except (NameError, ValueError):
-        return re.match(RE_IS_URL, url) is not None
+    if CHANNELS_FILE.is_file():
+        configs = [ChannelConfig(**config) for config in tomllib.loads(CHANNELS_FILE.read_text()).values()]
     else:
-        return True
+        lucky_role = (
+            int((LOCAL_DIR / "lucky_role.txt").read_text()) if (LOCAL_DIR / "lucky_role.txt").is_file() else None
+        ) or None
+        channels = map(int, (LOCAL_DIR / "channel.txt").read_text().split())
+        configs = [ChannelConfig(channel, lucky_role=lucky_role, duds=i == 0) for i, channel in enumerate(channels)]
+    if not configs:
+        msg = f"We have no channels to serve, add one to {CHANNELS_FILE} (or channel.txt)"
+        raise ValueError(msg)
+    return {config.channel: config for config in configs}
+
+
+def shift_time(at: time, by: timedelta) -> time:
+    """
+    Moves a time of day by less than a day, wrapping around midnight, so a minute before 00:00 is 23:59.
+
+    :returns: The time of day by after at (or before, if by is negative).
+    :rtype: time
+    """
+    return (datetime.combine(date(2000, 1, 2), at) + by).time()
+
+
+def daily_jobs(channels: dict[int, ChannelConfig]) -> list[Job]:
+    """
+    Works out everything we do each day: one refresh for each posting time, then each channel's own jobs.
+
+    Each channel's jobs are grouped, so they happen in order, while every channel is served at once,
+    and its posts are after the refresh for its posting time, so they always have the refreshed quotes.
+    :returns: The jobs, for a Scheduler.
+    :rtype: list[Job]
+    """
+    refreshes = {
+        at: Job(f"refresh@{at.isoformat()}", shift_time(at, -REFRESH_LEAD), refresh_quotes)
+        for at in sorted({config.quote_at for config in channels.values()})
+    }
+    jobs = list(refreshes.values())
+    for channel, config in channels.items():
+        after = (refreshes[config.quote_at].name,)  # When caught up together, the refresh still has to come first
+        if config.duds:
+            report = functools.partial(dud_quotes, channel)
+            jobs.append(Job(f"dud_report:{channel}", config.quote_at, report, group=channel, after=after))
+        post = functools.partial(send_quote, QuotePost(channel), refresh=False)
+        jobs.append(Job(f"quote:{channel}", config.quote_at, post, group=channel, after=after))
+        if config.lucky_role is not None:
+            lucky_at = shift_time(config.quote_at, LUCKY_COLOUR_LAG)
+            colour = functools.partial(change_lucky_colour, channel, silent_update=False)
+            jobs.append(Job(f"lucky_colour:{channel}", lucky_at, colour, group=channel))
+    return jobs
 
 
 def random_colour() -> int:
@@ -126,64 +212,107 @@ async def on_ready() -> None:
 @client.event
 async def on_message(message: discord.Message) -> None:
     """SwackQuote has been sent a message! Exciting!"""
-    logger = logging.getLogger("on_message")
-    if message.channel.id != CHANNEL:
+    if (config := CHANNELS.get(channel := message.channel.id)) is None:
         return
-    match message.author.id, str.split(message.content):
-        case user, ["#reroll", *_] if user in ADMINS:
-            logger.info("Requesting quote re-roll")
-            await send_quote("Re-rolled Quote", log="request_quote")
-        case user, ["#test"] if user in ADMINS:
-            logger.info("Requesting test quote")
-            await test_quote()
-        case user, ["#test", which, *_] if user in ADMINS:
-            logger.info(f"Requesting test quote '{which}'")
-            await test_quote(which)
-        case user, ["#colour" | "#color"] if user in ADMINS and LUCKY_ROLE is not None:
-            await change_lucky_colour(silent_update=False)
-        case user, ["#colour" | "#color", colour, *_] if user in ADMINS and LUCKY_ROLE is not None:
-            await change_lucky_colour(colour, silent_update=False)
-        case _, ["#repo", *_]:
-            await client.get_channel(CHANNEL).send(content=REPO_LINK)
-        case _, ["#authors", *_]:
-            await author_counts()
-        case _, ["#authorsgraph", which_graph, which_scale, *_]:
-            await author_counts(which_graph, which_scale, graph=True)
-        case _, ["#help", *_]:
-            await send_help()
+    words = str.split(message.content)
+    if message.author.id not in ADMINS or not await admin_command(channel, config, words):
+        await anyone_command(channel, words)
+
+
+async def admin_command(channel: int, config: ChannelConfig, words: list[str]) -> bool:
+    """
+    Does what an admin asked for, if it is something only admins can ask for.
+
+    :returns: Whether it was.
+    :rtype: bool
+    """
+    logger = logging.getLogger("on_message")
+    match words:
+        case ["#reroll", *_]:
+            logger.info(f"Requesting quote re-roll in {channel}")
+            await send_quote(QuotePost(channel, "Re-rolled Quote"), log="request_quote")
+        case ["#test"]:
+            logger.info(f"Requesting test quote in {channel}")
+            await test_quote(channel)
+        case ["#test", which, *_]:
+            logger.info(f"Requesting test quote '{which}' in {channel}")
+            await test_quote(channel, which)
+        case ["#stats", *_]:
+            await send_stats(channel)
+        case ["#colour" | "#color"] if config.lucky_role is not None:
+            await change_lucky_colour(channel, silent_update=False)
+        case ["#colour" | "#color", colour, *_] if config.lucky_role is not None:
+            await change_lucky_colour(channel, colour, silent_update=False)
+        case _:
+            return False
+    return True
+
+
+async def anyone_command(channel: int, words: list[str]) -> None:
+    """Does what anyone asked for, if it is something we do."""
+    match words:
+        case ["#repo", *_]:
+            await client.get_channel(channel).send(content=REPO_LINK)
+        case ["#authors", *_]:
+            await author_counts(channel)
+        case ["#authorsgraph", which_graph, which_scale, *_]:
+            await author_counts(channel, which_graph, which_scale, graph=True)
+        case ["#search", *query] if query:
+            await search_quotes(channel, " ".join(query))
+        case ["#help", *_]:
+            await send_help(channel)
 
 
 @client.event
-async def send_help() -> None:
+async def send_help(channel: int) -> None:
     """Prints out the help."""
     embed_msg = discord.Embed(title="Sending help!", colour=random_colour(), description=HELP_DOC)
     embed_msg.set_footer(text=f"Help for {await current_date_time()}")
-    await client.get_channel(CHANNEL).send(embed=embed_msg)
+    await client.get_channel(channel).send(embed=embed_msg)
 
 
 @client.event
-async def author_counts(which_graph: str = "line", which_scale: str = "lin", *, graph: bool = False) -> None:
-    """Who has contributed quotes (as self-assessed by the submitter field)."""
-    quotes = await refresh_quotes()  # This way we have access to the latest quotes
-    authors = dict(
-        sorted(Counter(map(attrgetter("submitter"), quotes.values())).items(), key=itemgetter(1), reverse=True)
+async def search_quotes(channel: int, query: str) -> None:
+    """Finds the quotes with the given words in them, best match first."""
+    logger = logging.getLogger("search_quotes")
+    quotes = await current_quotes()  # The index is kept up to date by every refresh, so we need not refresh here
+    results = (await search_index()).search(query)
+    logger.info(f"Search for '{query}' found {len(results)} quotes")
+    lines = []
+    for identifier, _ in results:
+        text = textwrap.shorten((await rendered_quote(quotes[identifier])).text, width=300, placeholder="…")
+        lines.append(f"**{quotes.position(identifier)}.** `{identifier}`\n{text}")
+    embed_msg = discord.Embed(
+        title=textwrap.shorten(f"Searching for: {query}", width=256, placeholder="…"),
+        colour=random_colour(),
+        description="\n\n".join(lines) or "No quotes have all of those words.",
     )
-    pad_name = max(map(len, authors)) + 1
-    pad_num = max(map(len, map(str, authors.values()))) + 1
+    embed_msg.set_footer(text=f"Search as of {await current_date_time()}")
+    await client.get_channel(channel).send(embed=embed_msg)
 
-    # in py312 we can use f"{f"{author} ".ljust(pad_name, ".")}.{f" {count}".rjust(pad_num, ".")}"
-    author_list = [
-        ".".join([f"{author} ".ljust(pad_name, "."), f" {count}".rjust(pad_num, ".")])
-        for author, count in authors.items()
-    ]
-    "Their name and number of submitted quotes, with our fun dot-based padding."
-    author_string = "\n".join(["```", *author_list, "```"])
+
+@client.event
+async def send_stats(channel: int) -> None:
+    """Prints out our metrics, since we started."""
+    embed_msg = discord.Embed(title="Stats", colour=random_colour(), description=metrics.summary())
+    embed_msg.set_footer(text=f"Stats as of {await current_date_time()}")
+    await client.get_channel(channel).send(embed=embed_msg)
+
+
+@client.event
+async def author_counts(
+    channel: int, which_graph: str = "line", which_scale: str = "lin", *, graph: bool = False
+) -> None:
+    """Who has contributed quotes (as self-assessed by the submitter field)."""
+    stats = await submitter_stats()  # Kept up to date by every refresh, so we need not refresh here
+    authors = dict(stats.ranked())
+    author_string = stats.table()
     "Formatted as a fenced block, so everything lines up nicely."
 
     embed_msg = discord.Embed(title="Submitters", colour=random_colour(), description=author_string)
     embed_msg.set_footer(text=f"Submitter table as of {await current_date_time()}")
 
-    await client.get_channel(CHANNEL).send(embed=embed_msg)
+    await client.get_channel(channel).send(embed=embed_msg)
     logger.info("Author counts have been sent!")
 
     #Here, we check if a graph was requested
@@ -207,120 +336,73 @@ async def author_counts(which_graph: str = "line", which_scale: str = "lin", *,
             embed_msg = discord.Embed(title="Error", colour=random_colour(), description="error message")
             embed_msg.set_footer(text="An invalid scale type has been requested!")
 
-            await client.get_channel(CHANNEL).send(embed=embed_msg)
+            await client.get_channel(channel).send(embed=embed_msg)
             return
 
         is_bar = False
 
         if which_graph == "line":
-            await send_graph(author_set, is_bar, is_linear)
+            await send_graph(channel, author_set, is_bar, is_linear)
         elif which_graph == "bar":
             is_bar = True
-            await send_graph(author_set, is_bar, is_linear)
+            await send_graph(channel, author_set, is_bar, is_linear)
         else:
             logger.info("An invalid graph type was requested!")
             embed_msg = discord.Embed(title="Error", colour=random_colour(), description="error message")
             embed_msg.set_footer(text="An invalid graph type has been requested!")
 
-            await client.get_channel(CHANNEL).send(embed=embed_msg)
+            await client.get_channel(channel).send(embed=embed_msg)
 
 
 @client.event
-async def send_graph(author_set: list[tuple[str, int]], is_bar: bool, is_linear: bool) -> None:
-        """Prints a graph of the self assessed submitters to the repo."""
-        #Define the scaling of the graph
+async def send_graph(channel: int, author_set: list[tuple[str, int]], is_bar: bool, is_linear: bool) -> None:
+    """Prints a graph of the self assessed submitters to the repo."""
+    # Rendered (or remembered) by graphs.py, away from the event loop
+    png = await authors_graph(author_set, is_bar=is_bar, is_linear=is_linear)
+    logger.info("Author graph has been rendered!")
 
-        x_size = 0.5 * len(author_set)
-        y_size = 0.65 * x_size
-        fig_size = plt.rcParams["figure.figsize"]
-        fig_size[0] = x_size
-        fig_size[1] = y_size
-        plt.rcParams["figure.figsize"] = fig_size
-        plt.rcParams.update({"font.size": 14})
+    # Create the embedded content, straight from memory
+    image_file = discord.File(io.BytesIO(png), filename="authors.png")
+    embed = discord.Embed()
+    embed.set_image(url="attachment://authors.png")
 
-        #Split these into data points
+    await client.get_channel(channel).send(file=image_file, embed=embed)
 
-        x = [plot_point[0] for plot_point in author_set]
-        y = [plot_point[1] for plot_point in author_set]
-
-        #Plot either a bar or line, and annotate each one appropriately
-        if is_bar:
-            plt.bar(x,y)
-            for i, num in enumerate(y):
-                plt.annotate(num, (x[i], y[i]), xycoords ="data", xytext = (-4, 3), textcoords="offset points")
-
-        else:
-            plt.scatter(x,y)
-            plt.plot(x,y)
-            for i, num in enumerate(y):
-                if i > 0:
-                    plt.annotate(num, (x[i], y[i]), xycoords ="data", xytext = (4, 4), textcoords="offset points")
-            plt.annotate(y[0], (x[0], y[0]), xycoords ="data", xytext = (4, -2), textcoords="offset points")
-
-
-
-        #Make the graph look pretty
-
-        plt.xticks(rotation=45, ha="right")
-        plt.xlabel ("Name of Submitters")
-        plt.ylabel ("Number of Submissions")
-        plt.title ("Chart of Submissions to SwackQuote!")
-
-
-        #Set the scale of the graph
-
-        plt.yscale("linear" if is_linear else "log")
-
-
-        plt.savefig(LOCAL_DIR / "authors.png", dpi = 600, bbox_inches = "tight")
-        logger.info("Author graph file has been created!")
-
-        #Create the embedded content
-
-        image_file = discord.File(LOCAL_DIR / "authors.png", filename = "authors.png")
-        embed = discord.Embed()
-        embed.set_image(url="attachment://authors.png")
-
-        #Send the file, then delete it
-
-        await client.get_channel(CHANNEL).send(file=image_file, embed = embed)
-
-        logger.info("Attempted to remove the graph image")
-        Path.unlink(LOCAL_DIR / "authors.png")
-        plt.clf()
 
 @client.event
-async def dud_quotes() -> None:
+async def dud_quotes(channel: int) -> None:
     """For when things go less than correct, try to let us know."""
     logger = logging.getLogger("dud_quotes")
     # We just print verbatim, no need to parse
-    duds = QUOTE_DUD_PATH.read_text().strip()
+    duds = "\n".join(quote_state().duds().values()).strip()
     if len(duds):
         logger.info(f"Sending dud quotes: \n{duds}")
         embed_msg = discord.Embed(
             title="These quotes need fixing", description=f"```toml\n{duds[:3900]}\n```", colour=random_colour()
         )
-        await client.get_channel(CHANNEL).send(embed=embed_msg)
+        await client.get_channel(channel).send(embed=embed_msg)
         logger.info("Dud quotes have been sent")
     else:
         logger.info("There were no dud quotes today")
+    duplicates = "\n".join(
+        f"[{k}] looks like [{duplicate_of}] ({similarity:.0%})"
+        for k, duplicate_of, similarity in quote_state().duplicates()
+    )
+    if len(duplicates):
+        logger.info(f"Sending likely duplicates: \n{duplicates}")
+        embed_msg = discord.Embed(
+            title="These quotes may be duplicates", description=f"```\n{duplicates[:3900]}\n```", colour=random_colour()
+        )
+        await client.get_channel(channel).send(embed=embed_msg)
+        logger.info("Likely duplicates have been sent")
 
 
 @client.event
 async def quote_loop() -> NoReturn:
-    """Idles until we should start."""
+    """Idles until we should start, then runs each of our daily jobs on time."""
     await client.wait_until_ready()
-    logging.debug("Running quote loop")
-    while True:
-        previous = datetime.now(UTC)
-        await asyncio.sleep(MINUTE)
-        now = datetime.now(UTC)
-        if previous.hour != now.now().hour and now.hour == 12:
-            await asyncio.sleep(15)
-            await send_quote()
-            if LUCKY_ROLE is not None:
-                await asyncio.sleep(15)
-                await change_lucky_colour(silent_update=False)
+    logging.debug(f"Running quote loop for {len(CHANNELS)} channels")
+    await Scheduler(quote_state(), daily_jobs(CHANNELS)).run()
 
 
 @client.event
@@ -337,12 +419,13 @@ async def current_date_time() -> str:
 
 
 @client.event
-async def change_lucky_colour(pick: str | None = None, *, silent_update: bool = False) -> None:
-    """Change today's colour for the "I'm feeling lucky" role."""
-    if LUCKY_ROLE is None:
-        logger.info("Attempted to change lucky colour, but we have no lucky role.")
+async def change_lucky_colour(channel: int, pick: str | None = None, *, silent_update: bool = False) -> None:
+    """Change today's colour for the channel's "I'm feeling lucky" role."""
+    lucky_role = CHANNELS[channel].lucky_role
+    role: discord.Role | None = None if lucky_role is None else client.get_channel(channel).guild.get_role(lucky_role)
+    if role is None:
+        logger.info(f"Attempted to change lucky colour, but we have no lucky role in {channel}.")
     else:
-        role: discord.Role = client.get_channel(CHANNEL).guild.get_role(LUCKY_ROLE)
         colour = None
         logger.info("Time for a new lucky colour!")
         match pick:
@@ -373,7 +456,7 @@ async def change_lucky_colour(pick: str | None = None, *, silent_update: bool =
                     await role.edit(colour=colour)
                     logger.info("Quote sent successfully")
                     if not silent_update:
-                        await client.get_channel(CHANNEL).send(
+                        await client.get_channel(channel).send(
                             embed=(
                                 discord.Embed(
                                     title="Today's lucky colour is...",
@@ -391,62 +474,131 @@ async def change_lucky_colour(pick: str | None = None, *, silent_update: bool =
 
 
 @client.event
-async def send_quote(
-    pre: str = "Quote", title: str | None = None, which: str | None = None, log: str = "send_quote"
-) -> None:
+async def send_quote(post: QuotePost, log: str = "send_quote", *, refresh: bool = True) -> None:
     """SwackQuote deployed. Quote inbound."""
     logger = logging.getLogger(log)
+    channel, pre, title, which = post
 
-    quotes = await refresh_quotes()  # This way we have access to the latest quotes
-    await dud_quotes()
+    # Commands never wait on the repo, stale quotes are refreshed in the background for next time,
+    # and the daily posts share a refresh made just before them
+    quotes = await (cached_quotes() if refresh else current_quotes())
 
-    quote, i = pull_random_quote(quotes) if which is None else pull_specific_quote(which, quotes)
+    if which is None:  # The draw touches the channel's deck and history, so keep it off the event loop
+        quote, i = await asyncio.to_thread(pull_random_quote, quotes, channel)
+    else:
+        quote, i = pull_specific_quote(which, quotes)
     title = title or calculate_swack_level()
-    quote_text = format_quote_text(quote)
+    rendered = await rendered_quote(quote)  # Rendered the first time it is sent, not every time
 
     # Build the quote embed we will send
-    embed_msg = discord.Embed(title=title, colour=random_colour(), description=quote_text)
+    embed_msg = discord.Embed(title=title, colour=random_colour(), description=rendered.text)
     embed_msg.set_footer(
         text=f"""{pre} for {await current_date_time()}
 Quote {i}/{len(quotes)}, Submitted by {quote.submitter}"""
     )
-    if quote.source and is_url(quote.source):
-        embed_msg.url = quote.source
+    if rendered.url is not None:
+        embed_msg.url = rendered.url
         embed_msg.title += " 🔗"
 
     # Try and send the quote
-    logger.info(f"Attempting to send quote #{i}, submitted by {quote.submitter}")
+    logger.info(f"Attempting to send quote #{i}, submitted by {quote.submitter}, to {channel}")
     try:
-        await client.get_channel(CHANNEL).send(embed=embed_msg)
-        if quote.embed and quote.source and is_url(quote.source):
-            await client.get_channel(CHANNEL).send(content=quote.source)
+        with metrics.timer("discord_send"):
+            await client.get_channel(channel).send(embed=embed_msg)
+            if rendered.embed:
+                await client.get_channel(channel).send(content=rendered.url)
+        metrics.count("quotes_sent")
         logger.info("Quote sent successfully")
     except Exception:
         logger.exception(f"Error sending quote #{i}")
 
 
 @client.event
-async def test_quote(which: str = "<testing>", log: str = "test_quote") -> None:
+async def test_quote(channel: int, which: str = "<testing>", log: str = "test_quote") -> None:
     """Send our default testing quote, or another one of your choice, marked up so we can tell."""
-    await send_quote(pre="Testing", title="Testing the Swack", which=which, log=log)
+    await send_quote(QuotePost(channel, pre="Testing", title="Testing the Swack", which=which), log=log)
+
+
+async def quote_choices(ctx: discord.AutocompleteContext) -> list[discord.OptionChoice]:
+    """Suggests the quotes whose ID, or submitter, starts with what has been typed so far."""
+    quotes = await current_quotes()
+    return [
+        discord.OptionChoice(textwrap.shorten(f"{k} ({quotes[k].submitter})", width=100, placeholder="…"), k)
+        for k in (await prefix_index()).complete(ctx.value or "")
+    ]
+
+
+async def admin_channel(ctx: discord.ApplicationContext) -> int | None:
+    """
+    Checks that a slash command was used by an admin, in one of our channels, and if so, acknowledges it privately.
+
+    :returns: The channel the command was used in, if it was allowed.
+    :rtype: Optional[int]
+    """
+    if ctx.author.id not in ADMINS or ctx.channel_id not in CHANNELS:
+        await ctx.respond("Sorry, only admins can do that, and only where I send quotes.", ephemeral=True)
+        return None
+    await ctx.defer(ephemeral=True)  # Sending the quote may take longer than Discord waits for a response
+    return ctx.channel_id
+
+
+@client.slash_command(name="test", description="Sends a test quote")
+@discord.option(
+    "quote", str, description="Which quote (by ID, or submitter)", required=False, autocomplete=quote_choices
+)
+async def slash_test(ctx: discord.ApplicationContext, quote: str | None = None) -> None:
+    """As #test, but with the quotes suggested as you type."""
+    if (channel := await admin_channel(ctx)) is not None:
+        logger.info(f"Requesting test quote '{quote}' in {channel}")
+        await test_quote(channel, quote or "<testing>")
+        await ctx.followup.send("Test quote sent!", ephemeral=True)
+
+
+@client.slash_command(name="reroll", description="Rerolls today's quote")
+@discord.option(
+    "quote", str, description="Reroll to this quote (by ID, or submitter)", required=False, autocomplete=quote_choices
+)
+async def slash_reroll(ctx: discord.ApplicationContext, quote: str | None = None) -> None:
+    """As #reroll, but optionally to a quote of your choice, suggested as you type."""
+    if (channel := await admin_channel(ctx)) is not None:
+        logger.info(f"Requesting quote re-roll in {channel}")
+        await send_quote(QuotePost(channel, "Re-rolled Quote", which=quote), log="request_quote")
+        await ctx.followup.send("Quote re-rolled!", ephemeral=True)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs SwackQuote.")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="time each phase of starting up, without connecting to Discord, failing if imports are over budget",
+    )
+    args = parser.parse_args()
+    phases = Phases()
+
+    # Only when we are the bot, not when a worker process imports us
+    with phases("logs"):
+        logs.init()
+
     # Permissions and directions for SwackQuote
-    ADMINS = set(tomllib.loads((LOCAL_DIR / "admins.toml").read_text()).values())
-    "Those able to send commands to SwackQuote."
-    CHANNEL = int((LOCAL_DIR / "channel.txt").read_text())
-    "Which channel SwackQuote will move to, place quotes in, and monitor for commands."
-    LUCKY_ROLE = (
-        int((LOCAL_DIR / "lucky_role.txt").read_text()) if (LOCAL_DIR / "lucky_role.txt").is_file() else None
-    ) or None
-    "Which role SwackQuote will change the daily colour of (optional, will do nothing if not present)."
-
-    # Ensure necessary files exist
-    QUOTE_FILE_PATH.touch()
-    QUOTE_DUD_PATH.touch()
-    QUOTE_DECK_PATH.touch()
-    QUOTE_HISTORY_PATH.touch()
+    with phases("config"):
+        ADMINS = set(tomllib.loads((LOCAL_DIR / "admins.toml").read_text()).values())
+        "Those able to send commands to SwackQuote."
+        CHANNELS = load_channels()
+        "Which channels SwackQuote will place quotes in, and monitor for commands, and how."
+
+    # Ensure necessary files exist, and bring over any old state (to the first channel, which is who it belonged to)
+    with phases("state"):
+        QUOTE_FILE_PATH.touch()
+        quote_state().claim(next(iter(CHANNELS)))
+
+    if args.profile_startup:
+        with phases("quotes"):  # Otherwise loaded by whichever comes first, a command or the daily refresh
+            asyncio.run(current_quotes())
+        report, within_budget = startup_report(phases)
+        print(report)
+        sys.exit(0 if within_budget else 1)
 
     client.loop.create_task(quote_loop())
+    client.loop.create_task(metrics.export_loop())
     client.run((LOCAL_DIR / "token.txt").read_text())
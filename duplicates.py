@@ -0,0 +1,233 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`duplicates.py` spots quotes that were submitted again, give or take some wording or punctuation.
+
+Each quote is cut into overlapping runs of characters (shingles), summarised by a MinHash signature,
+and filed into locality-sensitive hash buckets by bands of that signature.
+Similar quotes very likely share a bucket, so only those that do are ever compared, rather than every pair.
+Only the buckets are kept, and a QuoteDiff updates them (and is checked against them) one quote at a time.
+"""
+
+import itertools
+import random
+import re
+import zlib
+from collections.abc import Mapping
+from typing import TYPE_CHECKING, NamedTuple
+
+from startup import optional_numpy
+
+if TYPE_CHECKING:
+    from quotes import Quote, QuoteDiff
+
+SHINGLE_SIZE = 5
+"How many characters long each shingle is."
+
+MINHASH_BANDS = 16
+"How many bands each signature is cut into, quotes sharing any band are compared."
+
+MINHASH_ROWS = 4
+"How many hashes are in each band, so a signature has MINHASH_BANDS * MINHASH_ROWS."
+
+MINHASH_SEED = 0x5EED
+"Seeds our hash functions, so signatures are the same from run to run."
+
+DUPLICATE_SIMILARITY = 0.6
+"How much of their shingles two quotes must share (Jaccard similarity) to be called duplicates."
+
+MINHASH_MASK = (1 << 64) - 1
+"Our hash functions are the top 32 bits of (a * x + b) mod 2**64, which numpy does without dividing."
+
+MINHASH_BATCH = 64
+"How many quotes we work out signatures for at once when filing every quote, any more and numpy waits on memory."
+
+RE_NOT_WORD = re.compile(r"[\W_]+")
+"Everything that is not part of a word, which we ignore."
+
+
+class Duplicate(NamedTuple):
+    """A quote that looks a lot like one we already had."""
+
+    identifier: str
+    "The quote that was added (or changed)."
+    duplicate_of: str
+    "The quote it looks like."
+    similarity: float
+    "How much of their shingles they share, from 0 to 1."
+
+
+def normalise(text: str) -> str:
+    """
+    Ignores case, punctuation, and spacing.
+
+    :returns: The words of text, lower case, separated by single spaces.
+    :rtype: str
+    """
+    return " ".join(RE_NOT_WORD.split(text.casefold())).strip()
+
+
+def shingles(quote: "Quote") -> set[int]:
+    """
+    Cuts the (normalised) text of a quote into overlapping runs of SHINGLE_SIZE characters.
+
+    :returns: The CRC-32 of each shingle.
+    :rtype: set[int]
+    """
+    text = normalise(quote.quote).encode("utf8")
+    return {zlib.crc32(text[i : i + SHINGLE_SIZE]) for i in range(max(len(text) - SHINGLE_SIZE, 0) + 1)}
+
+
+def similarity(a: set[int], b: set[int]) -> float:
+    """
+    How much do two sets of shingles overlap?
+
+    :returns: Their Jaccard similarity, from 0 (nothing shared) to 1 (the same).
+    :rtype: float
+    """
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class MinHasher:
+    """MINHASH_BANDS * MINHASH_ROWS random hash functions, and the minimum each gives over a set of shingles."""
+
+    def __init__(self, seed: int = MINHASH_SEED) -> None:
+        """Pick our hash functions, the same ones each time for the same seed."""
+        rng = random.Random(seed)
+        n = MINHASH_BANDS * MINHASH_ROWS
+        self._a = [rng.randrange(1 << 64) | 1 for _ in range(n)]
+        self._b = [rng.randrange(1 << 64) for _ in range(n)]
+        if (np := optional_numpy()) is not None:
+            self._np_a = np.array(self._a, dtype=np.uint64)
+            self._np_b = np.array(self._b, dtype=np.uint64)
+
+    def signature(self, hashes: set[int]) -> list[int]:
+        """
+        Works out the MinHash signature of some shingles, with numpy if we have it.
+
+        :returns: The smallest value each of our hash functions gives over the shingles.
+        :rtype: list[int]
+        """
+        if (np := optional_numpy()) is not None:
+            x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+            return ((self._np_a[:, None] * x + self._np_b[:, None]) >> 32).min(axis=1).tolist()
+        return [min(((a * x + b) & MINHASH_MASK) >> 32 for x in hashes) for a, b in zip(self._a, self._b, strict=True)]
+
+    def signatures(self, many: list[set[int]]) -> list[list[int]]:
+        """
+        Works out the MinHash signatures of many sets of shingles, all at once with numpy if we have it.
+
+        :returns: The signature of each, as `signature()` would give.
+        :rtype: list[list[int]]
+        """
+        if (np := optional_numpy()) is None or not many:
+            return [self.signature(hashes) for hashes in many]
+        x = np.fromiter(itertools.chain.from_iterable(many), dtype=np.uint64)
+        starts = np.cumsum([0, *map(len, many[:-1])])
+        values = (self._np_a[:, None] * x + self._np_b[:, None]) >> 32
+        return np.minimum.reduceat(values, starts, axis=1).T.tolist()
+
+    @staticmethod
+    def bands(signature: list[int]) -> list[int]:
+        """
+        Cuts a signature into bands, which similar quotes are likely to share at least one of.
+
+        :returns: A bucket key for each band.
+        :rtype: list[int]
+        """
+        return [
+            hash((band, *signature[band * MINHASH_ROWS : (band + 1) * MINHASH_ROWS])) for band in range(MINHASH_BANDS)
+        ]
+
+
+class DuplicateIndex:
+    """Every quote we have, in LSH buckets, kept up to date from each QuoteDiff rather than rebuilt."""
+
+    def __init__(self, quotes: Mapping[str, "Quote"] | None = None) -> None:
+        """File each of the given quotes, this is the only time we look at all of them."""
+        self._hasher = MinHasher()
+        self._buckets: dict[int, str | list[str]] = {}
+        "Bucket key -> the quote in it, or quotes if there is more than one (most buckets hold just one)."
+        items = iter((quotes or {}).items())
+        while batch := list(itertools.islice(items, MINHASH_BATCH)):
+            signatures = self._hasher.signatures([shingles(quote) for _, quote in batch])
+            for (identifier, _), signature in zip(batch, signatures, strict=True):
+                self._file(identifier, self._hasher.bands(signature))
+
+    def _keys(self, quote: "Quote") -> list[int]:
+        """The buckets a quote goes in."""
+        return self._hasher.bands(self._hasher.signature(shingles(quote)))
+
+    def add(self, identifier: str, quote: "Quote") -> None:
+        """File a quote we now have."""
+        self._file(identifier, self._keys(quote))
+
+    def _file(self, identifier: str, keys: list[int]) -> None:
+        """Put a quote in each of the given buckets."""
+        for key in keys:
+            match self._buckets.get(key):
+                case None:
+                    self._buckets[key] = identifier
+                case str(only):
+                    self._buckets[key] = [only, identifier]
+                case list(many):
+                    many.append(identifier)
+
+    def remove(self, identifier: str, quote: "Quote") -> None:
+        """Take out a quote (as it was when filed) that we no longer have."""
+        for key in self._keys(quote):
+            match self._buckets.get(key):
+                case str(only) if only == identifier:
+                    del self._buckets[key]
+                case list(many) if identifier in many:
+                    many.remove(identifier)
+                    if len(many) == 1:
+                        self._buckets[key] = many[0]
+
+    def candidates(self, quote: "Quote") -> set[str]:
+        """
+        Finds the quotes sharing a bucket with this one, which are likely to be similar.
+
+        :returns: Their identifiers.
+        :rtype: set[str]
+        """
+        found = set()
+        for key in self._keys(quote):
+            match self._buckets.get(key):
+                case str(only):
+                    found.add(only)
+                case list(many):
+                    found.update(many)
+        return found
+
+    def duplicates(self, identifier: str, quote: "Quote", quotes: Mapping[str, "Quote"]) -> list[Duplicate]:
+        """
+        Finds the quotes we have filed that this one is really similar to, checking each candidate in full.
+
+        :returns: Each duplicate, most similar first.
+        :rtype: list[Duplicate]
+        """
+        ours = shingles(quote)
+        found = [
+            Duplicate(identifier, candidate, s)
+            for candidate in self.candidates(quote) - {identifier}
+            if candidate in quotes and (s := similarity(ours, shingles(quotes[candidate]))) >= DUPLICATE_SIMILARITY
+        ]
+        return sorted(found, key=lambda duplicate: duplicate.similarity, reverse=True)
+
+    def apply(self, diff: "QuoteDiff", quotes: Mapping[str, "Quote"]) -> list[Duplicate]:
+        """
+        Updates the buckets from what changed in a refresh, checking each new (or changed) quote on the way in.
+
+        :returns: The duplicates among what was added or changed, of each other or of what we already had.
+        :rtype: list[Duplicate]
+        """
+        for identifier, quote in diff.removals:
+            self.remove(identifier, quote)
+        for identifier, _, old_quote in diff.changed:
+            self.remove(identifier, old_quote)
+        found = []
+        for identifier, quote, *_ in [*diff.changed, *diff.additions]:
+            found += self.duplicates(identifier, quote, quotes)
+            self.add(identifier, quote)
+        return found
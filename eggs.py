@@ -2,17 +2,18 @@
 A polite little Discord bot that can send out a quote each day.
 
 `eggs.py` handles the eggs.
+
+The basket is read once, then kept (along with a quote_id -> Egg index) until `eggs.toml` changes,
+so finding the egg for a quote never touches the disk.
 """
 
-# import logging
-# import random
+import logging
 import tomllib
+from collections.abc import Container
 from pathlib import Path
-from typing import Any, NamedTuple
-
-# import requests
-import tomli_w
+from typing import NamedTuple
 
+from snapshot import content_digest
 
 LOCAL_DIR = Path(__file__).parent.resolve()
 
@@ -29,6 +30,48 @@ class Egg(NamedTuple):
     notes: str | None = None
 
 
+class Basket(NamedTuple):
+    """Every Egg we found, and where we found them."""
+
+    eggs: dict[str, Egg]
+    "Name -> Egg, as in EGGS."
+    by_quote: dict[str, Egg]
+    "quote_id -> Egg, the last one wins if a quote has more than one."
+    stat: tuple[int, int] | None
+    "The size and modification time of EGGS when we read it, if it was there."
+    digest: bytes | None
+    "The `content_digest()` of EGGS when we read it, if it was there."
+
+
+_basket: Basket | None = None
+"The eggs as of our last `reload_eggs()`."
+
+
+def reload_eggs() -> bool:
+    """
+    Reads EGGS again, but only if its size or modification time have changed, and only rebuilds if its content has.
+
+    :returns: Whether the basket was rebuilt.
+    :rtype: bool
+    """
+    global _basket  # noqa: PLW0603
+    try:
+        stat = EGGS.stat()
+        stat = stat.st_size, stat.st_mtime_ns
+    except OSError:
+        stat = None
+    if _basket is not None and _basket.stat == stat:
+        return False
+    text = EGGS.read_bytes() if stat is not None else None
+    digest = content_digest(text) if text is not None else None
+    if _basket is not None and _basket.digest == digest:
+        _basket = _basket._replace(stat=stat)
+        return False
+    eggs = {name: Egg(**egg) for name, egg in tomllib.loads(text.decode("utf8")).items()} if text is not None else {}
+    _basket = Basket(eggs, {egg.quote_id: egg for egg in eggs.values()}, stat, digest)
+    return True
+
+
 def egg_hunting() -> dict[str, Egg]:
     """
     Goes Egg hunting.
@@ -36,9 +79,32 @@ def egg_hunting() -> dict[str, Egg]:
     :returns: A basket of sorted Eggs.
     :rtype: dict[str, Egg]
     """
-    raw_eggs = tomllib.loads(EGGS.read_text(encoding="utf8"))
-    # There is a better way to do this.. it sucks!
-    eggs = {}
-    for egg in raw_eggs:
-        eggs[egg] = Egg(**raw_eggs[egg])
-    return eggs
+    reload_eggs()
+    return _basket.eggs
+
+
+def egg_for(quote_id: str) -> Egg | None:
+    """
+    Finds the Egg hidden in a quote, reading EGGS only if we never have.
+
+    :returns: The Egg attached to that quote, if there is one.
+    :rtype: Optional[Egg]
+    """
+    if _basket is None:
+        reload_eggs()
+    return _basket.by_quote.get(quote_id)
+
+
+def check_eggs(quotes: Container[str]) -> list[str]:
+    """
+    Checks that every Egg is hidden in a quote we actually have.
+
+    :returns: The names of any Eggs whose quote_id is missing.
+    :rtype: list[str]
+    """
+    if _basket is None:
+        reload_eggs()
+    missing = [name for name, egg in _basket.eggs.items() if egg.quote_id not in quotes]
+    if missing:
+        logging.getLogger("check_eggs").warning(f"Eggs for quotes we do not have: {', '.join(missing)}")
+    return missing
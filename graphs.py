@@ -0,0 +1,120 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`graphs.py` draws the graphs for #authorsgraph.
+
+Rendering happens in a worker process, with matplotlib's object-oriented API, straight into memory.
+So the event loop is never held up, no global pyplot state is shared between requests, and nothing touches the disk.
+The last few graphs are kept, so asking for the same graph again costs nothing.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import io
+import multiprocessing
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from snapshot import content_digest
+
+GRAPH_DPI = 600
+"How finely we render the graphs."
+
+GRAPH_CACHE_SIZE = 8
+"How many rendered graphs we keep around."
+
+_graph_pool: concurrent.futures.ProcessPoolExecutor | None = None
+"The worker process we render in, started on first use, see `graph_pool()`."
+
+_graph_cache: OrderedDict[tuple[bytes, bool, bool], asyncio.Future[bytes]] = OrderedDict()
+"(Author-counts digest, is bar, is linear) -> the PNG, least recently used first."
+
+
+def render_authors_graph(authors: Sequence[tuple[str, int]], *, is_bar: bool, is_linear: bool) -> bytes:
+    """
+    Draws a graph of the self assessed submitters to the repo, this runs in the worker process.
+
+    :returns: The graph, as a PNG.
+    :rtype: bytes
+    """
+    # Only the worker needs matplotlib, so only the worker imports it
+    import matplotlib as mpl  # noqa: PLC0415
+    from matplotlib.figure import Figure  # noqa: PLC0415
+
+    x = [author for author, _ in authors]
+    y = [count for _, count in authors]
+
+    with mpl.rc_context({"font.size": 14}):
+        # Define the scaling of the graph
+        x_size = max(0.5 * len(authors), 1)
+        fig = Figure(figsize=(x_size, 0.65 * x_size))
+        ax = fig.subplots()
+
+        # Plot either a bar or line, and annotate each one appropriately
+        if is_bar:
+            ax.bar(x, y)
+            for author, num in authors:
+                ax.annotate(num, (author, num), xycoords="data", xytext=(-4, 3), textcoords="offset points")
+        elif authors:
+            ax.scatter(x, y)
+            ax.plot(x, y)
+            for author, num in authors[1:]:
+                ax.annotate(num, (author, num), xycoords="data", xytext=(4, 4), textcoords="offset points")
+            ax.annotate(y[0], (x[0], y[0]), xycoords="data", xytext=(4, -2), textcoords="offset points")
+
+        # Make the graph look pretty
+        for label in ax.get_xticklabels():
+            label.set_rotation(45)
+            label.set_horizontalalignment("right")
+        ax.set_xlabel("Name of Submitters")
+        ax.set_ylabel("Number of Submissions")
+        ax.set_title("Chart of Submissions to SwackQuote!")
+
+        # Set the scale of the graph
+        ax.set_yscale("linear" if is_linear else "log")
+
+        png = io.BytesIO()
+        fig.savefig(png, format="png", dpi=GRAPH_DPI, bbox_inches="tight")
+    return png.getvalue()
+
+
+def graph_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Gets the worker process we render in, starting it on first use.
+
+    :returns: A pool of one, so matplotlib is only ever imported once.
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    global _graph_pool  # noqa: PLW0603
+    if _graph_pool is None:
+        _graph_pool = concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+    return _graph_pool
+
+
+async def authors_graph(authors: Sequence[tuple[str, int]], *, is_bar: bool, is_linear: bool) -> bytes:
+    """
+    Gets a graph of the submitters, rendering it only if we have not recently.
+
+    Requests for a graph that is still being rendered wait for that one, rather than rendering it again.
+    :returns: The graph, as a PNG.
+    :rtype: bytes
+    """
+    global _graph_pool  # noqa: PLW0603
+    authors = [(author, count) for author, count in authors]
+    key = content_digest("\n".join(f"{author}\t{count}" for author, count in authors)), is_bar, is_linear
+    if (png := _graph_cache.get(key)) is None:
+        loop = asyncio.get_running_loop()
+        render = functools.partial(render_authors_graph, authors, is_bar=is_bar, is_linear=is_linear)
+        png = _graph_cache[key] = loop.run_in_executor(graph_pool(), render)
+        while len(_graph_cache) > GRAPH_CACHE_SIZE:
+            _graph_cache.popitem(last=False)
+    _graph_cache.move_to_end(key)
+    try:
+        return await asyncio.shield(png)
+    except Exception as e:
+        if _graph_cache.get(key) is png:
+            del _graph_cache[key]  # Try again next time
+        if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+            _graph_pool = None  # With a fresh worker
+        raise
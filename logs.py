@@ -2,20 +2,75 @@
 Quick but reliable logging wrapper that will rotate log files cleanly in our desired formatting.
 
 Only imported by `bot.py`, which calls `init()`, and from then on everything is ready to use.
+
+By default, logging only puts records on a queue, and a background thread does all the writing, rotating, and (if
+asked) compressing of the files, so none of that ever happens on the event loop.
 """
 
+import atexit
+import gzip
 import logging
 import logging.config
 import logging.handlers
+import os
+import queue
+import shutil
 from pathlib import Path
+from typing import Any
+
 
+def init(*, debug: bool | None = None, compress: bool | None = None, queued: bool = True) -> None:
+    """
+    Configure `logging` with our handlers of choice.
 
-def init() -> None:
-    """Configure `logging` with our handlers of choice."""
+    :param debug: Whether to log DEBUG too (into DBGLOG), defaults to DEBUG.
+    :param compress: Whether to gzip the rotated log files, defaults to COMPRESS.
+    :param queued: Whether to write from a background thread, rather than wherever we log from.
+    """
+    global _listener  # noqa: PLW0603
+    stop()
+    debug = DEBUG if debug is None else debug
+    compress = COMPRESS if compress is None else compress
     OUTLOG.touch()
     ERRLOG.touch()
-    DBGLOG.touch()
-    logging.config.dictConfig(LOG_CONFIG)
+    if debug:
+        DBGLOG.touch()
+    logging.config.dictConfig(log_config(debug=debug))
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    if compress:
+        for handler in handlers:
+            handler.namer, handler.rotator = gzip_namer, gzip_rotator
+    if queued:
+        records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def stop() -> None:
+    """Write out anything still queued and stop the background thread, if there is one."""
+    global _listener  # noqa: PLW0603
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def gzip_namer(name: str) -> str:
+    """Rotated log files are gzipped, so they are named as such."""
+    return f"{name}.gz"
+
+
+def gzip_rotator(source: str, dest: str) -> None:
+    """Rotate a log file by gzipping it, rather than just renaming it."""
+    with Path(source).open("rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    Path(source).unlink()
 
 
 OUTLOG = Path("out.log")
@@ -27,14 +82,29 @@ ERRLOG = Path("err.log")
 DBGLOG = Path("dbg.log")
 "Where DEBUG level logging goes (when used)."
 
+DEBUG = bool(os.environ.get("SWACKQUOTE_DEBUG"))
+"Whether we log at DEBUG level (into DBGLOG) by default, set SWACKQUOTE_DEBUG to turn it on."
+
+COMPRESS = bool(os.environ.get("SWACKQUOTE_GZIP_LOGS"))
+"Whether we gzip rotated logs by default, set SWACKQUOTE_GZIP_LOGS to turn it on."
+
 FILE_CONFIG = {"formatter": "fmt", "maxBytes": 10**6, "backupCount": 5}
 "We limit logs to 1MB, and rotate through up to 5 at a time."
 
-LOG_CONFIG = {
-    "version": 1,
-    "disable_existing_loggers": True,
-    "formatters": {"fmt": {"format": "[{asctime}: {name} {levelname}]: {message}", "style": "{"}},
-    "handlers": {
+_listener: logging.handlers.QueueListener | None = None
+"The background thread that does our writing, when queued."
+
+atexit.register(stop)
+
+
+def log_config(*, debug: bool) -> dict[str, Any]:
+    """
+    We have INFO and ERROR logging setup, with our formatting, and DEBUG only when we want it.
+
+    :returns: A configuration for `logging.config.dictConfig()`.
+    :rtype: dict[str, Any]
+    """
+    handlers = {
         "outfile": {
             "class": "logging.handlers.RotatingFileHandler",
             "level": "INFO",
@@ -47,13 +117,18 @@ LOG_CONFIG = {
             "filename": ERRLOG,
             **FILE_CONFIG,
         },
-        "debugfile": {
+    }
+    if debug:
+        handlers["debugfile"] = {
             "class": "logging.handlers.RotatingFileHandler",
             "level": "DEBUG",
             "filename": DBGLOG,
             **FILE_CONFIG,
-        },
-    },
-    "root": {"level": "INFO", "handlers": ["outfile", "errfile", "debugfile"]},
-}
-"We have INFO, ERROR, and DEBUG logging setup, with our formatting."
+        }
+    return {
+        "version": 1,
+        "disable_existing_loggers": True,
+        "formatters": {"fmt": {"format": "[{asctime}: {name} {levelname}]: {message}", "style": "{"}},
+        "handlers": handlers,
+        "root": {"level": "DEBUG" if debug else "INFO", "handlers": list(handlers)},
+    }
@@ -0,0 +1,278 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`metrics.py` keeps count of how often, and how long, the slow parts of the bot take.
+
+Timings go into fixed-bucket histograms, so recording one is a bisect and a few additions, however long we run.
+They can be read with #stats, and are written out for Prometheus every so often, see `export_loop()`.
+"""
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any, NoReturn, TypeVar
+
+LOCAL_DIR = Path(__file__).parent.resolve()
+"Where this file and other files are placed."
+
+METRICS_PATH = LOCAL_DIR / "metrics.prom"
+"Where we write our metrics, in the Prometheus text format, for a node exporter's textfile collector (or anyone)."
+
+METRICS_INTERVAL = 60
+"How often (in seconds) we write METRICS_PATH."
+
+METRICS_PREFIX = "swackquote"
+"What each of our metrics is called, to Prometheus, before its own name."
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1, 2.5, 5,
+    10, 30, 60,
+)  # fmt: skip
+"The upper bounds (in seconds) of our latency histograms, anything slower is counted above the last."
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Histogram:
+    """How many observations fell into each bucket, with their count and sum, as Prometheus has it."""
+
+    __slots__ = ("_lock", "bounds", "buckets", "count", "sum")
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """An empty histogram, with the given (sorted) bucket upper bounds."""
+        self.bounds = bounds
+        "The upper bound of each bucket, the last bucket (for everything else) has none."
+        self.buckets = [0] * (len(bounds) + 1)
+        "How many observations fell into each bucket, not cumulative."
+        self.count = 0
+        "How many observations there have been."
+        self.sum = 0.0
+        "The total of every observation."
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record an observation, such as how long something took."""
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def copy(self) -> "Histogram":
+        """
+        Copies the histogram as it is right now, so it can be read while it is still being observed into.
+
+        :returns: A histogram with the same buckets, count and sum.
+        :rtype: Histogram
+        """
+        copied = Histogram(self.bounds)
+        with self._lock:
+            copied.buckets, copied.count, copied.sum = self.buckets.copy(), self.count, self.sum
+        return copied
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile, such as the median (0.5), from the buckets.
+
+        :returns: The upper bound of the bucket the quantile falls in (infinity if it is above them all), or 0 if empty.
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip((*self.bounds, float("inf")), self.buckets, strict=True):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_histograms: dict[str, Histogram] = {}
+"Name -> latency histogram, see `histogram()`."
+
+_counters: Counter[str] = Counter()
+"Name -> how many times it happened, see `count()`."
+
+_lock = threading.Lock()
+"Held while adding to _histograms or _counters, which worker threads do while we may be reading them."
+
+
+def histogram(name: str) -> Histogram:
+    """
+    Gets a latency histogram by name, making it the first time.
+
+    :returns: The histogram of that name.
+    :rtype: Histogram
+    """
+    if (found := _histograms.get(name)) is None:
+        with _lock:
+            found = _histograms.setdefault(name, Histogram())
+    return found
+
+
+def count(name: str, n: int = 1) -> None:
+    """Counts that something happened (n times)."""
+    with _lock:
+        _counters[name] += n
+
+
+def _snapshot() -> tuple[list[tuple[str, Histogram]], list[tuple[str, int]]]:
+    """
+    Copies every histogram and counter, so they can be formatted while worker threads keep adding to them.
+
+    :returns: Each histogram (copied), and each counter, sorted by name.
+    :rtype: tuple[list[tuple[str, Histogram]], list[tuple[str, int]]]
+    """
+    with _lock:
+        histograms, counters = list(_histograms.items()), list(_counters.items())
+    return sorted((name, hist.copy()) for name, hist in histograms), sorted(counters)
+
+
+@contextlib.contextmanager
+def timer(name: str) -> Iterator[None]:
+    """Times the block into the histogram name, counting it under name_errors too if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        count(f"{name}_errors")
+        raise
+    finally:
+        histogram(name).observe(time.perf_counter() - start)
+
+
+def timed(name: str | None = None) -> Callable[[F], F]:
+    """
+    Times every call of a function (or coroutine function), as `timer()` would, under name (or the function's name).
+
+    :returns: A decorator.
+    :rtype: Callable[[F], F]
+    """
+
+    def decorator(func: F) -> F:
+        """Wraps func so that it is timed."""
+        hist = histogram(name or func.__name__)
+        errors = f"{name or func.__name__}_errors"
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def timed_coroutine(*args: Any, **kwargs: Any) -> Any:
+                """Await func, timing it."""
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException:
+                    count(errors)
+                    raise
+                finally:
+                    hist.observe(time.perf_counter() - start)
+
+            return timed_coroutine  # type: ignore[return-value]
+
+        @functools.wraps(func)
+        def timed_function(*args: Any, **kwargs: Any) -> Any:
+            """Call func, timing it."""
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                count(errors)
+                raise
+            finally:
+                hist.observe(time.perf_counter() - start)
+
+        return timed_function  # type: ignore[return-value]
+
+    return decorator
+
+
+def format_seconds(seconds: float) -> str:
+    """
+    Formats a duration for people, in whichever unit suits it.
+
+    :returns: Something like "250µs", "12.5ms", or "1.2s".
+    :rtype: str
+    """
+    if seconds == float("inf"):
+        return f">{LATENCY_BUCKETS[-1]:g}s"
+    if seconds < 0.001:
+        return f"{seconds * 1e6:.0f}µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.3g}ms"
+    return f"{seconds:.3g}s"
+
+
+def summary() -> str:
+    """
+    Summarises our metrics for #stats, as a fenced block, so everything lines up nicely.
+
+    :returns: For each histogram, its count, mean, median and 99th percentile, then each counter.
+    :rtype: str
+    """
+    histograms, counters = _snapshot()
+    lines = [f"{'':<22}{'count':>7}{'mean':>9}{'p50':>9}{'p99':>9}"]
+    for name, hist in histograms:
+        mean = hist.sum / hist.count if hist.count else 0.0
+        lines.append(
+            f"{name:<22}{hist.count:>7}{format_seconds(mean):>9}"
+            f"{format_seconds(hist.quantile(0.5)):>9}{format_seconds(hist.quantile(0.99)):>9}"
+        )
+    lines.extend(f"{name:<22}{n:>7}" for name, n in counters)
+    return "\n".join(["```", *lines, "```"])
+
+
+def prometheus_text() -> str:
+    """
+    Writes out our metrics as Prometheus expects them.
+
+    :returns: Every histogram (in seconds) and counter (as a total), in the Prometheus text exposition format.
+    :rtype: str
+    """
+    histograms, counters = _snapshot()
+    lines = []
+    for name, hist in histograms:
+        metric = f"{METRICS_PREFIX}_{name}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip((*hist.bounds, "+Inf"), hist.buckets, strict=True):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum {hist.sum}")
+        lines.append(f"{metric}_count {hist.count}")
+    for name, n in counters:
+        metric = f"{METRICS_PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {n}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: Path = METRICS_PATH) -> None:
+    """Writes `prometheus_text()` to path, all at once, so it is never read half-written."""
+    partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    partial.write_text(prometheus_text(), encoding="utf8")
+    partial.replace(path)
+
+
+async def export_loop(path: Path = METRICS_PATH, interval: float = METRICS_INTERVAL) -> NoReturn:
+    """Writes our metrics to path every interval seconds, away from the event loop, logging (not raising) any error."""
+    logger = logging.getLogger("metrics")
+    while True:
+        try:
+            await asyncio.to_thread(write_prometheus, path)
+        except Exception:
+            logger.exception(f"Could not write metrics to {path}")
+        await asyncio.sleep(interval)
@@ -4,36 +4,92 @@ A polite little Discord bot that can send out a quote each day.
 `quotes.py` focuses on parsing, formatting, and updating quotes.
 """
 
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import io
+import itertools
 import logging
+import math
+import multiprocessing
+import os
 import random
+import re
+import time
 import tomllib
+import types
+import typing
+from collections import Counter, deque
+from collections.abc import Awaitable, Callable, Hashable, Iterable, Iterator, Mapping, Sequence
+from datetime import UTC, datetime, timedelta
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, NamedTuple
+from typing import TYPE_CHECKING, Any, NamedTuple, Protocol, TypeVar
 
-import requests
 import tomli_w
 
+from duplicates import Duplicate, DuplicateIndex
 from eggs import (
-    egg_hunting,
+    check_eggs,
+    egg_for,
+    reload_eggs,
 )
+from metrics import count, timed
+from search import PrefixIndex, SearchIndex
+from snapshot import Row, Snapshot, content_digest, open_snapshot, write_snapshot
+from startup import optional_numpy
+from state import QuoteState
+
+if TYPE_CHECKING:
+    import aiohttp
+
+with contextlib.suppress(ModuleNotFoundError):
+    from ada_url import URL
+
+T = TypeVar("T")
 
 QUOTE_FILE_ADDRESS = "https://raw.githubusercontent.com/Gnomeball/SwackQuote/main/quotes.toml"
 "Where to check for the latest quotes."
 
+QUOTE_FETCH_TIMEOUT = 10
+"How long (in seconds) we give QUOTE_FILE_ADDRESS to answer before we fallback to local."
+
+QUOTE_FRESHNESS = 5 * 60
+"How long (in seconds) after we last checked QUOTE_FILE_ADDRESS that commands use our quotes without checking again."
+
+QUOTE_BACKOFF = 30
+"How long (in seconds) we leave QUOTE_FILE_ADDRESS alone after it fails, doubling for each failure in a row."
+
+QUOTE_BACKOFF_LIMIT = 8 * 60
+"The longest (in seconds) we back off from QUOTE_FILE_ADDRESS, before the circuit opens."
+
+QUOTE_BREAKER_FAILURES = 5
+"How many failures in a row before we stop trying QUOTE_FILE_ADDRESS (the circuit opens) for QUOTE_BREAKER_COOLDOWN."
+
+QUOTE_BREAKER_COOLDOWN = 60 * 60
+"How long (in seconds) the circuit stays open, before we try QUOTE_FILE_ADDRESS once more."
+
 LOCAL_DIR = Path(__file__).parent.resolve()
 "Where this file and other files are placed."
 
 QUOTE_FILE_PATH = LOCAL_DIR / "quotes.toml"
 "The collection of all quotes."
 
-QUOTE_DUD_PATH = LOCAL_DIR / "quote_duds.toml"
-"Any quotes that aren't `quote_compliant()`."
+QUOTE_SNAPSHOT_PATH = LOCAL_DIR / "quotes.snapshot"
+"A memory-mapped copy of QUOTE_FILE_PATH, so we can start up without parsing it, see `snapshot.py`."
+
+QUOTE_STATE_PATH = LOCAL_DIR / "quote_state.sqlite3"
+"The current deck of quotes we're using, the logged appearances of each quote, and any that aren't `quote_compliant()`."
 
 QUOTE_DECK_PATH = LOCAL_DIR / "quote_deck.txt"
-"The current deck of quotes we're using."
+"Where the deck used to be kept, imported into QUOTE_STATE_PATH once."
 
 QUOTE_HISTORY_PATH = LOCAL_DIR / "quote_history.txt"
-"The logged appearances of each quote."
+"Where the history used to be kept, imported into QUOTE_STATE_PATH once."
+
+QUOTE_VALIDATORS_PATH = LOCAL_DIR / "quote_validators.toml"
+"The ETag and Last-Modified of the last QUOTE_FILE_ADDRESS we pulled, so we only download it again once it changes."
 
 QUOTE_REPEAT_DELAY = 200
 "How many days must pass before a repeated quote should be allowed."
@@ -41,6 +97,21 @@ QUOTE_REPEAT_DELAY = 200
 DISCORD_MESSAGE_LENGTH_LIMIT = 4000
 "How long can a Discord message be? This long, give or take."
 
+RE_TABLE_HEADER = re.compile(r"^\s*\[(?!\[)(?:\s*(?P<bare>[A-Za-z0-9_-]+)\s*\])?")
+"Matches the start of a TOML table header, capturing the identifier when it is a bare key."
+
+RE_MULTILINE_STRING = re.compile(r"\"\"\"|'''")
+"Either delimiter of a TOML multi-line string."
+
+RE_IS_URL = re.compile(r"^https?://[^\s/$.?#].[^\s]*$", flags=re.IGNORECASE | re.MULTILINE | re.UNICODE)
+"Pattern to check if a string is most likely a URL. Credit to @stephenhay."
+
+PARSE_CHUNK_TABLES = 1000
+"How many tables each worker process parses at a time in `stream_quotes()`."
+
+WEIGHTED_DRAW_ATTEMPTS = 64
+"How many weighted samples we try before giving up on finding one that is not recent, and using the deck instead."
+
 
 class Quote(NamedTuple):
     """Our Quote type, bundles its info together, requires submitter & quote."""
@@ -52,77 +123,620 @@ class Quote(NamedTuple):
     embed: bool = False
 
 
+class QuoteStore(Mapping[str, Quote]):
+    """
+    Our collection of quotes, indexed by both identifier and position (as in "Quote i/N").
+
+    Positions are 1-based and follow the order the quotes were given in, so the order of QUOTE_FILE_PATH.
+    The columns are either in memory, or decoded on demand from a memory-mapped `snapshot.Snapshot`.
+    """
+
+    __slots__ = ("_ids", "_positions", "_quotes", "_snapshot", "_table_digests", "digest")
+
+    def __init__(
+        self,
+        quotes: Mapping[str, Quote] | Iterable[tuple[str, Quote]] = (),
+        *,
+        digest: bytes | None = None,
+        table_digests: Mapping[str, bytes] | None = None,
+        snapshot: Snapshot | None = None,
+    ) -> None:
+        """
+        Index the given identifier -> Quote pairs, and the digests of the TOML they came from (if known).
+
+        Given a snapshot instead, we wrap it, see `from_snapshot()`.
+        """
+        quote_dict = dict(quotes)
+        self._ids: Sequence[str] = list(quote_dict) if snapshot is None else snapshot.identifiers
+        "Position - 1 -> identifier."
+        self._quotes: Sequence[Quote] = list(quote_dict.values()) if snapshot is None else snapshot.quotes
+        "Position - 1 -> Quote."
+        self._positions: Mapping[str, int] = (
+            {identifier: i for i, identifier in enumerate(self._ids, 1)} if snapshot is None else snapshot.positions
+        )
+        "Identifier -> position."
+        self._table_digests: Mapping[str, bytes] = (
+            dict(table_digests or {}) if snapshot is None else snapshot.table_digests
+        )
+        "Identifier -> `content_digest()` of its TOML table."
+        self._snapshot = snapshot
+        "The snapshot the columns are decoded from, if any."
+        self.digest = digest if snapshot is None else snapshot.digest
+        "The `content_digest()` of the whole TOML document these quotes came from."
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "QuoteStore":
+        """
+        Wraps a memory-mapped snapshot, nothing is decoded until it is used.
+
+        :returns: A store backed entirely by the snapshot.
+        :rtype: QuoteStore
+        """
+        return cls(snapshot=snapshot)
+
+    def __getitem__(self, identifier: str) -> Quote:
+        """Get a Quote by its identifier."""
+        return self._quotes[self._positions[identifier] - 1]
+
+    def __contains__(self, identifier: object) -> bool:
+        """Do we have a Quote with this identifier?"""
+        return identifier in self._positions
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the identifiers, in order."""
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        """How many quotes are there?"""
+        return len(self._ids)
+
+    def __eq__(self, other: object) -> bool:
+        """Do we have the same identifiers for the same quotes (in any order)?"""
+        match other:
+            case QuoteStore() if self.digest is not None and self.digest == other.digest:
+                return True
+            case Mapping():
+                return len(self) == len(other) and all(k in other and other[k] == q for k, q in self.items())
+            case _:
+                return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        """Summarise the store, the quotes themselves are too long to repr."""
+        return f"<QuoteStore of {len(self)} quotes>"
+
+    def position(self, identifier: str) -> int:
+        """
+        Where is a given quote in the collection?
+
+        :returns: The 1-based position of the quote with this identifier.
+        :rtype: int
+        """
+        return self._positions[identifier]
+
+    def identifier(self, position: int) -> str:
+        """
+        Which quote is at a given position in the collection?
+
+        :returns: The identifier of the quote at this 1-based position.
+        :rtype: str
+        """
+        return self._ids[position - 1]
+
+    def table_digest(self, identifier: str) -> bytes | None:
+        """
+        What did the TOML table for a given quote look like?
+
+        :returns: The `content_digest()` of the quote's table, if we know it.
+        :rtype: Optional[bytes]
+        """
+        return self._table_digests.get(identifier)
+
+    def at(self, position: int) -> Quote:
+        """
+        Gets a Quote by its position, without looking up its identifier.
+
+        :returns: The quote at this 1-based position.
+        :rtype: Quote
+        """
+        return self._quotes[position - 1]
+
+    def digests(self) -> Iterator[tuple[str, bytes | None]]:
+        """
+        Goes through every identifier and table digest at once, which a snapshot does without searching for either.
+
+        :returns: Each identifier, in order, with the `content_digest()` of its table, if we know it.
+        :rtype: Iterator[tuple[str, Optional[bytes]]]
+        """
+        if self._snapshot is not None:
+            return self._snapshot.digests()
+        return ((identifier, self._table_digests.get(identifier)) for identifier in self._ids)
+
+
+class QuoteDiff(NamedTuple):
+    """What changed between two QuoteStores."""
+
+    additions: list[tuple[str, Quote]]
+    removals: list[tuple[str, Quote]]
+    changed: list[tuple[str, Quote, Quote]]
+    "Identifier, new Quote, old Quote."
+
+
+def diff_quotes(old: QuoteStore, new: QuoteStore) -> QuoteDiff:
+    """
+    Compares two QuoteStores, skipping over any quote whose table digest is unchanged.
+
+    Each store is gone through once, in order, with `QuoteStore.digests()`, and a quote is only decoded if we need it,
+    so we never search a snapshot for an identifier.
+    :returns: The additions, removals, and changes going from old to new.
+    :rtype: QuoteDiff
+    """
+    old_digests = {k: (position, digest) for position, (k, digest) in enumerate(old.digests(), 1)}
+    additions, changed = [], []
+    for position, (k, digest) in enumerate(new.digests(), 1):
+        if (found := old_digests.pop(k, None)) is None:
+            additions.append((k, new.at(position)))
+        elif (digest is None or digest != found[1]) and (q := new.at(position)) != (old_q := old.at(found[0])):
+            changed.append((k, q, old_q))
+    removals = [(k, old.at(position)) for k, (position, _) in old_digests.items()]
+    return QuoteDiff(additions, removals, changed)
+
+
+class SubmitterStats:
+    """
+    How many quotes each submitter has given us, kept up to date from each QuoteDiff rather than recounted.
+
+    The ranking and the fenced table for #authors are only rebuilt when the counts change.
+    """
+
+    def __init__(self, quotes: Mapping[str, Quote] | None = None) -> None:
+        """Count the submitters of the given quotes, this is the only time we look at all of them."""
+        self.counts: Counter[str] = Counter(q.submitter for q in (quotes or {}).values())
+        "Submitter -> how many quotes they have, in the order we first saw them."
+        self._ranked: list[tuple[str, int]] | None = None
+        "The counts, most first, see `ranked()`."
+        self._table: str | None = None
+        "The counts, as a fenced table, see `table()`."
+
+    def apply(self, diff: QuoteDiff) -> bool:
+        """
+        Updates the counts from what changed in a refresh.
+
+        :returns: Whether any of the counts changed.
+        :rtype: bool
+        """
+        before = self.counts.copy()
+        self.counts.update(q.submitter for _, q in diff.additions)
+        self.counts.subtract(q.submitter for _, q in diff.removals)
+        for _, q, old_q in diff.changed:
+            if q.submitter != old_q.submitter:
+                self.counts[q.submitter] += 1
+                self.counts[old_q.submitter] -= 1
+        self.counts = +self.counts  # Drop anyone who no longer has any quotes
+        if self.counts == before:
+            return False
+        self._ranked = self._table = None
+        return True
+
+    def ranked(self) -> list[tuple[str, int]]:
+        """
+        Who has contributed quotes (as self-assessed by the submitter field).
+
+        :returns: Each submitter and their number of quotes, most first.
+        :rtype: list[tuple[str, int]]
+        """
+        if self._ranked is None:
+            self._ranked = sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        return self._ranked
+
+    def table(self) -> str:
+        """
+        Formats the ranking as a fenced block, so everything lines up nicely.
+
+        :returns: Their name and number of submitted quotes, with our fun dot-based padding.
+        :rtype: str
+        """
+        if self._table is None:
+            ranked = self.ranked()
+            pad_name = max((len(author) for author, _ in ranked), default=0) + 1
+            pad_num = max((len(str(count)) for _, count in ranked), default=0) + 1
+            # in py312 we can use f"{f"{author} ".ljust(pad_name, ".")}.{f" {count}".rjust(pad_num, ".")}"
+            author_list = [
+                ".".join([f"{author} ".ljust(pad_name, "."), f" {count}".rjust(pad_num, ".")])
+                for author, count in ranked
+            ]
+            self._table = "\n".join(["```", *author_list, "```"])
+        return self._table
+
+
+_current_quotes: QuoteStore | None = None
+"The quotes as of our last `refresh_quotes()`, reused while QUOTE_FILE_ADDRESS remains unmodified."
+
+_submitter_stats: SubmitterStats | None = None
+"The submitters of _current_quotes, once someone has asked, see `submitter_stats()`."
+
+_quote_renders: "QuoteRenders | None" = None
+"The _current_quotes we have sent, rendered, see `rendered_quote()`."
+
+_search_index: SearchIndex | None = None
+"The words of _current_quotes, once someone has searched, see `search_index()`."
+
+_prefix_index: PrefixIndex | None = None
+"The identifiers and submitters of _current_quotes, once someone has completed an ID, see `prefix_index()`."
+
+_duplicate_index: DuplicateIndex | None = None
+"The LSH buckets of _current_quotes, that each refresh checks new quotes against, see `check_duplicates()`."
+
+_http_session: "aiohttp.ClientSession | None" = None
+"Our pooled connection to QUOTE_FILE_ADDRESS, reused between refreshes, see `http_session()`."
+
+_revalidated_at: float | None = None
+"When (by `time.monotonic()`) a refresh last started, see `cached_quotes()`."
+
+_revalidation: asyncio.Task | None = None
+"The refresh `cached_quotes()` last started in the background, kept so it is not garbage collected part way."
+
+
+def iter_tables(quotes: str) -> Iterator[tuple[str | None, str]]:
+    """
+    Splits a TOML-format string at its [table] headers as we go, without parsing the tables.
+
+    Headers inside multi-line strings are skipped, anything else we get wrong is caught by whoever parses the tables.
+    :returns: The preamble before the first table (with no identifier), then the identifier (if a bare key) and text
+        of each table.
+    :rtype: Iterator[tuple[Optional[str], str]]
+    """
+    identifier, lines = None, []
+    in_string = None
+    "The multi-line string delimiter we are inside of, if any."
+    for line in io.StringIO(quotes, newline=""):
+        if in_string is None and (header := RE_TABLE_HEADER.match(line)):
+            yield identifier, "".join(lines)
+            identifier, lines = header["bare"], [line]
+        else:
+            lines.append(line)
+        for delimiter in RE_MULTILINE_STRING.findall(line):
+            if in_string is None:
+                in_string = delimiter
+            elif in_string == delimiter:
+                in_string = None
+    yield identifier, "".join(lines)
+
+
+def split_tables(quotes: str) -> list[tuple[str | None, str]] | None:
+    """
+    Splits a TOML-format string at its [table] headers, without parsing the tables.
+
+    Headers inside multi-line strings are skipped, anything else we get wrong is caught by `as_quotes()`.
+    :returns: The identifier (if a bare key) and text of each table, or None if there is more than tables to it.
+    :rtype: Optional[list[tuple[Optional[str], str]]]
+    """
+    (_, preamble), *tables = iter_tables(quotes)
+    try:
+        if tomllib.loads(preamble):
+            return None
+    except tomllib.TOMLDecodeError:
+        return None
+    return tables
+
+
+class QuoteError(NamedTuple):
+    """Something wrong with a not-quite quote."""
+
+    identifier: str | None
+    "Which quote it was, if we know."
+    field: str | None
+    "Which field of it was wrong, if it was just the one."
+    message: str
+
+
+class QuoteValidator:
+    """
+    Checks dicts against our Quote type, with everything about the type worked out once, up front.
+
+    Much like `typing.NamedTuple` itself, we write the source of a function that checks and builds a Quote from a dict,
+    so a good quote costs a handful of lookups and isinstance checks, and only duds are looked at field by field.
+    """
+
+    def __init__(self) -> None:
+        """Compile the checks for Quote."""
+        self.annotations: dict[str, Any] = dict(Quote.__annotations__)
+        "Type annotations for Quote, {field: type} map."
+        self.fields = frozenset(self.annotations)
+        "Every field a Quote may have."
+        self.required = frozenset(field for field in Quote._fields if field not in Quote._field_defaults)
+        "Necessary fields that must be supplied for a Quote."
+        self.types: dict[str, tuple[type, ...]] = {
+            field: typing.get_args(anno) if isinstance(anno, types.UnionType) else (anno,)
+            for field, anno in self.annotations.items()
+        }
+        "Field -> what isinstance() must accept for it, `str | None` becomes `(str, NoneType)`."
+        self.lengths = {"quote": DISCORD_MESSAGE_LENGTH_LIMIT}
+        "Field -> how long it may be."
+
+        namespace: dict[str, Any] = {"_fields": self.fields, "_required": self.required, "_new": tuple.__new__}
+        lines = [
+            "def convert(quote):",
+            "    if type(quote) is not dict or not (_required <= quote.keys() <= _fields):",
+            "        return None",
+        ]
+        for i, field in enumerate(Quote._fields):
+            allowed = tuple(t for t in self.types[field] if t is not types.NoneType)
+            namespace[f"_types_{i}"], namespace[f"_default_{i}"] = allowed, Quote._field_defaults.get(field)
+            get = f"quote[{field!r}]" if field in self.required else f"quote.get({field!r}, _default_{i})"
+            wrong = f"not isinstance(v{i}, _types_{i})"
+            if len(allowed) < len(self.types[field]):
+                wrong = f"v{i} is not None and {wrong}"
+            if field in self.lengths:
+                wrong = f"{wrong} or len(v{i}) > {self.lengths[field]}"
+            lines += [f"    v{i} = {get}", f"    if {wrong}:", "        return None"]
+        lines.append(f"    return _new(Quote, ({', '.join(f'v{i}' for i in range(len(Quote._fields)))},))")
+        exec("\n".join(lines), globals() | namespace, namespace)  # noqa: S102
+        self.convert: Callable[[Any], Quote | None] = namespace["convert"]
+        "The fast path, the Quote that quote makes, or None if it is not quite one."
+
+    def check(self, quote: Any) -> bool:
+        """
+        Is quote a valid Quote?
+
+        :returns: Is quote a valid Quote?
+        :rtype: bool
+        """
+        return self.convert(quote) is not None
+
+    def errors(self, quote: Any, identifier: str | None = None) -> list[QuoteError]:
+        """
+        The slow path, everything that is wrong with quote.
+
+        :returns: What is wrong with each field, if anything.
+        :rtype: list[QuoteError]
+        """
+        if not isinstance(quote, dict):
+            return [QuoteError(identifier, None, f"Quote must be a dictionary, was {type(quote)}({quote})")]
+        errors = [
+            QuoteError(identifier, field, f"Missing '{field}' field from quote {quote}")
+            for field in Quote._fields
+            if field in self.required and field not in quote
+        ]
+        for key, val in quote.items():
+            if key not in self.fields:
+                message = f"{key} is not valid field for Quote, must be one of {', '.join(self.annotations)}"
+                errors.append(QuoteError(identifier, key, message))
+            elif not isinstance(val, self.types[key]):
+                message = f"Field {key} is an incorrect type, must be {self.annotations[key]}, was {type(val)}({val})"
+                errors.append(QuoteError(identifier, key, message))
+        if isinstance(text := quote.get("quote"), str) and len(text) > DISCORD_MESSAGE_LENGTH_LIMIT:
+            message = (
+                f"Quote is too long, must be less than {DISCORD_MESSAGE_LENGTH_LIMIT} bytes (UTF-8),"
+                f" but is {len(text)} bytes long"
+            )
+            errors.append(QuoteError(identifier, "quote", message))
+        return errors
+
+    def validate(self, document: Mapping[str, Any]) -> tuple[dict[str, Quote], dict[str, Any], list[QuoteError]]:
+        """
+        Validates a whole parsed document of identifier -> quote dict in one pass.
+
+        :returns: The valid quotes, the not-quite quotes, and what was wrong with them.
+        :rtype: dict[str, Quote], dict[str, Any], list[QuoteError]
+        """
+        quotes, duds, errors = {}, {}, []
+        convert = self.convert
+        for identifier, quote in document.items():
+            if (converted := convert(quote)) is not None:
+                quotes[identifier] = converted
+            else:
+                duds[identifier] = quote
+                errors += self.errors(quote, identifier)
+        return quotes, duds, errors
+
+
+QUOTE_VALIDATOR = QuoteValidator()
+"Our validator for Quote, compiled once."
+
+
 def quote_compliant(quote: dict) -> bool:
     """
-    Checks whether a dict would make a valid Quote.
+    Checks whether a dict would make a valid Quote, logging what is wrong with it if not.
 
     :returns: Is quote a valid Quote?
     :rtype: bool
     """
+    if QUOTE_VALIDATOR.check(quote):
+        return True
     logger = logging.getLogger("quote_compliant")
-    annos = Quote.__annotations__
-    "Type annotations for Quote, {field: [types]} map."
-    required_fields = {field for field in annos if field not in Quote._field_defaults}
-    "Necessary fields that must be supplied for a Quote."
-    match quote:
-        case dict(quote):
-            well_formed_quote = True
-            """Whether the quote is good to go."""
-
-            for field in required_fields:
-                if field not in quote:
-                    logger.error(f"Missing '{field}' field from quote {quote}")
-                    well_formed_quote = False
-
-            for key, val in quote.items():
-                match key, val:
-                    case "submitter" | "quote", str():
-                        logger.debug(f"Field {key} = {val} (str)")
-                    case "attribution" | "source", str() | None:
-                        logger.debug(f"Field {key} = {val} ({type(val)})")
-                    case "embed", bool():
-                        logger.debug(f"Field {key} = {val} (bool)")
-                    case "submitter" | "quote" | "attribution" | "source" | "embed", _:
-                        logger.error(f"Field {key} is an incorrect type, must be {annos[key]}, was {type(val)}({val})")
-                        well_formed_quote = False
-                    case _, _:
-                        logger.error(f"{key} is not valid field for Quote, must be one of {', '.join(annos)}")
-                        well_formed_quote = False
-
-            if len(quote["quote"]) > DISCORD_MESSAGE_LENGTH_LIMIT:
-                logger.error(
-                    f"Quote is too long, must be less than 4000 bytes (UTF-8), but is {len(quote['quote'])} bytes long"
-                )
-                well_formed_quote = False
-
-            return well_formed_quote
-        case _:
-            logger.error(f"Quote must be a dictionary, was {type(quote)}({quote})")
-            return False
+    for error in QUOTE_VALIDATOR.errors(quote):
+        logger.error(error.message)
+    return False
 
 
-def as_quotes(quotes: str, logger: logging.Logger) -> tuple[dict[str, Quote], dict[str, dict[str, Any]]]:
+@timed()
+def as_quotes(
+    quotes: str, logger: logging.Logger, previous: QuoteStore | None = None
+) -> tuple[QuoteStore, dict[str, dict[str, Any]]]:
     """
-    Converts a TOML-format string to a dict[str, Quote] of identifier -> Quote.
+    Converts a TOML-format string to a QuoteStore of identifier -> Quote.
 
-    :returns: Dictionary of Quote identifiers to Quote.
-    :rtype: dict[str, Quote], dict[str, Quote]
+    Tables whose text is unchanged from `previous` are reused, so we only parse and check the ones that changed.
+    :returns: Store of Quote identifiers to Quote, and a dictionary of not-quite quotes.
+    :rtype: QuoteStore, dict[str, Quote]
     """
-    loaded_quotes = tomllib.loads(quotes)
-    quote_dict, non_compliant = {}, {}
-    for i, q in loaded_quotes.items():
-        if quote_compliant(q):
-            quote_dict[i] = Quote(**q)
+    loaded_quotes, table_digests, reused = {}, {}, {}
+    tables = split_tables(quotes)
+    for identifier, table in tables or ():
+        table_digest = content_digest(table)
+        if identifier is not None and previous is not None and previous.table_digest(identifier) == table_digest:
+            loaded_table = {identifier: reused.setdefault(identifier, previous[identifier])}
         else:
-            non_compliant[i] = q
+            try:
+                loaded_table = tomllib.loads(table)
+            except tomllib.TOMLDecodeError:
+                loaded_table = {}
+        if len(loaded_table) != 1 or (identifier := next(iter(loaded_table))) in loaded_quotes:
+            tables = None  # We split somewhere we should not have, so we will have to do it the long way
+            break
+        loaded_quotes |= loaded_table
+        table_digests[identifier] = table_digest
+    if tables is None:
+        loaded_quotes, table_digests, reused = tomllib.loads(quotes), {}, {}
+    valid, non_compliant, errors = QUOTE_VALIDATOR.validate({i: q for i, q in loaded_quotes.items() if i not in reused})
+    quote_dict = {i: reused[i] if i in reused else valid[i] for i in loaded_quotes if i not in non_compliant}
+    for i in non_compliant:
+        table_digests.pop(i, None)
+    for error in errors:
+        logger.error(f"[{error.identifier}] {error.message}")
     if len(non_compliant):
         logger.error(f"Received non compliant quotes:\n {non_compliant}")
-    return quote_dict, non_compliant
+    return QuoteStore(quote_dict, digest=content_digest(quotes), table_digests=table_digests), non_compliant
+
+
+class Dud(NamedTuple):
+    """A not-quite quote, and what is wrong with it."""
+
+    identifier: str
+    quote: Any
+    errors: list[QuoteError]
+
+
+class UnsplittableError(ValueError):
+    """The quotes could not be parsed a table at a time, only as a whole, see `as_quotes()`."""
+
+
+def parse_tables(tables: Sequence[str]) -> list[tuple[str, bytes, Quote | Dud]]:
+    """
+    Parses and checks some tables, each on its own, done in a worker process by `stream_quotes()`.
+
+    :returns: The identifier, `content_digest()`, and Quote (or Dud) of each table.
+    :rtype: list[tuple[str, bytes, Union[Quote, Dud]]]
+    """
+    parsed = []
+    for table in tables:
+        try:
+            loaded_table = tomllib.loads(table)
+        except tomllib.TOMLDecodeError:
+            loaded_table = {}
+        if len(loaded_table) != 1:
+            msg = f"Table does not stand on its own:\n{table}"
+            raise UnsplittableError(msg)
+        ((identifier, quote),) = loaded_table.items()
+        if (converted := QUOTE_VALIDATOR.convert(quote)) is None:
+            converted = Dud(identifier, quote, QUOTE_VALIDATOR.errors(quote, identifier))
+        parsed.append((identifier, content_digest(table), converted))
+    return parsed
+
+
+def _check_preamble(preamble: str) -> None:
+    """
+    Checks there is nothing but comments before the first table, which would make the tables not stand on their own.
+
+    :raises UnsplittableError: If there is.
+    """
+    msg = "There is more than tables to these quotes"
+    try:
+        if tomllib.loads(preamble):
+            raise UnsplittableError(msg)
+    except tomllib.TOMLDecodeError as e:
+        raise UnsplittableError(msg) from e
+
+
+def _check_unseen(parsed: list[tuple[str, bytes, Quote | Dud]], seen: set[str]) -> list[tuple[str, bytes, Quote | Dud]]:
+    """
+    Checks none of these tables redefine a quote in seen, as those would have to be merged, then adds them to it.
+
+    :returns: The tables, as they were.
+    :rtype: list[tuple[str, bytes, Union[Quote, Dud]]]
+    :raises UnsplittableError: If any are seen already.
+    """
+    for identifier, _, _ in parsed:
+        if identifier in seen:
+            msg = f"[{identifier}] is defined more than once"
+            raise UnsplittableError(msg)
+        seen.add(identifier)
+    return parsed
+
+
+def _stream_tables(quotes: str, workers: int | None = None) -> Iterator[tuple[str, bytes, Quote | Dud]]:
+    """
+    Splits the quotes into chunks of PARSE_CHUNK_TABLES tables, parsing up to workers chunks at once.
+
+    Only a few chunks are ever in flight, so the parsed quotes never have to all be in memory at once.
+    :returns: The identifier, `content_digest()`, and Quote (or Dud) of each table, in order.
+    :rtype: Iterator[tuple[str, bytes, Union[Quote, Dud]]]
+    """
+    tables = iter_tables(quotes)
+    _, preamble = next(tables)
+    _check_preamble(preamble)
+    chunks = (
+        [table for _, table in chunk] for chunk in iter(lambda: list(itertools.islice(tables, PARSE_CHUNK_TABLES)), [])
+    )
+    seen: set[str] = set()
+    "Every identifier so far, a table that redefines one has to be merged, so must be parsed as a whole."
+
+    first = next(chunks, [])
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    if workers <= 1 or len(first) < PARSE_CHUNK_TABLES:  # Not worth starting any processes for
+        for chunk in itertools.chain([first], chunks):
+            yield from _check_unseen(parse_tables(chunk), seen)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        try:
+            in_flight = deque([pool.submit(parse_tables, first)])
+            for chunk in chunks:
+                in_flight.append(pool.submit(parse_tables, chunk))
+                if len(in_flight) >= 2 * workers:
+                    yield from _check_unseen(in_flight.popleft().result(), seen)
+            while in_flight:
+                yield from _check_unseen(in_flight.popleft().result(), seen)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+
+def stream_quotes(quotes: str, workers: int | None = None) -> Iterator[tuple[str, Quote] | Dud]:
+    """
+    Parses and checks a TOML-format string of quotes across worker processes, a chunk of tables at a time.
+
+    Small documents are parsed in this process, as starting the workers would take longer than the parsing.
+    :param workers: How many processes to use, all our cores if None, or 0 (or 1) to use just this one.
+    :returns: Each (identifier, Quote), or Dud, in order, as soon as its chunk is done.
+    :rtype: Iterator[Union[tuple[str, Quote], Dud]]
+    :raises UnsplittableError: If the quotes can only be parsed as a whole, this may come after some quotes.
+    """
+    for identifier, _, quote in _stream_tables(quotes, workers):
+        yield quote if isinstance(quote, Dud) else (identifier, quote)
 
 
-def as_dicts(quotes: dict[str, Quote]) -> dict[str, dict[str, str]]:
+def parse_quotes(
+    quotes: str, logger: logging.Logger, workers: int | None = None
+) -> tuple[QuoteStore, dict[str, dict[str, Any]]]:
     """
-    Converts a dict[str, Quote] to something TOML can serialise.
+    Converts a TOML-format string to a QuoteStore of identifier -> Quote, with `stream_quotes()`.
+
+    Gives exactly what `as_quotes()` would, falling back to it when the quotes cannot be parsed a table at a time.
+    :returns: Store of Quote identifiers to Quote, and a dictionary of not-quite quotes.
+    :rtype: QuoteStore, dict[str, Quote]
+    """
+    quote_dict, table_digests, non_compliant, errors = {}, {}, {}, []
+    try:
+        for identifier, table_digest, quote in _stream_tables(quotes, workers):
+            if isinstance(quote, Dud):
+                non_compliant[identifier] = quote.quote
+                errors += quote.errors
+            else:
+                quote_dict[identifier], table_digests[identifier] = quote, table_digest
+    except UnsplittableError:
+        return as_quotes(quotes, logger)
+    for error in errors:
+        logger.error(f"[{error.identifier}] {error.message}")
+    if non_compliant:
+        logger.error(f"Received non compliant quotes:\n {non_compliant}")
+    return QuoteStore(quote_dict, digest=content_digest(quotes), table_digests=table_digests), non_compliant
+
+
+def as_dicts(quotes: Mapping[str, Quote]) -> dict[str, dict[str, str]]:
+    """
+    Converts a QuoteStore (or any identifier -> Quote mapping) to something TOML can serialise.
 
     :returns: Dictionary of quote identifiers to TOML-compatible dicts
     :rtype: dict[str, dict[str, str]]
@@ -132,6 +746,12 @@ def as_dicts(quotes: dict[str, Quote]) -> dict[str, dict[str, str]]:
     }
 
 
+def write_toml(path: Path, document: dict[str, Any]) -> None:
+    """Writes a TOML document to the given path."""
+    with path.open("wb") as f:
+        tomli_w.dump(document, f)
+
+
 def calculate_swack_level() -> str:
     """
     Calculate the Swack Level with the Patent-Pending Swack Power Meter!
@@ -186,139 +806,853 @@ def format_quote_text(quote: Quote) -> str:
     return quote_text
 
 
-def pull_specific_quote(quote: str, quotes: dict[str, Quote]) -> tuple[Quote, int | str]:
+def is_url(url: str) -> bool:
     """
-    Selects a given quote from the given dictionary.
+    Check if a string is a valid URL for Discord.
+
+    Some invalid URLs may get through, but all valid URLs will pass.
+    Things that are absolutely not URLs will fail.
+    :returns: whether the given string is a valid URL.
+    :rtype: bool
+    """
+    try:
+        _ = URL(url)
+    except (NameError, ValueError):
+        return re.match(RE_IS_URL, url) is not None
+    else:
+        return True
+
+
+class Rendered(NamedTuple):
+    """A Quote, worked out ready to send."""
+
+    text: str
+    "The quote as we show it, see `format_quote_text()`."
+    url: str | None
+    "The source, if it is a valid URL we can link to."
+    embed: bool
+    "Whether to embed the source beneath the quote, which we only do for a valid URL."
+
+
+def render_quote(quote: Quote) -> Rendered:
+    """
+    Works out everything we need to send a quote that only depends on the quote.
+
+    :returns: Its text, its source if we can link to it, and whether we embed it.
+    :rtype: Rendered
+    """
+    url = quote.source if quote.source and is_url(quote.source) else None
+    return Rendered(format_quote_text(quote), url, quote.embed and url is not None)
+
+
+class QuoteRenders:
+    """
+    The quotes we have sent, each rendered the first time, then kept by its content.
+
+    A Quote hashes and compares by its fields, so the render is shared by any quote just like it.
+    Nothing is rendered when we load, and a QuoteDiff only ever has us forget what was removed or changed.
+    """
+
+    def __init__(self) -> None:
+        """No renders yet, each quote is rendered the first time it is asked for."""
+        self._renders: dict[Quote, Rendered] = {}
+        "Quote -> the quote, rendered."
+
+    def apply(self, diff: QuoteDiff) -> None:
+        """Forgets the renders of what was removed or changed in a refresh."""
+        for _, quote in diff.removals:
+            self._renders.pop(quote, None)
+        for _, _, old_quote in diff.changed:
+            self._renders.pop(old_quote, None)
+
+    def get(self, quote: Quote) -> Rendered:
+        """
+        Gets a quote ready to send.
+
+        :returns: The render we kept for it, rendering it now if this is the first time.
+        :rtype: Rendered
+        """
+        if (rendered := self._renders.get(quote)) is None:
+            rendered = self._renders[quote] = render_quote(quote)
+        return rendered
+
+    def __len__(self) -> int:
+        """How many distinct quotes we have rendered."""
+        return len(self._renders)
+
+
+def pull_specific_quote(quote: str, quotes: QuoteStore) -> tuple[Quote, int | str]:
+    """
+    Selects a given quote from the given store.
 
     :returns: The selected quote, or, failing that, a test quote.
     :rtype: Quote, Union[int, str]
     """
     if quote in quotes:
-        return quotes[quote], list(quotes).index(quote) + 1
+        return quotes[quote], quotes.position(quote)
 
     return Quote("Tester", "*Testing* - [Links work too!](https://www.google.co.uk)"), "Test"
 
 
-def pull_random_quote(quotes: dict[str, Quote]) -> tuple[Quote, int]:
+class AliasTable:
+    """
+    A Walker/Vose alias table, for drawing from a fixed set of weights in O(1) time.
+
+    Building the table is O(n), and uses NumPy to scale and partition the weights when we have it.
+    """
+
+    __slots__ = ("_alias", "_probability")
+
+    def __init__(self, weights: Sequence[float]) -> None:
+        """Build the table for the given (non-negative, not all zero) weights."""
+        n = len(weights)
+        if (np := optional_numpy()) is not None:
+            scaled = np.asarray(weights, dtype=np.float64)
+            total = scaled.sum() if n else 0.0
+            if not np.isfinite(total) or total <= 0 or (scaled < 0).any():
+                msg = "Weights must be finite, non-negative, and not all zero"
+                raise ValueError(msg)
+            scaled *= n / total
+            small, large = np.flatnonzero(scaled < 1).tolist(), np.flatnonzero(scaled >= 1).tolist()
+            probability = scaled.tolist()
+        else:
+            total = math.fsum(weights)
+            if not math.isfinite(total) or total <= 0 or any(w < 0 for w in weights):
+                msg = "Weights must be finite, non-negative, and not all zero"
+                raise ValueError(msg)
+            probability = [w * n / total for w in weights]
+            small = [i for i, p in enumerate(probability) if p < 1]
+            large = [i for i, p in enumerate(probability) if p >= 1]
+        alias = list(range(n))
+        while small and large:
+            less, more = small.pop(), large.pop()
+            alias[less] = more
+            probability[more] += probability[less] - 1
+            (small if probability[more] < 1 else large).append(more)
+        for i in small + large:  # Whatever is left over is only off from 1 by rounding
+            probability[i] = 1.0
+        self._probability: list[float] = probability
+        "Index -> the chance we keep the index we landed on, rather than taking its alias."
+        self._alias: list[int] = alias
+        "Index -> where the rest of its column went."
+
+    def __len__(self) -> int:
+        """How many weights are in the table?"""
+        return len(self._alias)
+
+    def sample(self) -> int:
+        """
+        Draw an index, with probability proportional to its weight.
+
+        :returns: The 0-based index of the weight we drew.
+        :rtype: int
+        """
+        i = int(random.random() * len(self._alias))
+        return i if random.random() < self._probability[i] else self._alias[i]
+
+
+class WeightPolicy(Protocol):
+    """How much more (or less) likely each quote should be to get picked."""
+
+    def key(self) -> Hashable:
+        """Something that changes whenever the weights might, besides the quotes themselves."""
+        ...
+
+    def weights(self, quotes: QuoteStore, state: QuoteState) -> Sequence[float]:
+        """The weight of each quote, in order of position."""
+        ...
+
+
+class SubmitterBalance:
+    """Evens out how often we hear from each submitter, however many quotes they have given us."""
+
+    def __init__(self, strength: float = 1.0) -> None:
+        """With strength 1 every submitter is equally likely, with 0 every quote is."""
+        self.strength = strength
+
+    def key(self) -> Hashable:
+        """Our weights only change with the quotes."""
+        return self.strength
+
+    def weights(self, quotes: QuoteStore, state: QuoteState) -> Sequence[float]:  # noqa: ARG002
+        """Each quote is weighted against how many quotes its submitter has."""
+        submitters = [q.submitter for q in quotes.values()]
+        counts = Counter(submitters)
+        return [counts[submitter] ** -self.strength for submitter in submitters]
+
+
+class Staleness:
+    """Favours the quotes that have not been shown for a long time."""
+
+    def __init__(self, horizon: int = 365) -> None:
+        """Any quote unseen for horizon days (or ever) is as stale as can be."""
+        self.horizon = horizon
+
+    def key(self) -> Hashable:
+        """We count in days, so our weights change once a day (today's quote is recent, so is never drawn anyway)."""
+        return self.horizon, datetime.now(UTC).date()
+
+    def weights(self, quotes: QuoteStore, state: QuoteState) -> Sequence[float]:
+        """Each quote is weighted by one more than the days since it was last shown."""
+        now, last_shown = datetime.now(UTC), state.last_shown()
+        return [
+            1 + (min((now - shown).days, self.horizon) if (shown := last_shown.get(k)) else self.horizon)
+            for k in quotes
+        ]
+
+
+class NewcomerBoost:
+    """Gives quotes a temporary boost when they are first added."""
+
+    def __init__(self, boost: float = 3.0, days: int = 14) -> None:
+        """Quotes added within the last so many days are boost times as likely."""
+        self.boost, self.days = boost, days
+
+    def key(self) -> Hashable:
+        """Quotes stop being new once a day, and become new on a refresh, which changes the quotes anyway."""
+        return self.boost, self.days, datetime.now(UTC).date()
+
+    def weights(self, quotes: QuoteStore, state: QuoteState) -> Sequence[float]:
+        """Each new quote is weighted by the boost, everything else by one."""
+        new = state.added_since(datetime.now(UTC) - timedelta(days=self.days))
+        return [self.boost if k in new else 1.0 for k in quotes]
+
+
+class Combined:
+    """Several policies at once, a quote's weight is the product of its weights from each."""
+
+    def __init__(self, *policies: WeightPolicy) -> None:
+        """Combine the given policies."""
+        self.policies = policies
+
+    def key(self) -> Hashable:
+        """Our weights change whenever any of theirs do."""
+        return tuple(policy.key() for policy in self.policies)
+
+    def weights(self, quotes: QuoteStore, state: QuoteState) -> Sequence[float]:
+        """Multiply together the weights of every policy."""
+        weights = [1.0] * len(quotes)
+        for policy in self.policies:
+            weights = [a * b for a, b in zip(weights, policy.weights(quotes, state), strict=True)]
+        return weights
+
+
+QUOTE_WEIGHTING: WeightPolicy | None = None
+"How to weight quotes when picking one at random, e.g. `Combined(Staleness(), SubmitterBalance())`, None for the deck."
+
+_alias_table: tuple[Hashable, AliasTable] | None = None
+"The alias table for QUOTE_WEIGHTING, and what it was built from, see `alias_table()`."
+
+
+def alias_table(quotes: QuoteStore, policy: WeightPolicy, state: QuoteState) -> AliasTable:
+    """
+    Gets the alias table for the given quotes and policy, only rebuilding it when either has changed.
+
+    :returns: A table to draw the positions (less one) of quotes from.
+    :rtype: AliasTable
     """
-    Selects a random quote from the given dictionary.
+    global _alias_table  # noqa: PLW0603
+    key = (quotes.digest if quotes.digest is not None else id(quotes), policy, policy.key())
+    if _alias_table is None or _alias_table[0] != key:
+        _alias_table = key, AliasTable(policy.weights(quotes, state))
+    return _alias_table[1]
+
+
+def draw_weighted(quotes: QuoteStore, state: QuoteState, usable: Callable[[str], bool], channel: int = 0) -> str | None:
+    """
+    Draws a usable quote according to QUOTE_WEIGHTING, and logs its appearance in the channel.
+
+    Unusable quotes are simply redrawn, so the odds among the usable ones are unchanged.
+    :returns: The quote drawn, or None if we could not find a usable one.
+    :rtype: Optional[str]
+    """
+    if QUOTE_WEIGHTING is None or not quotes:
+        return None
+    try:
+        table = alias_table(quotes, QUOTE_WEIGHTING, state)
+    except ValueError:
+        logging.getLogger("draw_weighted").exception("Could not weight the quotes, using the deck instead:")
+        return None
+    for _ in range(WEIGHTED_DRAW_ATTEMPTS):
+        if usable(quote := quotes.identifier(table.sample() + 1)):
+            state.record(quote, channel)
+            return quote
+    return None
+
+
+@timed()
+def pull_random_quote(quotes: QuoteStore, channel: int = 0) -> tuple[Quote, int]:
+    """
+    Selects a random quote from the given store, for the given channel.
 
     Currently, ignores the last QUOTE_REPEAT_DELAY quotes.
-    We reference the deck of current quotes for which are good to use and update it.
+    We draw according to QUOTE_WEIGHTING if we have one, otherwise (or if that fails) we draw the next usable quote
+    from the channel's shuffled deck, dealing a new one whenever it runs out.
     :returns: A Quote(submitter, quote, attribution = None, source = None) and its position in the full list.
     :rtype: Quote, int
     """
-    recent = QUOTE_HISTORY_PATH.read_text(encoding="utf8").splitlines()[-QUOTE_REPEAT_DELAY:]
-    rs, deck = set(recent), current_deck()
-    good_q = [(i, k) for i, k in enumerate(quotes, 1) if k not in rs and k in deck]
+    state = quote_state()
+    rs = set(state.recent(QUOTE_REPEAT_DELAY, channel))
 
-    quote_index, quote = random.choice(good_q)
-    deck.remove(quote)
-    recent.append(quote)
+    def usable(k: str) -> bool:
+        """Is this quote still around, and not one we have seen recently?"""
+        return k in quotes and k not in rs
 
-    # I think we can actually put reference to the Eggs here?
+    quote = draw_weighted(quotes, state, usable, channel)
+    if quote is None:
+        quote = state.draw(usable, channel)
+    if quote is None:
+        state.deal(quotes, channel)
+        quote = state.draw(usable, channel)
+    if quote is None:  # Every quote is a recent one, better to repeat one than to have none at all
+        state.deal(quotes, channel)
+        quote = state.draw(quotes.__contains__, channel)
+    quote_index = quotes.position(quote)
 
-    # get the eggs
-    eggs = egg_hunting()
-    # if quote is one of the eggs
-    for egg in eggs.values():
-        if egg.quote_id == quote:
-    # return the id attached to that egg
-            quote_index = egg.quote_num
-
-    QUOTE_HISTORY_PATH.write_text("\n".join(recent), encoding="utf8")
-    QUOTE_DECK_PATH.write_text("\n".join(deck - rs), encoding="utf8")
+    # If the quote is one of the eggs, we return the number attached to that egg instead
+    if (egg := egg_for(quote)) is not None:
+        quote_index = egg.quote_num
 
     return quotes[quote], quote_index
 
 
-def pull_quotes_from_file() -> tuple[dict[str, Quote], dict[str, dict[str, Any]]]:
+def save_snapshot(quotes: QuoteStore, duds: dict[str, dict[str, Any]]) -> None:
+    """Writes QUOTE_SNAPSHOT_PATH from the quotes (and duds) we just loaded from QUOTE_FILE_PATH."""
+    write_snapshot(
+        QUOTE_SNAPSHOT_PATH,
+        QUOTE_FILE_PATH,
+        quotes.digest or content_digest(""),
+        (Row(k, *q, quotes.table_digest(k)) for k, q in quotes.items()),
+        tomli_w.dumps(duds),
+    )
+
+
+def pull_quotes_from_file() -> tuple[QuoteStore, dict[str, dict[str, Any]]]:
     """
     Pulls the quotes from a local file at QUOTE_FILE_PATH.
 
-    :returns: The dictionary of quotes and a dictionary of not-quite quotes
-    :rtype: dict[str, Quote], dict[str, Quote]
+    Whenever QUOTE_SNAPSHOT_PATH was made from the same file, we map that instead of parsing anything,
+    otherwise a large file is parsed across all our cores with `parse_quotes()`.
+    :returns: The store of quotes and a dictionary of not-quite quotes
+    :rtype: QuoteStore, dict[str, Quote]
+    """
+    if (snapshot := open_snapshot(QUOTE_SNAPSHOT_PATH, QUOTE_FILE_PATH, Quote._make)) is not None:
+        return QuoteStore.from_snapshot(snapshot), tomllib.loads(snapshot.duds)
+    quotes, duds = parse_quotes(QUOTE_FILE_PATH.read_bytes().decode("utf8"), logging.getLogger("pull_quotes_from_file"))
+    save_snapshot(quotes, duds)
+    return quotes, duds
+
+
+def read_validators() -> dict[str, str]:
+    """
+    Reads the cache validators we stored for QUOTE_FILE_ADDRESS, if we have any.
+
+    :returns: Dictionary that may contain an "etag" and a "last_modified".
+    :rtype: dict[str, str]
     """
-    return as_quotes(QUOTE_FILE_PATH.read_text(encoding="utf8"), logging.getLogger("pull_quotes_from_file"))
+    try:
+        validators = tomllib.loads(QUOTE_VALIDATORS_PATH.read_text(encoding="utf8"))
+    except (OSError, tomllib.TOMLDecodeError):
+        return {}
+    return {k: v for k, v in validators.items() if k in {"etag", "last_modified"} and isinstance(v, str)}
+
+
+def write_validators(etag: str | None, last_modified: str | None) -> None:
+    """Stores the cache validators for QUOTE_FILE_ADDRESS alongside QUOTE_FILE_PATH."""
+    validators = {k: v for k, v in (("etag", etag), ("last_modified", last_modified)) if v is not None}
+    write_toml(QUOTE_VALIDATORS_PATH, validators)
+
+
+def conditional_headers() -> dict[str, str]:
+    """
+    Builds the headers for a conditional GET of QUOTE_FILE_ADDRESS.
+
+    We only send validators when we have a local copy to fall back on, as a 304 gives us nothing else.
+    :returns: The If-None-Match and If-Modified-Since headers, when we have them.
+    :rtype: dict[str, str]
+    """
+    if not _current_quotes and (not QUOTE_FILE_PATH.is_file() or QUOTE_FILE_PATH.stat().st_size == 0):
+        return {}
+    validators = read_validators()
+    headers = {}
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+class CircuitBreaker:
+    """
+    Stops us waiting on a remote that keeps failing, first backing off exponentially, then not trying at all (open).
+
+    Once the cooldown is over, one try is let through (half open), which closes the circuit if it works,
+    or opens it again if not.
+    """
+
+    def __init__(
+        self,
+        backoff: float = QUOTE_BACKOFF,
+        limit: float = QUOTE_BACKOFF_LIMIT,
+        threshold: int = QUOTE_BREAKER_FAILURES,
+        cooldown: float = QUOTE_BREAKER_COOLDOWN,
+    ) -> None:
+        """A closed circuit, with the given backoff (doubling up to limit), opening for cooldown after threshold."""
+        self.backoff, self.limit, self.threshold, self.cooldown = backoff, limit, threshold, cooldown
+        self.failures = 0
+        "How many times in a row the remote has failed."
+        self.retry_at = 0.0
+        "When (by `time.monotonic()`) we may next try the remote."
+
+    @property
+    def is_open(self) -> bool:
+        """Has the remote failed so often we have stopped trying it?"""
+        return self.failures >= self.threshold
+
+    def allows(self) -> bool:
+        """
+        May we try the remote now?
+
+        :returns: Whether we are past any backoff or cooldown.
+        :rtype: bool
+        """
+        return time.monotonic() >= self.retry_at
+
+    def succeeded(self) -> None:
+        """The remote worked, so close the circuit."""
+        self.failures, self.retry_at = 0, 0.0
+
+    def failed(self) -> float:
+        """
+        The remote failed, so back off, or open the circuit if it has failed too often.
+
+        :returns: How long (in seconds) until we try it again.
+        :rtype: float
+        """
+        self.failures += 1
+        delay = self.cooldown if self.is_open else min(self.backoff * 2 ** (self.failures - 1), self.limit)
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+
+_repo_breaker = CircuitBreaker()
+"How QUOTE_FILE_ADDRESS has been doing lately, see `pull_quotes_from_repo()`."
+
 
+async def http_session() -> "aiohttp.ClientSession":
+    """
+    Gets the shared HTTP session, opening it on first use (it must be made from within the event loop).
+
+    aiohttp is only imported then, as it is slow to import, and parse workers (and benchmarks) never need it.
+    :returns: A session that keeps its connections to QUOTE_FILE_ADDRESS alive between refreshes.
+    :rtype: aiohttp.ClientSession
+    """
+    global _http_session  # noqa: PLW0603
+    if _http_session is None or _http_session.closed:
+        import aiohttp  # noqa: PLC0415
+
+        _http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=QUOTE_FETCH_TIMEOUT))
+    return _http_session
+
+
+async def close_http_session() -> None:
+    """Closes the shared HTTP session, if we ever opened it."""
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
 
-def pull_quotes_from_repo() -> tuple[dict[str, Quote], dict[str, dict[str, Any]]]:
+
+class Pulled(NamedTuple):
+    """What we pulled from QUOTE_FILE_ADDRESS, see `pull_quotes_from_repo()`."""
+
+    text: str | None
+    "The TOML-format text of the quotes (empty if unreachable), or None if unmodified (or not tried)."
+    etag: str | None = None
+    "The ETag it was sent with, to store once we have kept the text, see `write_validators()`."
+    last_modified: str | None = None
+    "The Last-Modified it was sent with, stored likewise."
+
+
+@timed()
+async def pull_quotes_from_repo() -> Pulled:
     """
-    Pulls updated quotes from the repository.
+    Pulls the updated quote file from the repository, if it has changed since we last pulled it.
 
-    :returns: Updated quotes as a dictionary of quotes and a dictionary of not-quite quotes.
-    :rtype: dict[str, Quote], dict[str, Quote]
+    Never blocks the event loop, disk access is done in a worker thread.
+    If the repository keeps failing, we back off from it, then stop trying it for a while, see `CircuitBreaker`.
+    The validators it was sent with are only stored by whoever keeps the text, as until QUOTE_FILE_PATH matches them,
+    each 304 they get us would leave us with an older copy.
+    :returns: The text of the quotes, and its validators, if any.
+    :rtype: Pulled
     """
     logger = logging.getLogger("pull_quotes_from_repo")
-    updated_quotes = ""
+    if not _repo_breaker.allows():
+        count("repo_skipped")
+        logger.info(f"Not trying {QUOTE_FILE_ADDRESS}, it has failed {_repo_breaker.failures} times in a row")
+        return Pulled(None)
+    pulled, failed = Pulled(""), True
     try:
         logger.info(f"Updating quotes from: {QUOTE_FILE_ADDRESS}")
-        req = requests.get(QUOTE_FILE_ADDRESS, timeout=10)
-        if req.status_code != 200:
-            logger.error(f"Failed to get {QUOTE_FILE_ADDRESS} with status: {req.status_code}")
-        else:
-            updated_quotes = req.text
+        headers = await asyncio.to_thread(conditional_headers)
+        session = await http_session()
+        async with session.get(QUOTE_FILE_ADDRESS, headers=headers) as req:
+            count(f"repo_status_{req.status}")
+            if req.status == 304:
+                logger.info(f"{QUOTE_FILE_ADDRESS} has not been modified")
+                pulled, failed = Pulled(None), False
+            elif req.status != 200:
+                logger.error(f"Failed to get {QUOTE_FILE_ADDRESS} with status: {req.status}")
+            else:
+                text = await req.text(encoding="utf8")
+                pulled, failed = Pulled(text, req.headers.get("ETag"), req.headers.get("Last-Modified")), False
     except Exception:
+        count("pull_quotes_from_repo_errors")
         logger.exception("Exception while getting updated quotes:")
 
-    return as_quotes(updated_quotes, logger)
+    if not failed:
+        _repo_breaker.succeeded()
+        return pulled
+    delay = _repo_breaker.failed()
+    if _repo_breaker.is_open:
+        count("repo_circuit_opened")
+        logger.error(f"{QUOTE_FILE_ADDRESS} has failed {_repo_breaker.failures} times in a row, leaving it {delay}s")
+    else:
+        logger.warning(f"Backing off from {QUOTE_FILE_ADDRESS} for {delay}s")
+    return pulled
 
 
-def current_deck() -> set[str]:
-    """Get the deck of quotes we can use next."""
-    deck = set(QUOTE_DECK_PATH.read_text(encoding="utf8").splitlines())
-    if not deck:
-        quotes, _ = pull_quotes_from_file()
-        deck.update(quotes)
-        QUOTE_DECK_PATH.write_text("\n".join(deck), encoding="utf8")
-    return deck
+@functools.cache
+def quote_state() -> QuoteState:
+    """
+    Opens QUOTE_STATE_PATH, the first time we need it, importing the old text files if we have not yet.
 
+    :returns: The deck, history, and duds.
+    :rtype: QuoteState
+    """
+    state = QuoteState(QUOTE_STATE_PATH)
+    if state.migrate_text_files(QUOTE_DECK_PATH, QUOTE_HISTORY_PATH):
+        logging.getLogger("quote_state").info(f"Imported {QUOTE_DECK_PATH} and {QUOTE_HISTORY_PATH}")
+    return state
+
+
+def single_flight(func: Callable[[], Awaitable[T]]) -> Callable[[], Awaitable[T]]:
+    """
+    Coalesces concurrent calls of a coroutine function, so only one is ever in flight.
 
-async def refresh_quotes() -> dict[str, Quote]:
+    Anyone calling while it is in flight waits for that call, sharing its result (or exception), rather than
+    doing the work again alongside it. A waiter being cancelled does not cancel the call for everyone else.
+    :returns: The coalesced coroutine function.
+    :rtype: Callable[[], Awaitable[T]]
+    """
+    in_flight: asyncio.Future[T] | None = None
+    coalesced_count = f"{func.__name__}_coalesced"
+
+    def landed(future: asyncio.Future[T]) -> None:
+        """Let the next call start afresh, now this one is done."""
+        nonlocal in_flight
+        if in_flight is future:
+            in_flight = None
+
+    @functools.wraps(func)
+    async def coalesced() -> T:
+        """Join the call in flight, or start one."""
+        nonlocal in_flight
+        if in_flight is None:
+            in_flight = asyncio.ensure_future(func())
+            in_flight.add_done_callback(landed)
+        else:
+            count(coalesced_count)
+        return await asyncio.shield(in_flight)
+
+    return coalesced
+
+
+def save_duds(duds: dict[str, dict[str, Any]]) -> None:
+    """Keeps the not-quite quotes in QUOTE_STATE_PATH, as TOML, so we can tell someone about them."""
+    quote_state().set_duds({k: tomli_w.dumps({k: dud}) for k, dud in duds.items()})
+
+
+def check_duplicates(diff: QuoteDiff, old: Mapping[str, Quote], new: Mapping[str, Quote]) -> list[Duplicate]:
+    """
+    Checks what was added or changed in a refresh for duplicates, keeping them with the duds for the dud report.
+
+    The quotes are only all filed the first time something changes, rather than slowing down start up.
+    :returns: The likely duplicates.
+    :rtype: list[Duplicate]
+    """
+    global _duplicate_index  # noqa: PLW0603
+    if _duplicate_index is None:
+        _duplicate_index = DuplicateIndex(old)
+    found = _duplicate_index.apply(diff, new)
+    forget = [k for k, _ in diff.removals] + [k for k, *_ in diff.changed]
+    if found or forget:
+        quote_state().update_duplicates(found, forget)
+    return found
+
+
+async def current_quotes() -> QuoteStore:
+    """
+    Gets the quotes as of our last refresh, loading them from QUOTE_FILE_PATH (never the repo) if we have none yet.
+
+    :returns: The quotes we have locally.
+    :rtype: QuoteStore
+    """
+    return _current_quotes if _current_quotes is not None else await load_quotes()
+
+
+@single_flight
+async def load_quotes() -> QuoteStore:
+    """
+    Loads the quotes from QUOTE_FILE_PATH, unless we already have.
+
+    Everyone asking for quotes while we start up waits on the one load.
+    What we work out from them (renders, submitter stats, and indexes) waits until something first needs it.
+    :returns: The quotes we have locally.
+    :rtype: QuoteStore
+    """
+    global _current_quotes, _quote_renders
+    if _current_quotes is None:
+        logger = logging.getLogger("current_quotes")
+        quotes, duds = await asyncio.to_thread(pull_quotes_from_file)
+        if len(duds):
+            logger.error(f"We have {len(duds)} dud quotes, adding to {QUOTE_STATE_PATH}")
+            await asyncio.to_thread(save_duds, duds)
+        await asyncio.to_thread(reload_eggs)
+        check_eggs(quotes)
+        _current_quotes, _quote_renders = quotes, QuoteRenders()
+    return _current_quotes
+
+
+async def build_from_current(build: Callable[[QuoteStore], T]) -> T:
+    """
+    Builds something (such as an index) from our current quotes, away from the event loop.
+
+    A refresh only keeps up to date what was built before it swapped the quotes,
+    so if it swaps them while we build, we build again from the new ones.
+    :returns: What was built, from the quotes that are current now.
+    :rtype: T
+    """
+    while True:
+        quotes = await current_quotes()
+        built = await asyncio.to_thread(build, quotes)
+        if quotes is _current_quotes:
+            return built
+
+
+async def submitter_stats() -> SubmitterStats:
+    """
+    Gets the submitter statistics for our current quotes, without refreshing them, counting them the first time.
+
+    :returns: How many quotes each submitter has given us.
+    :rtype: SubmitterStats
+    """
+    return _submitter_stats if _submitter_stats is not None else await load_submitter_stats()
+
+
+@single_flight
+async def load_submitter_stats() -> SubmitterStats:
+    """
+    Counts the submitters, unless we already have, rather than slowing down start up for it.
+
+    Everyone asking for #authors while they are counted waits on the one count.
+    :returns: How many quotes each submitter has given us.
+    :rtype: SubmitterStats
+    """
+    global _submitter_stats  # noqa: PLW0603
+    if _submitter_stats is None:
+        _submitter_stats = await build_from_current(SubmitterStats)
+    return _submitter_stats
+
+
+async def rendered_quote(quote: Quote) -> Rendered:
+    """
+    Gets a quote ready to send, without refreshing our quotes.
+
+    :returns: Its text, its source if we can link to it, and whether we embed it.
+    :rtype: Rendered
+    """
+    await current_quotes()
+    return _quote_renders.get(quote)
+
+
+async def search_index() -> SearchIndex:
+    """
+    Gets the search index for our current quotes, without refreshing them, building it the first time.
+
+    :returns: An index of the words in each quote.
+    :rtype: SearchIndex
+    """
+    return _search_index if _search_index is not None else await load_search_index()
+
+
+@single_flight
+async def load_search_index() -> SearchIndex:
+    """
+    Builds the search index, unless we already have, rather than slowing down start up for it.
+
+    Everyone searching while it is built waits on the one build.
+    :returns: An index of the words in each quote.
+    :rtype: SearchIndex
+    """
+    global _search_index  # noqa: PLW0603
+    if _search_index is None:
+        _search_index = await build_from_current(SearchIndex)
+    return _search_index
+
+
+async def prefix_index() -> PrefixIndex:
+    """
+    Gets the prefix index for our current quotes, without refreshing them, building it the first time.
+
+    :returns: An index of the identifiers and submitters of each quote.
+    :rtype: PrefixIndex
+    """
+    return _prefix_index if _prefix_index is not None else await load_prefix_index()
+
+
+@single_flight
+async def load_prefix_index() -> PrefixIndex:
+    """
+    Builds the prefix index, unless we already have, rather than slowing down start up for it.
+
+    Everyone completing an ID while it is built waits on the one build.
+    :returns: An index of the identifiers and submitters of each quote.
+    :rtype: PrefixIndex
+    """
+    global _prefix_index  # noqa: PLW0603
+    if _prefix_index is None:
+        _prefix_index = await build_from_current(PrefixIndex)
+    return _prefix_index
+
+
+def log_diff(diff: QuoteDiff, logger: logging.Logger) -> None:
+    """Logs what changed in a refresh, a line for each quote added or removed, and both versions of each changed."""
+    for k, (submitter, quote, *opt) in diff.additions:
+        logger.info(f"+ [{k}] {submitter}{'; '.join(map(str, filter(None, opt)))}: {quote}")
+    for k, (submitter, quote, *opt) in diff.removals:
+        logger.info(f"- [{k}] {submitter}{'; '.join(map(str, filter(None, opt)))}: {quote}")
+    for k, (submitter, quote, *opt), (old_s, old_q, *old_opt) in diff.changed:
+        logger.info(f"- [{k}] {old_s}{'; '.join(map(str, filter(None, old_opt)))}: {old_q}")
+        logger.info(f"+ [{k}] {submitter}{'; '.join(map(str, filter(None, opt)))}: {quote}")
+
+
+async def updated_prefix_index(diff: QuoteDiff, updated: QuoteStore) -> PrefixIndex | None:
+    """
+    Gets the prefix index ready for the quotes a refresh is about to swap to, away from the event loop.
+
+    It is only rebuilt if any IDs or submitters changed, and only if anyone has been completing IDs,
+    otherwise it is not built until someone does.
+    :returns: The prefix index to swap to along with the quotes, if any.
+    :rtype: Optional[PrefixIndex]
+    """
+    additions, removals, changed = diff
+    if _prefix_index is None or not (additions or removals or any(q.submitter != o.submitter for _, q, o in changed)):
+        return _prefix_index
+    return await asyncio.to_thread(PrefixIndex, updated)
+
+
+def apply_diff(diff: QuoteDiff, prefixes: PrefixIndex | None) -> None:
+    """
+    Brings everything we have built from the quotes up to date with a refresh, as it swaps to the new ones.
+
+    This must be done in the same step as the swap (never awaiting in between), so nothing built from the old quotes
+    is kept without the diff, see `build_from_current()`.
+    """
+    global _prefix_index  # noqa: PLW0603
+    if _submitter_stats is not None:
+        _submitter_stats.apply(diff)
+    _quote_renders.apply(diff)
+    if _search_index is not None:
+        _search_index.apply(diff)
+    _prefix_index = prefixes
+
+
+@single_flight
+@timed()
+async def refresh_quotes() -> QuoteStore:
     """
     Overwrites QUOTE_FILE_PATH with any updates.
 
     If we cannot reach the repo, we always fallback to local.
-    Probably don't call this one from two different threads.
-    :returns: The most up-to-date dict of quotes we can access.
-    :rtype: dict[str, Quote]
+    All network, disk, and parsing work is kept off the event loop, so commands are answered while we refresh.
+    Calls made while a refresh is in flight share it, so a burst of commands costs one fetch, and only that one
+    refresh ever writes our files or applies its changes, see `single_flight()`.
+    Deck and history changes all go through the one QuoteState, a transaction at a time.
+    Probably don't call this one from two different threads (each with its own event loop).
+    :returns: The most up-to-date store of quotes we can access.
+    :rtype: QuoteStore
     """
+    global _current_quotes, _revalidated_at  # noqa: PLW0603
     logger = logging.getLogger("refresh_quotes")
-    deck = current_deck()
-    quotes, duds = pull_quotes_from_file()
-    updated_quotes, updated_duds = pull_quotes_from_repo()
-    duds |= updated_duds
-    if len(duds):
-        logger.error(f"We have {len(duds)} dud quotes, adding to {QUOTE_DUD_PATH}")
-        with QUOTE_DUD_PATH.open("wb") as f:
-            tomli_w.dump(duds, f)
-    if updated_quotes == {}:
+    _revalidated_at = time.monotonic()
+    pulled = await pull_quotes_from_repo()
+    updated_text = pulled.text
+    if _current_quotes is not None and await asyncio.to_thread(reload_eggs):
+        check_eggs(_current_quotes)
+    quotes = await current_quotes()
+    if updated_text is None:
+        return quotes
+    if not updated_text:
         logger.info(f"{QUOTE_FILE_ADDRESS} was empty")
         return quotes
-    if quotes == updated_quotes:
+    if content_digest(updated_text) == quotes.digest:
         logger.info(f"{QUOTE_FILE_PATH} and {QUOTE_FILE_ADDRESS} are the same")
+        await asyncio.to_thread(write_validators, pulled.etag, pulled.last_modified)
         return quotes
-    if quotes == {}:
+
+    updated_quotes, duds = await asyncio.to_thread(as_quotes, updated_text, logger, quotes)
+    if len(duds):
+        logger.error(f"We have {len(duds)} dud quotes, adding to {QUOTE_STATE_PATH}")
+        await asyncio.to_thread(save_duds, duds)
+    if not updated_quotes:
+        logger.info(f"{QUOTE_FILE_ADDRESS} was empty")
+        return quotes
+    if not quotes:
         logger.info(f"{QUOTE_FILE_PATH} was empty")
 
-    additions = [(k, q) for k, q in updated_quotes.items() if k not in quotes]
-    removals = [(k, q) for k, q in quotes.items() if k not in updated_quotes]
-    changed = [(k, q, quotes[k]) for k, q in updated_quotes.items() if k in quotes and q != quotes[k]]
+    diff = await asyncio.to_thread(diff_quotes, quotes, updated_quotes)
+    log_diff(diff, logger)
 
-    for k, (submitter, quote, *opt) in additions:
-        logger.info(f"+ [{k}] {submitter}{'; '.join(map(str, filter(None, opt)))}: {quote}")
-    for k, (submitter, quote, *opt) in removals:
-        logger.info(f"- [{k}] {submitter}{'; '.join(map(str, filter(None, opt)))}: {quote}")
-    for k, (submitter, quote, *opt), (old_s, old_q, *old_opt) in changed:
-        logger.info(f"- [{k}] {old_s}{'; '.join(map(str, filter(None, old_opt)))}: {old_q}")
-        logger.info(f"+ [{k}] {submitter}{'; '.join(map(str, filter(None, opt)))}: {quote}")
+    # We keep the file exactly as the repo has it, so its digest matches next time
+    await asyncio.to_thread(QUOTE_FILE_PATH.write_bytes, updated_text.encode("utf8"))
+    await asyncio.to_thread(save_snapshot, updated_quotes, duds)
+    # Stored only now we have kept the quotes, so failing before here fetches them again, rather than a 304
+    await asyncio.to_thread(write_validators, pulled.etag, pulled.last_modified)
 
-    if quotes != updated_quotes:
-        with QUOTE_FILE_PATH.open("wb") as f:
-            tomli_w.dump(as_dicts(updated_quotes), f)
+    if diff.additions or diff.removals:
+        await asyncio.to_thread(
+            quote_state().update_deck, additions=[k for k, _ in diff.additions], removals=[k for k, _ in diff.removals]
+        )
+    prefixes = await updated_prefix_index(diff, updated_quotes)
+    for k, duplicate_of, similarity in await asyncio.to_thread(check_duplicates, diff, quotes, updated_quotes):
+        logger.warning(f"[{k}] looks like a duplicate of [{duplicate_of}] ({similarity:.0%} similar)")
 
-    deck -= {k for k, _ in removals}
-    deck |= {k for k, _ in additions}
-    QUOTE_DECK_PATH.write_text("\n".join(deck), encoding="utf8")
+    # Swap to the snapshot we just wrote, so we only keep the quotes we use in memory
+    _current_quotes, _ = await asyncio.to_thread(pull_quotes_from_file)
+    apply_diff(diff, prefixes)
+    check_eggs(_current_quotes)
+    return _current_quotes
 
-    return updated_quotes
+
+async def revalidate_quotes() -> None:
+    """Refreshes the quotes in the background, where there is no one to raise to, so any error is logged instead."""
+    try:
+        await refresh_quotes()
+    except Exception:
+        logging.getLogger("refresh_quotes").exception("Error while refreshing quotes in the background:")
+
+
+async def cached_quotes() -> QuoteStore:
+    """
+    Gets the quotes straight away, for commands, refreshing them in the background if they are stale.
+
+    They are stale once QUOTE_FRESHNESS has passed since a refresh last started, however that went,
+    so how QUOTE_FILE_ADDRESS is doing never holds up a command (see `CircuitBreaker` for when it is down).
+    :returns: The quotes we have now, any changes the refresh finds are there for whoever asks next.
+    :rtype: QuoteStore
+    """
+    global _revalidation  # noqa: PLW0603
+    quotes = await current_quotes()
+    stale = _revalidated_at is None or time.monotonic() - _revalidated_at >= QUOTE_FRESHNESS
+    if stale and (_revalidation is None or _revalidation.done()):
+        _revalidation = asyncio.create_task(revalidate_quotes())
+    return quotes
@@ -0,0 +1,126 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`schedule.py` runs our daily jobs (the quote, the lucky colour, the dud report) on time.
+
+Rather than waking up every so often to check the clock, we work out when the next job is due and sleep until then.
+When each job last ran is kept in the state database, so a job that was missed while we were down is caught up
+as soon as we are back, as long as it is not too late for it.
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Hashable, Sequence
+from datetime import UTC, datetime, time, timedelta
+from typing import NamedTuple, NoReturn
+
+from state import QuoteState
+
+DAY = timedelta(days=1)
+"How often each job runs."
+
+SCHEDULER_CONCURRENCY = 100
+"How many jobs we run at once, each from a different group (e.g. channel)."
+
+
+class Job(NamedTuple):
+    """Something to do at the same time every day."""
+
+    name: str
+    "What the job is called, its last run is kept under this name."
+    at: time
+    "When to run it each day, in UTC."
+    run: Callable[[], Awaitable[None]]
+    grace: timedelta = timedelta(hours=12)
+    "How late a missed run can still be caught up, after that we wait for the next one."
+    group: Hashable = None
+    "Jobs in the same group (e.g. for the same channel) run one after another, different groups run concurrently."
+    after: tuple[str, ...] = ()
+    "Jobs (by name, in other groups) that must have finished first, whenever they are due at the same time as this."
+
+    def previous_fire(self, now: datetime) -> datetime:
+        """
+        When was this job last meant to run?
+
+        :returns: The latest time this job was scheduled for, at or before now.
+        :rtype: datetime
+        """
+        fire = datetime.combine(now.date(), self.at, tzinfo=UTC)
+        return fire if fire <= now else fire - DAY
+
+    def next_fire(self, now: datetime) -> datetime:
+        """
+        When is this job next meant to run?
+
+        :returns: The earliest time this job is scheduled for, after now.
+        :rtype: datetime
+        """
+        return self.previous_fire(now) + DAY
+
+
+class Scheduler:
+    """Runs each of its jobs when it is due, jobs due together run in the order given within their group."""
+
+    def __init__(self, state: QuoteState, jobs: Sequence[Job], concurrency: int = SCHEDULER_CONCURRENCY) -> None:
+        """Schedule the given jobs, keeping when they last ran in state, running up to concurrency groups at once."""
+        self.state = state
+        self.jobs = jobs
+        self._limit = asyncio.Semaphore(concurrency)
+
+    def due(self, now: datetime) -> list[Job]:
+        """
+        Which jobs should be run now, including any that were missed but are still within their grace?
+
+        A job we have never seen before is not due until its next fire, as we have no idea what it missed.
+        :returns: The jobs to run, in order.
+        :rtype: list[Job]
+        """
+        due, unseen, last_runs = [], {}, self.state.last_runs()
+        for job in self.jobs:
+            if (last_run := last_runs.get(job.name)) is None:
+                unseen[job.name] = now
+            elif last_run < (fire := job.previous_fire(now)) and now - fire <= job.grace:
+                due.append(job)
+        if unseen:
+            self.state.set_last_runs(unseen)
+        return due
+
+    async def run_due(self, now: datetime) -> None:
+        """Runs any jobs that are due as of now, a group at a time but many groups at once."""
+        groups: dict[Hashable, list[Job]] = {}
+        for job in self.due(now):
+            groups.setdefault(job.group, []).append(job)
+        finished = {job.name: asyncio.Event() for jobs in groups.values() for job in jobs}
+        await asyncio.gather(*(self._run_group(jobs, finished) for jobs in groups.values()))
+
+    async def _run_group(self, jobs: list[Job], finished: dict[str, asyncio.Event]) -> None:
+        """
+        Runs a group of jobs in order, each once the jobs it is after have finished (if they were due too).
+
+        We note that each has run even if it failed, so we never retry in a loop.
+        Each job waits before it takes a place in our limit, so it can never hold up the jobs it is waiting on.
+        """
+        logger = logging.getLogger("scheduler")
+        for job in jobs:
+            await asyncio.gather(*(finished[name].wait() for name in job.after if name in finished))
+            try:
+                async with self._limit:
+                    logger.info(f"Running {job.name}, scheduled for {job.at.isoformat()}")
+                    try:
+                        await job.run()
+                    except Exception:
+                        logger.exception(f"Error running {job.name}")
+                    await asyncio.to_thread(self.state.set_last_runs, {job.name: datetime.now(UTC)})
+            finally:
+                finished[job.name].set()
+
+    async def run(self) -> NoReturn:
+        """Runs the jobs forever, sleeping until exactly when the next one is due."""
+        logger = logging.getLogger("scheduler")
+        while True:
+            now = datetime.now(UTC)
+            await self.run_due(now)
+            # Woken from when we started, so anything that came due while those jobs ran is run straight away
+            wake = min((job.next_fire(now) for job in self.jobs), default=now + DAY)
+            logger.debug(f"Sleeping until {wake.isoformat()}")
+            await asyncio.sleep(max((wake - datetime.now(UTC)).total_seconds(), 0))
@@ -0,0 +1,223 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`search.py` finds quotes by the words in them, for #search, and by how their identifier or submitter starts,
+for autocompleting slash commands.
+
+Every word of each quote, its attribution, and its submitter, is kept in an inverted index (word -> the quotes with it),
+so a search only looks at the quotes that have the words searched for, ranked by BM25.
+Those quotes are looked at best first, so a search stops as soon as nothing left could make the results,
+even for words that most quotes have.
+The index is built once, then kept up to date from each QuoteDiff, rather than rebuilt.
+"""
+
+import heapq
+import itertools
+import math
+import re
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Iterator, Mapping
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from quotes import Quote, QuoteDiff
+
+RE_WORD = re.compile(r"\w+")
+"What counts as a word, for searching."
+
+FIELD_WEIGHTS = {"quote": 1, "attribution": 2, "submitter": 2}
+"How much more a word counts for in each field, so searching for who said it finds what they said first."
+
+BM25_K1 = 1.2
+"How quickly repeating a word stops making a quote more relevant."
+
+BM25_B = 0.75
+"How much longer quotes are penalised, for being more likely to have any given word."
+
+SEARCH_RESULTS = 5
+"How many quotes a search gives, at most."
+
+AUTOCOMPLETE_RESULTS = 25
+"How many quotes we suggest as someone types, which is as many as Discord will show."
+
+
+def words(text: str | None) -> list[str]:
+    """
+    Splits text into the words we search by, ignoring case.
+
+    :returns: The words, in order, repeats included.
+    :rtype: list[str]
+    """
+    return RE_WORD.findall(text.casefold()) if text else []
+
+
+def quote_terms(quote: "Quote") -> Counter[str]:
+    """
+    Weighs each word in a quote by how often, and in which fields, it appears.
+
+    :returns: Word -> its weighted count in the quote.
+    :rtype: Counter[str]
+    """
+    terms: Counter[str] = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for word in words(getattr(quote, field)):
+            terms[word] += weight
+    return terms
+
+
+class SearchResult(NamedTuple):
+    """A quote that matched a search."""
+
+    identifier: str
+    "Which quote."
+    score: float
+    "How well it matched, higher is better."
+
+
+class SearchIndex:
+    """An inverted index of our quotes, kept up to date from each QuoteDiff rather than rebuilt."""
+
+    def __init__(self, quotes: Mapping[str, "Quote"] | None = None) -> None:
+        """Index each of the given quotes, this is the only time we look at all of them."""
+        self._postings: dict[str, dict[str, int]] = {}
+        "Word -> identifier -> weighted count of the word in that quote."
+        self._lengths: dict[str, int] = {}
+        "Identifier -> total weighted count of the words in that quote."
+        self._total_length = 0
+        "The sum of _lengths, so we know the average."
+        self._impacts: dict[str, list[tuple[float, str]]] = {}
+        "Word -> (BM25 score for the word, identifier) for each quote with it, best first, see `_impact()`."
+        for identifier, quote in (quotes or {}).items():
+            self.add(identifier, quote)
+
+    def __len__(self) -> int:
+        """How many quotes are indexed?"""
+        return len(self._lengths)
+
+    def add(self, identifier: str, quote: "Quote") -> None:
+        """Index a quote we now have."""
+        terms = quote_terms(quote)
+        for word, n in terms.items():
+            self._postings.setdefault(word, {})[identifier] = n
+        length = self._lengths[identifier] = terms.total()
+        self._total_length += length
+        self._impacts.clear()  # Every score depends on the average length, so none are right any more
+
+    def remove(self, identifier: str, quote: "Quote") -> None:
+        """Forget a quote (as it was when indexed) that we no longer have."""
+        for word in quote_terms(quote):
+            if (posting := self._postings.get(word)) is not None:
+                posting.pop(identifier, None)
+                if not posting:
+                    del self._postings[word]
+        self._total_length -= self._lengths.pop(identifier, 0)
+        self._impacts.clear()
+
+    def apply(self, diff: "QuoteDiff") -> None:
+        """Updates the index from what changed in a refresh."""
+        for identifier, quote in diff.removals:
+            self.remove(identifier, quote)
+        for identifier, quote, old_quote in diff.changed:
+            self.remove(identifier, old_quote)
+            self.add(identifier, quote)
+        for identifier, quote in diff.additions:
+            self.add(identifier, quote)
+
+    def _score(self, word: str, identifier: str) -> float:
+        """The BM25 score of one word of a search, for a quote with it."""
+        posting = self._postings[word]
+        idf = math.log(1 + (len(self._lengths) - len(posting) + 0.5) / (len(posting) + 0.5))
+        norm = 1 - BM25_B + BM25_B * self._lengths[identifier] * len(self._lengths) / self._total_length
+        tf = posting[identifier]
+        return idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+    def _impact(self, word: str) -> list[tuple[float, str]]:
+        """
+        Ranks every quote with a word by how much the word alone scores for it, sorting only on first use.
+
+        :returns: (Score, identifier) for each quote with the word, best first.
+        :rtype: list[tuple[float, str]]
+        """
+        if (impact := self._impacts.get(word)) is None:
+            impact = sorted(((self._score(word, k), k) for k in self._postings[word]), reverse=True)
+            self._impacts[word] = impact
+        return impact
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS) -> list[SearchResult]:
+        """
+        Finds the quotes with every word of the query in them, ranked by BM25.
+
+        We go through the quotes with the rarest word, best first, and stop once even the best each other word could add
+        would not get a quote into the results.
+        :returns: Up to limit quotes, best match first.
+        :rtype: list[SearchResult]
+        """
+        terms = sorted(dict.fromkeys(words(query)), key=lambda word: len(self._postings.get(word, ())))
+        if not terms or limit < 1 or terms[0] not in self._postings:
+            return []
+        rarest, others = terms[0], terms[1:]
+        best_others = sum(self._impact(word)[0][0] for word in others)
+        found: list[tuple[float, str]] = []
+        for rarest_score, identifier in self._impact(rarest):
+            if len(found) == limit and rarest_score + best_others <= found[0][0]:
+                break
+            if all(identifier in self._postings[word] for word in others):
+                score = rarest_score + sum(self._score(word, identifier) for word in others)
+                if len(found) < limit:
+                    heapq.heappush(found, (score, identifier))
+                elif score > found[0][0]:
+                    heapq.heapreplace(found, (score, identifier))
+        return [SearchResult(k, score) for score, k in sorted(found, reverse=True)]
+
+
+class PrefixIndex:
+    """
+    Every quote's identifier and submitter, sorted (ignoring case), so those starting with some text are bisected to.
+
+    Rebuilt whenever the quotes change, as sorting them again is cheap next to a refresh.
+    """
+
+    def __init__(self, quotes: Mapping[str, "Quote"] | None = None) -> None:
+        """Sort the identifiers and submitters of the given quotes."""
+        by_identifier = sorted((k.casefold(), k) for k in (quotes or {}))
+        by_submitter = sorted((q.submitter.casefold(), k) for k, q in (quotes or {}).items())
+        self._identifier_keys = [key for key, _ in by_identifier]
+        "Each identifier, ignoring case, sorted."
+        self._identifiers = [k for _, k in by_identifier]
+        "The identifier for each of _identifier_keys."
+        self._submitter_keys = [key for key, _ in by_submitter]
+        "Each quote's submitter, ignoring case, sorted."
+        self._submitted = [k for _, k in by_submitter]
+        "The identifier for each of _submitter_keys."
+
+    def __len__(self) -> int:
+        """How many quotes are indexed?"""
+        return len(self._identifiers)
+
+    @staticmethod
+    def _starting(keys: list[str], values: list[str], prefix: str) -> Iterator[str]:
+        """The values whose keys start with prefix, in order."""
+        for i in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix):
+                return
+            yield values[i]
+
+    def complete(self, prefix: str, limit: int = AUTOCOMPLETE_RESULTS) -> list[str]:
+        """
+        Finds the quotes whose identifier, or failing that, submitter, starts with prefix (ignoring case).
+
+        :returns: Up to limit identifiers, those matched by identifier first, each in sorted order.
+        :rtype: list[str]
+        """
+        prefix = prefix.casefold()
+        matches = itertools.chain(
+            self._starting(self._identifier_keys, self._identifiers, prefix),
+            self._starting(self._submitter_keys, self._submitted, prefix),
+        )
+        found: dict[str, None] = {}
+        for k in matches:
+            if len(found) >= limit:
+                break
+            found.setdefault(k)
+        return list(found)
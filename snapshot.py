@@ -0,0 +1,334 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`snapshot.py` keeps a memory-mapped, columnar copy of the quotes, so starting up needs no TOML at all.
+
+Each text column (identifier, submitter, quote, attribution, source) is one UTF-8 blob with an array of offsets,
+`None` and `embed` are bitsets, and a sorted index over the identifiers lets us find a quote without building a dict.
+Nothing is decoded until it is asked for, so startup and memory stay flat however many quotes there are.
+"""
+
+import contextlib
+import hashlib
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from pathlib import Path
+from typing import Any, NamedTuple
+
+MAGIC = b"SWQS"
+"What every snapshot starts with."
+
+VERSION = 1
+"Which layout the snapshot uses, bumped whenever it changes."
+
+HEADER = struct.Struct("<4sII16sQQ")
+"Magic, version, how many quotes, and the digest, size, and modification time of the TOML it was made from."
+
+TEXT_COLUMNS = ("identifier", "submitter", "quote", "attribution", "source")
+"The columns stored as a UTF-8 blob with offsets, in the order of `Quote` (after the identifier)."
+
+SECTIONS = (
+    *(f"{column}.{part}" for column in TEXT_COLUMNS for part in ("offsets", "blob")),
+    "attribution.present",
+    "source.present",
+    "embed",
+    "table_digests",
+    "order",
+    "duds",
+)
+"Every section of a snapshot, in the order of its directory of (offset, length) pairs."
+
+DIRECTORY = struct.Struct(f"<{2 * len(SECTIONS)}Q")
+"Where each section starts, and how long it is."
+
+DIGEST_SIZE = 16
+"How long each digest is, see `content_digest()`."
+
+
+class Row(NamedTuple):
+    """Everything we keep for a single quote, the fields after `identifier` are exactly those of a `Quote`."""
+
+    identifier: str
+    submitter: str
+    quote: str
+    attribution: str | None
+    source: str | None
+    embed: bool
+    table_digest: bytes | None
+
+
+def content_digest(text: str | bytes) -> bytes:
+    """
+    Hashes some text, such as a quote file or a single table from one, so we can tell if it has changed.
+
+    :returns: A 128-bit BLAKE2b digest of the (UTF-8) text.
+    :rtype: bytes
+    """
+    return hashlib.blake2b(text.encode("utf8") if isinstance(text, str) else text, digest_size=DIGEST_SIZE).digest()
+
+
+def _bitset(bits: Sequence[bool]) -> bytes:
+    """Packs booleans into a little-endian bitset."""
+    packed = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            packed[i >> 3] |= 1 << (i & 7)
+    return bytes(packed)
+
+
+def write_snapshot(path: Path, source: Path, digest: bytes, rows: Iterable[Row], duds: str = "") -> None:
+    """
+    Writes a snapshot of the given quotes to path, replacing any snapshot already there.
+
+    :param source: The TOML the quotes were loaded from, we note its size and modification time.
+    :param digest: The `content_digest()` of source, so we can tell when the snapshot is stale.
+    :param duds: Any not-quite quotes, as TOML, we keep them verbatim.
+    """
+    rows = list(rows)
+    texts = {column: [] for column in TEXT_COLUMNS}
+    for row in rows:
+        for column in TEXT_COLUMNS:
+            texts[column].append((getattr(row, column) or "").encode("utf8"))
+
+    sections: dict[str, bytes] = {}
+    for column, encoded in texts.items():
+        offsets = array("Q", [0])
+        for text in encoded:
+            offsets.append(offsets[-1] + len(text))
+        sections[f"{column}.offsets"] = offsets.tobytes()
+        sections[f"{column}.blob"] = b"".join(encoded)
+    sections["attribution.present"] = _bitset([row.attribution is not None for row in rows])
+    sections["source.present"] = _bitset([row.source is not None for row in rows])
+    sections["embed"] = _bitset([row.embed for row in rows])
+    sections["table_digests"] = b"".join(row.table_digest or bytes(DIGEST_SIZE) for row in rows)
+    sections["order"] = array("I", sorted(range(len(rows)), key=texts["identifier"].__getitem__)).tobytes()
+    sections["duds"] = duds.encode("utf8")
+
+    directory, body, offset = [], bytearray(), HEADER.size + DIRECTORY.size
+    for name in SECTIONS:
+        padding = -(offset + len(body)) % 8  # Keep every section aligned for its array
+        body += bytes(padding)
+        directory += [offset + len(body), len(sections[name])]
+        body += sections[name]
+
+    stat = source.stat()
+    partial = path.with_suffix(f"{path.suffix}.partial")
+    with partial.open("wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(rows), digest, stat.st_size, stat.st_mtime_ns))
+        f.write(DIRECTORY.pack(*directory))
+        f.write(body)
+    partial.replace(path)
+
+
+class Snapshot:
+    """A read-only, memory-mapped snapshot, decoding only the parts of it we use."""
+
+    def __init__(self, mapped: mmap.mmap, make: Callable[[Sequence[Any]], Any]) -> None:
+        """Read the header and directory of a mapped snapshot, `make` turns the fields of a `Quote` into one."""
+        self._mmap = mapped
+        view = memoryview(mapped)
+        _, _, self._count, self.digest, _, _ = HEADER.unpack_from(view)
+        bounds = iter(DIRECTORY.unpack_from(view, HEADER.size))
+        sections = zip(SECTIONS, bounds, bounds, strict=True)
+        self._sections = {name: view[start : start + length] for name, start, length in sections}
+        self._offsets = {column: self._sections[f"{column}.offsets"].cast("Q") for column in TEXT_COLUMNS}
+        self._order = self._sections["order"].cast("I")
+        self._make = make
+
+    def __len__(self) -> int:
+        """How many quotes are in the snapshot?"""
+        return self._count
+
+    def _text(self, column: str, i: int) -> str:
+        """Decode the text of the column for the i-th (0-based) quote."""
+        offsets = self._offsets[column]
+        return str(self._sections[f"{column}.blob"][offsets[i] : offsets[i + 1]], "utf8")
+
+    def _bit(self, section: str, i: int) -> bool:
+        """Test the bit of the section for the i-th (0-based) quote."""
+        return bool(self._sections[section][i >> 3] & (1 << (i & 7)))
+
+    def identifier(self, i: int) -> str:
+        """The identifier of the i-th (0-based) quote."""
+        return self._text("identifier", i)
+
+    def quote(self, i: int) -> Any:
+        """Build the i-th (0-based) quote."""
+        return self._make(
+            (
+                self._text("submitter", i),
+                self._text("quote", i),
+                self._text("attribution", i) if self._bit("attribution.present", i) else None,
+                self._text("source", i) if self._bit("source.present", i) else None,
+                self._bit("embed", i),
+            )
+        )
+
+    def table_digest(self, i: int) -> bytes | None:
+        """The table digest of the i-th (0-based) quote, if it had one."""
+        digest = bytes(self._sections["table_digests"][i * DIGEST_SIZE : (i + 1) * DIGEST_SIZE])
+        return digest if any(digest) else None
+
+    def digests(self) -> Iterator[tuple[str, bytes | None]]:
+        """
+        Decodes every identifier and table digest, reading each section once rather than a quote at a time.
+
+        :returns: Each identifier, in order, with its table digest, if it had one.
+        :rtype: Iterator[tuple[str, Optional[bytes]]]
+        """
+        offsets, blob = self._offsets["identifier"].tolist(), self._sections["identifier.blob"].tobytes()
+        digests, missing = self._sections["table_digests"].tobytes(), bytes(DIGEST_SIZE)
+        for i in range(self._count):
+            digest = digests[i * DIGEST_SIZE : (i + 1) * DIGEST_SIZE]
+            yield str(blob[offsets[i] : offsets[i + 1]], "utf8"), digest if digest != missing else None
+
+    def find(self, identifier: str) -> int | None:
+        """
+        Binary search the sorted identifiers for a quote.
+
+        :returns: The index (0-based) of the quote with this identifier, if there is one.
+        :rtype: Optional[int]
+        """
+        target = identifier.encode("utf8")
+        offsets, blob = self._offsets["identifier"], self._sections["identifier.blob"]
+        by_order = _SortedIdentifiers(self._order, offsets, blob)
+        at = bisect_left(by_order, target)
+        if at < self._count and by_order[at] == target:
+            return self._order[at]
+        return None
+
+    @property
+    def duds(self) -> str:
+        """The not-quite quotes that came with this snapshot, as TOML."""
+        return str(self._sections["duds"], "utf8")
+
+    @property
+    def identifiers(self) -> Sequence[str]:
+        """Position - 1 -> identifier."""
+        return _Column(self, self.identifier)
+
+    @property
+    def quotes(self) -> Sequence[Any]:
+        """Position - 1 -> Quote."""
+        return _Column(self, self.quote)
+
+    @property
+    def positions(self) -> Mapping[str, int]:
+        """Identifier -> position."""
+        return _Positions(self)
+
+    @property
+    def table_digests(self) -> Mapping[str, bytes]:
+        """Identifier -> table digest."""
+        return _TableDigests(self)
+
+
+class _SortedIdentifiers(Sequence[bytes]):
+    """The encoded identifiers in sorted order, just enough of a Sequence to `bisect`."""
+
+    def __init__(self, order: memoryview, offsets: memoryview, blob: memoryview) -> None:
+        """Sort the identifiers by the given order."""
+        self._order, self._offsets, self._blob = order, offsets, blob
+
+    def __len__(self) -> int:
+        """How many identifiers are there?"""
+        return len(self._order)
+
+    def __getitem__(self, at: int) -> bytes:  # type: ignore[override]
+        """The at-th identifier in sorted order."""
+        i = self._order[at]
+        return self._blob[self._offsets[i] : self._offsets[i + 1]].tobytes()
+
+
+class _Column(Sequence[Any]):
+    """A lazily decoded column of a Snapshot."""
+
+    def __init__(self, snapshot: Snapshot, get: Callable[[int], Any]) -> None:
+        """A column of the snapshot, decoded by `get`."""
+        self._snapshot, self._get = snapshot, get
+
+    def __len__(self) -> int:
+        """How long is the column?"""
+        return len(self._snapshot)
+
+    def __getitem__(self, i: int) -> Any:  # type: ignore[override]
+        """Decode the i-th (0-based) entry."""
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return self._get(i % len(self))
+
+
+class _Positions(Mapping[str, int]):
+    """Identifier -> 1-based position, found by binary search."""
+
+    def __init__(self, snapshot: Snapshot) -> None:
+        """Positions of the quotes in the snapshot."""
+        self._snapshot = snapshot
+
+    def __getitem__(self, identifier: str) -> int:
+        """Find the position of a quote."""
+        if (i := self._snapshot.find(identifier)) is None:
+            raise KeyError(identifier)
+        return i + 1
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the identifiers, in order."""
+        return iter(self._snapshot.identifiers)
+
+    def __len__(self) -> int:
+        """How many quotes are there?"""
+        return len(self._snapshot)
+
+
+class _TableDigests(Mapping[str, bytes]):
+    """Identifier -> table digest, for those that have one."""
+
+    def __init__(self, snapshot: Snapshot) -> None:
+        """Table digests of the quotes in the snapshot."""
+        self._snapshot = snapshot
+
+    def __getitem__(self, identifier: str) -> bytes:
+        """Find the table digest of a quote."""
+        if (i := self._snapshot.find(identifier)) is None or (digest := self._snapshot.table_digest(i)) is None:
+            raise KeyError(identifier)
+        return digest
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the identifiers that have a table digest, in order."""
+        return (k for i, k in enumerate(self._snapshot.identifiers) if self._snapshot.table_digest(i) is not None)
+
+    def __len__(self) -> int:
+        """How many quotes have a table digest?"""
+        return sum(1 for _ in self)
+
+
+def open_snapshot(path: Path, source: Path, make: Callable[[Sequence[Any]], Any]) -> Snapshot | None:
+    """
+    Maps the snapshot at path into memory, if it is up to date with source.
+
+    We only hash source when its size or modification time have changed since the snapshot was made.
+    :returns: The snapshot, or None if it is missing, stale, or from another version.
+    :rtype: Optional[Snapshot]
+    """
+    try:
+        stat = source.stat()
+        with path.open("rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, _, digest, size, mtime_ns = HEADER.unpack_from(mapped)
+    except struct.error:
+        magic = None
+    if (
+        magic == MAGIC
+        and version == VERSION
+        and ((stat.st_size, stat.st_mtime_ns) == (size, mtime_ns) or content_digest(source.read_bytes()) == digest)
+    ):
+        return Snapshot(mapped, make)
+    with contextlib.suppress(BufferError):
+        mapped.close()
+    return None
@@ -0,0 +1,108 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`startup.py` keeps us quick to start, and measures how quick, for `python bot.py --profile-startup` and bench.py.
+
+Heavy dependencies we can do without (such as numpy) are only imported the first time they are needed,
+so starting up, or restarting after a crash, does not wait on them, and nor does each worker process we spawn.
+"""
+
+import contextlib
+import functools
+import subprocess
+import sys
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from types import ModuleType
+
+LOCAL_DIR = Path(__file__).parent.resolve()
+"Where this file and other files are placed."
+
+IMPORT_BUDGETS = {"quotes": 0.25, "bot": 1.0}
+"How long (in seconds) importing each of our modules may take, before `--profile-startup` (or bench.py) fails."
+
+IMPORT_SLOWEST = 8
+"How many of the slowest imports we report."
+
+
+@functools.cache
+def optional_numpy() -> ModuleType | None:
+    """
+    Imports numpy the first time we need it, as it is slow to import, and we only ever use it to go faster.
+
+    :returns: numpy, or None if we do not have it.
+    :rtype: ModuleType | None
+    """
+    with contextlib.suppress(ModuleNotFoundError):
+        import numpy as np  # noqa: PLC0415
+
+        return np
+    return None
+
+
+def import_times(module: str) -> tuple[float, list[tuple[str, float]]]:
+    """
+    Imports a module in a fresh interpreter, timing it as `python -X importtime` does.
+
+    :returns: How long (in seconds) the module took to import, and each module it imported itself, slowest first,
+        with how long it took (including everything it imported in turn).
+    :rtype: tuple[float, list[tuple[str, float]]]
+    """
+    stderr = subprocess.run(  # noqa: S603 - our own interpreter, importing one of our own modules
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=LOCAL_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    imported: list[tuple[str, float]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("| imported package"):
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # Each level is indented two more spaces, from one
+        if depth == 0 and name.strip() == module:
+            return int(cumulative) / 1e6, sorted(imported, key=lambda child: child[1], reverse=True)
+        if depth == 0:
+            imported = []  # Something imported before us, such as by site
+        elif depth == 1:
+            imported.append((name.strip(), int(cumulative) / 1e6))
+    msg = f"Importing {module} did not time it, was it already imported?"
+    raise RuntimeError(msg)
+
+
+class Phases:
+    """How long each phase of starting up took, in order."""
+
+    def __init__(self) -> None:
+        """No phases yet."""
+        self.durations: dict[str, float] = {}
+        "Phase -> how long (in seconds) it took."
+
+    @contextlib.contextmanager
+    def __call__(self, name: str) -> Iterator[None]:
+        """Times the block as the phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = time.perf_counter() - start
+
+
+def startup_report(phases: Phases) -> tuple[str, bool]:
+    """
+    Reports how long importing each of IMPORT_BUDGETS, and each phase of starting up, took.
+
+    :returns: The report, and whether every import was within budget.
+    :rtype: tuple[str, bool]
+    """
+    lines, within = [], True
+    for module, budget in IMPORT_BUDGETS.items():
+        took, imported = import_times(module)
+        within &= took <= budget
+        verdict = f"budget {budget * 1e3:.0f}ms" if took <= budget else f"OVER budget {budget * 1e3:.0f}ms"
+        lines.append(f"import {module:<18}{took * 1e3:>9.1f}ms ({verdict})")
+        lines.extend(f"  {name:<22}{child * 1e3:>9.1f}ms" for name, child in imported[:IMPORT_SLOWEST])
+    lines.extend(f"{name:<24}{took * 1e3:>9.1f}ms" for name, took in phases.durations.items())
+    return "\n".join(lines), within
@@ -0,0 +1,310 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`state.py` keeps track of each channel's deck and history of quotes sent, the duds and likely duplicates, and when
+our jobs last ran, in one SQLite database shared by every channel we serve.
+
+Every draw is a single transaction, so the deck and history can never disagree, even after a crash.
+The deck is a shuffled permutation with a cursor, so drawing just moves the cursor along, new quotes are swapped
+into random unread positions, and removed quotes are tombstoned, all without ever rebuilding the deck.
+"""
+
+import contextlib
+import json
+import random
+import sqlite3
+import threading
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from datetime import UTC, datetime
+from pathlib import Path
+
+MIGRATIONS = (
+    """
+    CREATE TABLE deck (quote_id TEXT PRIMARY KEY) WITHOUT ROWID;
+    CREATE TABLE history (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        quote_id TEXT NOT NULL,
+        shown_at TEXT
+    );
+    CREATE INDEX history_quote_id ON history (quote_id, seq);
+    CREATE TABLE duds (quote_id TEXT PRIMARY KEY, quote TEXT NOT NULL) WITHOUT ROWID;
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE deck_order (
+        pos INTEGER PRIMARY KEY,
+        quote_id TEXT NOT NULL,
+        removed INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX deck_order_quote_id ON deck_order (quote_id);
+    INSERT INTO deck_order (quote_id) SELECT quote_id FROM deck ORDER BY random();
+    INSERT INTO meta VALUES ('deck_cursor', 0);
+    DROP TABLE deck;
+    """,
+    """
+    CREATE TABLE added (quote_id TEXT PRIMARY KEY, added_at TEXT NOT NULL) WITHOUT ROWID;
+    CREATE INDEX history_shown_at ON history (quote_id, shown_at);
+    """,
+    """
+    CREATE TABLE jobs (name TEXT PRIMARY KEY, last_run TEXT NOT NULL) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE decks (
+        channel INTEGER NOT NULL,
+        pos INTEGER NOT NULL,
+        quote_id TEXT NOT NULL,
+        removed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (channel, pos)
+    ) WITHOUT ROWID;
+    INSERT INTO decks SELECT 0, pos, quote_id, removed FROM deck_order;
+    DROP TABLE deck_order;
+    CREATE TABLE cursors (channel INTEGER PRIMARY KEY, cursor INTEGER NOT NULL);
+    INSERT INTO cursors SELECT 0, value FROM meta WHERE key = 'deck_cursor';
+    DELETE FROM meta WHERE key = 'deck_cursor';
+    ALTER TABLE history ADD COLUMN channel INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX history_channel ON history (channel, seq);
+    """,
+    """
+    CREATE TABLE duplicates (
+        quote_id TEXT NOT NULL,
+        duplicate_of TEXT NOT NULL,
+        similarity REAL NOT NULL,
+        PRIMARY KEY (quote_id, duplicate_of)
+    ) WITHOUT ROWID;
+    """,
+)
+"Each step of the schema, the database's `user_version` is how many have been applied."
+
+DRAW_BATCH = 64
+"How many positions of the deck we read at a time while looking for a quote to draw."
+
+
+class QuoteState:
+    """
+    The decks, histories, and duds, safe to share between the event loop and its worker threads.
+
+    Decks and histories are per channel, channel 0 is the one we had before we served more than one, see `claim()`.
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        """Open (creating or upgrading as needed) the state database at path."""
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            (version,) = self._db.execute("PRAGMA user_version").fetchone()
+            for i, migration in enumerate(MIGRATIONS[version:], version + 1):
+                self._db.executescript(f"BEGIN; {migration.strip()} PRAGMA user_version = {i}; COMMIT;")
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+    def migrate_text_files(self, deck_path: Path, history_path: Path) -> bool:
+        """
+        Imports the deck and history from our old text files, exactly once.
+
+        The text files are left where they are, but are never read again.
+        :returns: Whether anything was imported.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'migrated_text_files'").fetchone():
+                return False
+            deck = deck_path.read_text(encoding="utf8").splitlines() if deck_path.is_file() else []
+            history = history_path.read_text(encoding="utf8").splitlines() if history_path.is_file() else []
+        deck = list(dict.fromkeys(k for k in deck if k))
+        random.shuffle(deck)
+        with self._writing() as db:
+            db.executemany("INSERT INTO decks (channel, pos, quote_id) VALUES (0, ?, ?)", enumerate(deck, 1))
+            db.execute("INSERT OR REPLACE INTO cursors VALUES (0, 0)")
+            db.executemany("INSERT INTO history (quote_id) VALUES (?)", ((k,) for k in history if k))
+            db.execute("INSERT INTO meta VALUES ('migrated_text_files', ?)", (datetime.now(UTC).isoformat(),))
+        return bool(deck or history)
+
+    @contextlib.contextmanager
+    def _writing(self) -> Iterator[sqlite3.Connection]:
+        """Hold the database for a single write transaction, rolled back if anything goes wrong."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _cursor(self, channel: int) -> int:
+        """The position of the last quote the channel drew, everything after it is unread."""
+        row = self._db.execute("SELECT cursor FROM cursors WHERE channel = ?", (channel,)).fetchone()
+        return row[0] if row else 0
+
+    def channels(self) -> list[int]:
+        """Every channel that has a deck."""
+        with self._lock:
+            return [channel for (channel,) in self._db.execute("SELECT channel FROM cursors ORDER BY channel")]
+
+    def claim(self, channel: int) -> bool:
+        """
+        Gives the deck and history of channel 0 (from before we served more than one channel) to a channel.
+
+        :returns: Whether there was anything to claim, a channel that already has a deck claims nothing.
+        :rtype: bool
+        """
+        with self._writing() as db:
+            if channel == 0 or db.execute("SELECT 1 FROM cursors WHERE channel = ?", (channel,)).fetchone():
+                return False
+            if not db.execute("SELECT 1 FROM cursors WHERE channel = 0").fetchone():
+                return False
+            for table in ("decks", "history", "cursors"):
+                db.execute(f"UPDATE {table} SET channel = ? WHERE channel = 0", (channel,))  # noqa: S608
+        return True
+
+    def deck(self, channel: int = 0) -> list[str]:
+        """The quotes the channel can use next, in the order we will get to them."""
+        with self._lock:
+            return [
+                k
+                for (k,) in self._db.execute(
+                    "SELECT quote_id FROM decks WHERE channel = ? AND pos > ? AND NOT removed ORDER BY pos",
+                    (channel, self._cursor(channel)),
+                )
+            ]
+
+    def recent(self, n: int, channel: int = 0) -> list[str]:
+        """The last n quotes that were sent to the channel, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT quote_id FROM history WHERE channel = ? ORDER BY seq DESC LIMIT ?", (channel, n)
+            ).fetchall()
+        return [k for (k,) in reversed(rows)]
+
+    def draw(self, usable: Callable[[str], bool], channel: int = 0) -> str | None:
+        """
+        Draws the next usable quote from the channel's deck, and logs its appearance, all at once.
+
+        Any unusable quotes we pass over are used up, just as though they had been drawn.
+        :returns: The quote drawn, or None if the deck has run out.
+        :rtype: Optional[str]
+        """
+        with self._writing() as db:
+            cursor, drawn = self._cursor(channel), None
+            while drawn is None:
+                batch = db.execute(
+                    "SELECT pos, quote_id FROM decks WHERE channel = ? AND pos > ? AND NOT removed"
+                    " ORDER BY pos LIMIT ?",
+                    (channel, cursor, DRAW_BATCH),
+                ).fetchall()
+                if not batch:
+                    break
+                for cursor, quote_id in batch:  # noqa: B007
+                    if usable(quote_id):
+                        drawn = quote_id
+                        break
+            db.execute("INSERT OR REPLACE INTO cursors VALUES (?, ?)", (channel, cursor))
+            if drawn is not None:
+                db.execute(
+                    "INSERT INTO history (quote_id, shown_at, channel) VALUES (?, ?, ?)",
+                    (drawn, datetime.now(UTC).isoformat(), channel),
+                )
+        return drawn
+
+    def record(self, quote_id: str, channel: int = 0) -> None:
+        """Log the appearance of a quote that was chosen without the deck."""
+        with self._writing() as db:
+            db.execute(
+                "INSERT INTO history (quote_id, shown_at, channel) VALUES (?, ?, ?)",
+                (quote_id, datetime.now(UTC).isoformat(), channel),
+            )
+
+    def last_shown(self) -> dict[str, datetime]:
+        """When each quote was last sent, to any channel, for those we know."""
+        with self._lock:
+            rows = self._db.execute("SELECT quote_id, max(shown_at) FROM history GROUP BY quote_id").fetchall()
+        return {k: datetime.fromisoformat(shown_at) for k, shown_at in rows if shown_at is not None}
+
+    def added_since(self, since: datetime) -> set[str]:
+        """Which quotes were added by a refresh after the given time."""
+        with self._lock:
+            rows = self._db.execute("SELECT quote_id FROM added WHERE added_at > ?", (since.isoformat(),))
+            return {k for (k,) in rows}
+
+    def deal(self, quote_ids: Iterable[str], channel: int = 0) -> None:
+        """Replace the channel's deck with a fresh shuffle of the given quotes."""
+        deck = list(quote_ids)
+        random.shuffle(deck)
+        with self._writing() as db:
+            db.execute("DELETE FROM decks WHERE channel = ?", (channel,))
+            db.executemany(
+                "INSERT INTO decks (channel, pos, quote_id) VALUES (?, ?, ?)",
+                ((channel, pos, k) for pos, k in enumerate(deck, 1)),
+            )
+            db.execute("INSERT OR REPLACE INTO cursors VALUES (?, 0)", (channel,))
+
+    def update_deck(self, additions: Iterable[str] = (), removals: Iterable[str] = ()) -> None:
+        """
+        Tombstone any unread quotes that were removed, and swap each addition into a random unread position.
+
+        Every channel's deck is updated, as they all share the same quotes.
+        """
+        additions, removals = list(additions), list(removals)
+        with self._writing() as db:
+            now = datetime.now(UTC).isoformat()
+            db.executemany("INSERT OR REPLACE INTO added VALUES (?, ?)", ((k, now) for k in additions))
+            if removals:  # One pass over every deck, rather than indexing them all by quote, keeps dealing cheap
+                db.execute(
+                    "UPDATE decks SET removed = 1 WHERE quote_id IN (SELECT value FROM json_each(?)) AND pos > "
+                    "(SELECT cursor FROM cursors WHERE cursors.channel = decks.channel)",
+                    (json.dumps(removals),),
+                )
+            for channel, cursor in db.execute("SELECT channel, cursor FROM cursors").fetchall():
+                (last,) = db.execute("SELECT coalesce(max(pos), 0) FROM decks WHERE channel = ?", (channel,)).fetchone()
+                last = max(last, cursor)
+                for quote_id in additions:
+                    last += 1
+                    swap = random.randint(cursor + 1, last)
+                    db.execute("UPDATE decks SET pos = ? WHERE channel = ? AND pos = ?", (last, channel, swap))
+                    db.execute("INSERT INTO decks (channel, pos, quote_id) VALUES (?, ?, ?)", (channel, swap, quote_id))
+
+    def last_runs(self) -> dict[str, datetime]:
+        """When each job last ran, for those that have."""
+        with self._lock:
+            rows = self._db.execute("SELECT name, last_run FROM jobs").fetchall()
+        return {name: datetime.fromisoformat(last_run) for name, last_run in rows}
+
+    def set_last_runs(self, runs: Mapping[str, datetime]) -> None:
+        """Note when the named jobs last ran."""
+        with self._writing() as db:
+            rows = ((name, when.isoformat()) for name, when in runs.items())
+            db.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?)", rows)
+
+    def duds(self) -> dict[str, str]:
+        """The not-quite quotes, as identifier -> TOML."""
+        with self._lock:
+            return dict(self._db.execute("SELECT quote_id, quote FROM duds ORDER BY quote_id"))
+
+    def set_duds(self, duds: dict[str, str]) -> None:
+        """Replace the not-quite quotes, given as identifier -> TOML."""
+        with self._writing() as db:
+            db.execute("DELETE FROM duds")
+            db.executemany("INSERT INTO duds VALUES (?, ?)", duds.items())
+
+    def duplicates(self) -> list[tuple[str, str, float]]:
+        """The quotes that look a lot like another, as (identifier, identifier of the other, similarity)."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT quote_id, duplicate_of, similarity FROM duplicates ORDER BY quote_id, similarity DESC"
+            ).fetchall()
+
+    def update_duplicates(self, found: Iterable[tuple[str, str, float]], forget: Iterable[str] = ()) -> None:
+        """Forget any duplicates involving the given quotes (which have changed or gone), then add those found."""
+        with self._writing() as db:
+            if forget := list(forget):
+                db.execute(
+                    "DELETE FROM duplicates WHERE quote_id IN (SELECT value FROM json_each(?1)) "
+                    "OR duplicate_of IN (SELECT value FROM json_each(?1))",
+                    (json.dumps(forget),),
+                )
+            db.executemany("INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?)", found)
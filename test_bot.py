@@ -0,0 +1,93 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`test_bot.py` checks how `bot.py` plans each day, without connecting to Discord.
+"""
+
+import asyncio
+from datetime import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+import tomli_w
+
+import bot
+import quotes
+from bench import isolated_quotes
+from bot import ChannelConfig, QuotePost, daily_jobs, send_quote
+
+
+def test_posts_after_refresh() -> None:
+    """Every channel's posts are after the refresh for its posting time, so they wait for it when caught up."""
+    configs = {1: ChannelConfig(1, time(0), duds=True), 2: ChannelConfig(2, time(12)), 3: ChannelConfig(3, time(12))}
+    jobs = {job.name: job for job in daily_jobs(configs)}
+    for channel, config in configs.items():
+        refresh = f"refresh@{config.quote_at.isoformat()}"
+        assert jobs[f"quote:{channel}"].after == (refresh,)
+    assert jobs["dud_report:1"].after == ("refresh@00:00:00",)
+
+
+class ChannelStandIn:
+    """A local stand-in for a Discord channel, keeping whatever is sent to it."""
+
+    def __init__(self) -> None:
+        """Nothing sent yet."""
+        self.sent: list[dict[str, Any]] = []
+        "The keyword arguments of each send."
+
+    async def send(self, **message: Any) -> None:
+        """Keep the message, rather than sending it."""
+        self.sent.append(message)
+
+
+@pytest.mark.parametrize(
+    ("post", "footer"),
+    [
+        (QuotePost(1, "Re-rolled Quote", which="b"), "Re-rolled Quote for"),
+        (QuotePost(1, "Testing", "Testing the Swack", "b"), "Testing for"),
+    ],
+)
+def test_send_quote(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, post: QuotePost, footer: str) -> None:
+    """A post sends the quote it asked for, labelled as it asked."""
+    channel = ChannelStandIn()
+    monkeypatch.setattr(bot.client, "get_channel", lambda _: channel)
+    document = {k: {"submitter": "Someone", "quote": f"Quote {k}."} for k in "abc"}
+    with isolated_quotes(tmp_path):
+        quotes.QUOTE_FILE_PATH.write_text(tomli_w.dumps(document), encoding="utf8")
+        asyncio.run(send_quote(post, refresh=False))
+    (message,) = channel.sent
+    embed = message["embed"]
+    assert embed.description == "Quote b."
+    assert embed.footer.text.startswith(footer)
+    assert "Quote 2/3" in embed.footer.text
+    assert post.title is None or embed.title == post.title
+
+
+@pytest.mark.parametrize(
+    ("author", "content", "sent"),
+    [
+        (1, "#reroll", "embed"),
+        (2, "#reroll", None),
+        (2, "#repo", "content"),
+        (1, "#repo", "content"),
+        (2, "#search quote", "embed"),
+        (2, "#search", None),
+    ],
+)
+def test_on_message(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, author: int, content: str, sent: str | None
+) -> None:
+    """Admins can use every command, anyone else only those for everyone."""
+    channel = ChannelStandIn()
+    monkeypatch.setattr(bot.client, "get_channel", lambda _: channel)
+    monkeypatch.setattr(bot, "ADMINS", {1}, raising=False)
+    monkeypatch.setattr(bot, "CHANNELS", {7: ChannelConfig(7)}, raising=False)
+    message = SimpleNamespace(channel=SimpleNamespace(id=7), author=SimpleNamespace(id=author), content=content)
+    document = {k: {"submitter": "Someone", "quote": f"Quote {k}."} for k in "abc"}
+    with isolated_quotes(tmp_path):
+        quotes.QUOTE_FILE_PATH.write_text(tomli_w.dumps(document), encoding="utf8")
+        monkeypatch.setattr(quotes, "_revalidated_at", float("inf"))  # So a re-roll does not refresh from the repo
+        asyncio.run(bot.on_message(message))
+    assert [next(iter(message)) for message in channel.sent] == ([sent] if sent else [])
@@ -0,0 +1,32 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`test_duplicates.py` checks that `duplicates.py` spots quotes submitted again, and only those.
+"""
+
+import random
+
+from bench import resubmissions, synthetic_quote_dicts
+from duplicates import DuplicateIndex
+from quotes import Quote, QuoteDiff, QuoteStore
+
+
+def test_resubmissions_spotted() -> None:
+    """At least nine in ten resubmitted quotes are spotted as duplicates of the quote they were, as they are added."""
+    store = QuoteStore((k, Quote(**q)) for k, q in synthetic_quote_dicts(1_000, dud_rate=0).items())
+    resubmitted, unrelated = resubmissions(store, random.Random(0), every=4)
+    additions = [(k, q) for k, (_, _, q) in resubmitted.items()] + list(unrelated.items())
+    found = DuplicateIndex(store).apply(QuoteDiff(additions, [], []), {**store, **dict(additions)})
+    spotted = {(k, duplicate_of) for k, duplicate_of, _ in found}
+    missed = [(k, original, kind) for k, (original, kind, _) in resubmitted.items() if (k, original) not in spotted]
+    assert len(missed) <= len(resubmitted) // 10, f"Missed {len(missed)} of {len(resubmitted)}: {missed}"
+
+
+def test_removed_quotes_forgotten() -> None:
+    """A quote is spotted again with its punctuation and case changed, until it is removed."""
+    original = Quote("Someone", "Something worth saying, over and over and over again.")
+    again = original._replace(quote="Something worth saying... over and over, and OVER again!")
+    index = DuplicateIndex({"original": original})
+    assert [d.duplicate_of for d in index.duplicates("again", again, {"original": original})] == ["original"]
+    index.apply(QuoteDiff([], [("original", original)], []), {})
+    assert index.candidates(again) == set()
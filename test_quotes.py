@@ -0,0 +1,90 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`test_quotes.py` checks what `quotes.py` gives us, not how fast, which is for bench.py.
+
+Run these with `python -m pytest`, they use the same made-up quotes and stand-in repo as bench.py, so need no network.
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+
+import pytest
+import tomli_w
+
+import quotes
+from bench import QuoteFileStandIn, count_transfers, isolated_quotes, synthetic_quote_dicts, synthetic_quotes_toml
+from quotes import PARSE_CHUNK_TABLES, QuoteStore, as_quotes, parse_quotes, refresh_quotes
+
+
+def test_refresh_transfers(tmp_path: Path) -> None:
+    """A refresh is only sent (and only parses) the quotes when they have changed."""
+    text = synthetic_quotes_toml(100)
+    edited = text + tomli_w.dumps({f"new-{k}": q for k, q in synthetic_quote_dicts(1, 0, seed=1).items()})
+    with isolated_quotes(tmp_path):
+        quotes.QUOTE_FILE_PATH.write_text(text, encoding="utf8")
+        counts = asyncio.run(count_transfers(text, edited))
+    assert counts["unmodified"] == {"bytes": 0, "parses": 0}, "A 304 should cost nothing"
+    assert counts["resent"] == {"bytes": len(text.encode("utf8")), "parses": 0}, "The same quotes should not be parsed"
+    assert counts["edited"] == {"bytes": len(edited.encode("utf8")), "parses": 1}, "An edit should be parsed once"
+
+
+def test_refresh_failure_fetched_again(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """A refresh that fails before it has kept the new quotes leaves the next one to fetch them again, not a 304."""
+    text = synthetic_quotes_toml(20, dud_rate=0)
+    edited = text + tomli_w.dumps({"new": {"submitter": "Someone", "quote": "Something new."}})
+
+    def unwritable(*_: object) -> None:
+        """As if the disk were full."""
+        msg = "No space left on device"
+        raise OSError(msg)
+
+    async def refresh_twice() -> QuoteStore:
+        """Refresh to the edit, failing on the snapshot the first time."""
+        async with QuoteFileStandIn(text) as repo:
+            quotes.QUOTE_FILE_ADDRESS = repo.address
+            await refresh_quotes()  # Now we have the ETag of what we have
+            repo.text = edited
+            with monkeypatch.context() as patched:
+                patched.setattr(quotes, "save_snapshot", unwritable)
+                with pytest.raises(OSError, match="No space"):
+                    await refresh_quotes()
+            current = await refresh_quotes()
+            await quotes.close_http_session()
+        return current
+
+    with isolated_quotes(tmp_path):
+        quotes.QUOTE_FILE_PATH.write_text(text, encoding="utf8")
+        assert "new" in asyncio.run(refresh_twice())
+
+
+@pytest.mark.parametrize("workers", [0, 2], ids=["inline", "parallel"])
+def test_parse_quotes(workers: int) -> None:
+    """Parsing a table at a time, in this process or across workers, gives exactly what `as_quotes()` does."""
+    logger = logging.getLogger("test_parse_quotes")
+    text = synthetic_quotes_toml(3 * PARSE_CHUNK_TABLES + 1, dud_rate=0.01)  # Enough chunks to start the workers
+    expected, expected_duds = as_quotes(text, logger)
+    parsed, duds = parse_quotes(text, logger, workers)
+    assert list(parsed.items()) == list(expected.items())
+    assert duds == expected_duds
+    assert [parsed.table_digest(k) for k in parsed] == [expected.table_digest(k) for k in expected]
+
+
+SOMETHING = '[a]\nsubmitter = "Someone"\nquote = "Something."\n\n'
+"A quote, as its own table."
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        f"version = 2\n\n{SOMETHING}",
+        f'{SOMETHING}[b]\nsubmitter = "Someone"\nquote = "Else."\n\n[a.x]\ny = 1\n',
+        f'{SOMETHING}[b]\nsubmitter = "Someone"\n\n[b.quote]\nx = 1\n',
+    ],
+    ids=["preamble", "redefined", "split"],
+)
+def test_parse_quotes_unsplittable(text: str) -> None:
+    """Quotes that cannot be parsed a table at a time are parsed as a whole, as `as_quotes()` does."""
+    logger = logging.getLogger("test_parse_quotes")
+    assert parse_quotes(text, logger, 0) == as_quotes(text, logger)
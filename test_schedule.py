@@ -0,0 +1,67 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`test_schedule.py` checks that `schedule.py` runs each job when it is due, and never skips one.
+"""
+
+import asyncio
+import functools
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+from schedule import Job, Scheduler
+from state import QuoteState
+
+
+async def run_for(scheduler: Scheduler, seconds: float) -> None:
+    """Runs the scheduler for a while, then stops it."""
+    running = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(seconds)
+    running.cancel()
+
+
+def test_jobs_due_while_running(tmp_path: Path) -> None:
+    """A job that comes due while another is still running is run straight after, rather than skipped for the day."""
+    ran = []
+
+    async def job(name: str, takes: float) -> None:
+        """Note that we ran, then take a while about it."""
+        ran.append(name)
+        await asyncio.sleep(takes)
+
+    start = datetime.now(UTC)
+    jobs = [
+        Job("slow", (start + timedelta(seconds=0.2)).time(), functools.partial(job, "slow", 0.3), group="slow"),
+        Job("next", (start + timedelta(seconds=0.3)).time(), functools.partial(job, "next", 0), group="next"),
+    ]
+    state = QuoteState(tmp_path / "quote_state.sqlite3")
+    try:
+        asyncio.run(run_for(Scheduler(state, jobs), 1))
+    finally:
+        state.close()
+    assert ran == ["slow", "next"]
+
+
+def test_jobs_after(tmp_path: Path) -> None:
+    """Jobs caught up together run after the jobs they are after, even in other groups."""
+    ran = []
+
+    async def job(name: str, takes: float) -> None:
+        """Take a while, then note that we ran."""
+        await asyncio.sleep(takes)
+        ran.append(name)
+
+    now = datetime.now(UTC)
+    refresh_at, post_at = (now - timedelta(minutes=2)).time(), (now - timedelta(minutes=1)).time()
+    jobs = [Job("refresh", refresh_at, functools.partial(job, "refresh", 0.2))]
+    jobs += [
+        Job(f"quote:{c}", post_at, functools.partial(job, f"quote:{c}", 0), group=c, after=("refresh",))
+        for c in range(3)
+    ]
+    state = QuoteState(tmp_path / "quote_state.sqlite3")
+    try:
+        state.set_last_runs({job.name: now - timedelta(days=1) for job in jobs})  # We were down when they were due
+        asyncio.run(Scheduler(state, jobs, concurrency=1).run_due(now))
+    finally:
+        state.close()
+    assert ran == ["refresh", "quote:0", "quote:1", "quote:2"]
@@ -0,0 +1,41 @@
+"""
+A polite little Discord bot that can send out a quote each day.
+
+`test_startup.py` checks that starting up leaves heavy dependencies until they are needed, see `startup.py`.
+
+How long starting up takes, against IMPORT_BUDGETS, is for bench.py (and `python bot.py --profile-startup`).
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+from startup import IMPORT_BUDGETS, LOCAL_DIR, optional_numpy
+
+DEFERRED = {"numpy", "matplotlib"}
+"What none of our modules should import just by being imported."
+
+
+@pytest.mark.parametrize("module", list(IMPORT_BUDGETS))
+def test_imports_deferred(module: str) -> None:
+    """Importing each of IMPORT_BUDGETS, in a fresh interpreter, imports none of DEFERRED."""
+    check = f"import sys, {module}; print(*{{name.partition('.')[0] for name in sys.modules}})"
+    imported = subprocess.run(  # noqa: S603 - our own interpreter, running our own check
+        [sys.executable, "-c", check],
+        cwd=LOCAL_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert DEFERRED.isdisjoint(imported), f"Importing {module} imported {sorted(DEFERRED.intersection(imported))}"
+
+
+def test_optional_numpy_missing(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Without numpy, `optional_numpy()` gives None, so we fall back to plain Python."""
+    monkeypatch.setitem(sys.modules, "numpy", None)  # As if it were not installed
+    optional_numpy.cache_clear()
+    try:
+        assert optional_numpy() is None
+    finally:
+        optional_numpy.cache_clear()